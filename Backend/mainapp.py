@@ -1,4 +1,5 @@
 from flask import Flask
+import click
 from flask_cors import CORS
 from config import config
 import os
@@ -102,27 +103,39 @@ def create_app(config_name=None):
     # Enhanced health check with service status
     @app.route("/api/health/detailed")
     def detailed_health_check():
-        from utils.auth import get_firebase_app
         from utils.firestore_db import get_firestore_db
         from utils.storage import get_storage
+        from utils.resilience import circuit_states, get_dependency
+        import time
 
         services = {}
         overall_status = "healthy"
 
         # Check Firebase
         try:
+            from utils.auth import get_firebase_app
+
             firebase_app = get_firebase_app()
             services["firebase"] = "connected" if firebase_app else "disconnected"
         except Exception as e:
             services["firebase"] = f"error: {str(e)}"
             overall_status = "degraded"
 
-        # Check Firestore
+        # Check Firestore: the circuit breaker already sees every request, so
+        # only probe when it has no recent evidence either way
         try:
             firestore_db = get_firestore_db()
-            # Try a simple operation
-            firestore_db.get_all_notes(limit=1)
-            services["firestore"] = "connected"
+            breaker = get_dependency("firestore").breaker
+            recent = max(breaker.last_success_at or 0, breaker.last_failure_at or 0)
+            if breaker.state == "closed" and time.time() - recent > 30:
+                firestore_db.get_all_notes(limit=1)
+            services["firestore"] = {
+                "closed": "connected",
+                "half_open": "recovering",
+                "open": "unavailable (circuit open)",
+            }[breaker.state]
+            if breaker.state != "closed":
+                overall_status = "degraded"
         except Exception as e:
             services["firestore"] = f"error: {str(e)}"
             overall_status = "degraded"
@@ -135,13 +148,35 @@ def create_app(config_name=None):
             services["storage"] = f"error: {str(e)}"
             overall_status = "degraded"
 
+        circuits = circuit_states()
+        if "open" in circuits.values():
+            overall_status = "degraded"
+
         return {
             "status": overall_status,
             "message": f"Notes API is {overall_status}",
             "services": services,
+            "circuits": circuits,
             "timestamp": app.config.get("START_TIME", "unknown"),
         }, (200 if overall_status == "healthy" else 503)
 
+    # Runtime metrics (cache hit rates, index sizes, ...); admins only, they
+    # expose file paths, queue errors and backend endpoints
+    @app.route("/api/health/metrics")
+    def health_metrics():
+        import datetime
+        from utils.auth import require_admin
+        from utils.metrics import collect_metrics
+
+        @require_admin
+        def _health_metrics(current_user):
+            return {
+                "metrics": collect_metrics(),
+                "timestamp": datetime.datetime.now().isoformat(),
+            }, 200
+
+        return _health_metrics()
+
     # Test authentication endpoint
     @app.route("/api/test-auth")
     def test_auth():
@@ -227,11 +262,13 @@ def create_app(config_name=None):
             "endpoints": {
                 "health": "/health",
                 "detailed_health": "/api/health/detailed",
+                "metrics": "/api/health/metrics",
                 "upload": "/api/files/upload",
                 "notes": "/api/files/notes",
                 "download": "/api/files/download/<note_id>",
                 "my_notes": "/api/files/my-notes",
                 "search": "/api/files/search",
+                "suggest": "/api/files/suggest",
                 "stats": "/api/files/stats",
                 "subjects": "/api/files/subjects",
                 "departments": "/api/files/departments",
@@ -271,6 +308,38 @@ def create_app(config_name=None):
             "code": "UNAUTHORIZED",
         }, 401
 
+    # Maintenance commands (run with `flask --app wsgi <command>`)
+    @app.cli.command("rebuild-facets")
+    def rebuild_facets_command():
+        """Backfill subject/department facet counts and download totals from the notes collection."""
+        from utils.firestore_db import get_firestore_db
+
+        facets = get_firestore_db().rebuild_facets()
+        print(
+            f"✅ Rebuilt facets: {len(facets['subjects'])} subjects, "
+            f"{len(facets['departments'])} departments"
+        )
+
+    @app.cli.command("refresh-catalog")
+    @click.option('--interval', default=30.0, show_default=True, help='Seconds between refreshes')
+    @click.option('--once', is_flag=True, help='Publish a single snapshot and exit')
+    def refresh_catalog_command(interval, once):
+        """Run the shared-memory note catalog refresher (one per host)."""
+        from utils.shared_catalog import run_catalog_refresher
+
+        print(f"✅ Publishing shared note catalog every {interval}s" if not once else "✅ Publishing shared note catalog")
+        run_catalog_refresher(interval=interval, once=once)
+
+    @app.cli.command("rollup-usage")
+    @click.option('--interval', default=3600.0, show_default=True, help='Seconds between rollups')
+    @click.option('--once', is_flag=True, help='Roll up once and exit')
+    def rollup_usage_command(interval, once):
+        """Roll hourly usage history up into daily and monthly documents (one per deployment)."""
+        from utils.usage_history import run_usage_rollup
+
+        print(f"✅ Rolling up usage history every {interval}s" if not once else "✅ Rolling up usage history")
+        run_usage_rollup(interval=interval, once=once)
+
     # Store start time for health checks
     import datetime
 
@@ -280,13 +349,16 @@ def create_app(config_name=None):
     print("📋 Available endpoints:")
     print("   • GET  /health - Basic health check")
     print("   • GET  /api/health/detailed - Detailed health check")
+    print("   • GET  /api/health/metrics - Cache and index metrics (admin)")
     print("   • GET  /api/info - API information")
     print("   • POST /api/files/upload - Upload file")
     print("   • GET  /api/files/notes - Get all notes")
     print("   • GET  /api/files/my-notes - Get user's notes")
     print("   • GET  /api/files/download/<id> - Download file")
     print("   • GET  /api/files/search - Search notes")
+    print("   • GET  /api/files/suggest - Autocomplete suggestions")
     print("   • GET  /api/files/stats - Get statistics")
+    print("   • GET  /api/files/usage/history - Usage series and projections (admin)")
 
     return app
 
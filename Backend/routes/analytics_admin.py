@@ -1,11 +1,17 @@
 # Backend/routes/analytics_admin.py
 from flask import Blueprint, request, jsonify, current_app
-from utils.auth import require_authentication
+from utils.auth import get_users_info, require_authentication
 from utils.analytics import AnalyticsDB
 from utils.firestore_db import get_firestore_db
 from utils.user_profiles import UserProfilesDB
 from utils.usage_db import track_usage, get_usage_tracker
 from utils.ratings_comments import RatingsCommentsDB
+from utils.fanout import fan_out
+from utils.singleflight import get_singleflight
+from utils.disk_cache import disk_cached
+from utils.degradation import DegradedUnavailable, degraded_response, get_degradation_policy, limit_admin_scans
+from utils.async_db import gather, get_async_notes_db, get_async_ratings_db, run_async
+import asyncio
 
 analytics_bp = Blueprint('analytics', __name__)
 
@@ -35,7 +41,9 @@ def get_popular_notes():
         limit = int(request.args.get('limit', 10))
         
         analytics_db = get_analytics_db()
-        popular_notes = analytics_db.get_popular_notes(days, limit)
+        popular_notes = get_degradation_policy().cached_or_compute(
+            ('popular', days, limit), lambda: analytics_db.get_popular_notes(days, limit)
+        )
         
         return jsonify({
             'popular_notes': popular_notes,
@@ -43,6 +51,8 @@ def get_popular_notes():
             'period_days': days
         }), 200
         
+    except DegradedUnavailable:
+        return degraded_response()
     except Exception as e:
         current_app.logger.error(f"Get popular notes error: {str(e)}")
         return jsonify({
@@ -58,7 +68,10 @@ def get_trending_notes():
         limit = int(request.args.get('limit', 5))
         
         firestore_db = get_firestore_db()
-        all_notes = firestore_db.get_all_notes(limit=100)
+        mirror = getattr(firestore_db, 'mirror', None)
+        all_notes = get_degradation_policy().cached_or_compute(
+            'trending', lambda: firestore_db.get_all_notes(limit=100), free=bool(mirror and mirror.is_healthy())
+        )
         
         # Sort by download count descending
         trending = sorted(all_notes, key=lambda x: x.get('download_count', 0), reverse=True)[:limit]
@@ -68,6 +81,8 @@ def get_trending_notes():
             'count': len(trending)
         }), 200
         
+    except DegradedUnavailable:
+        return degraded_response()
     except Exception as e:
         current_app.logger.error(f"Get trending notes error: {str(e)}")
         return jsonify({
@@ -81,13 +96,16 @@ def get_subject_stats():
     """Get statistics by subject"""
     try:
         analytics_db = get_analytics_db()
-        subject_stats = analytics_db.get_subject_statistics()
+        subject_stats = get_degradation_policy().cached_or_compute('subject_stats', lambda: get_singleflight(
+            'subject_stats').do('subjects', analytics_db.get_subject_statistics))
         
         return jsonify({
             'subjects': subject_stats,
             'count': len(subject_stats)
         }), 200
         
+    except DegradedUnavailable:
+        return degraded_response()
     except Exception as e:
         current_app.logger.error(f"Get subject stats error: {str(e)}")
         return jsonify({
@@ -101,13 +119,17 @@ def get_department_stats():
     """Get statistics by department"""
     try:
         analytics_db = get_analytics_db()
-        dept_stats = analytics_db.get_department_statistics()
+        dept_stats = get_degradation_policy().cached_or_compute(
+            'department_stats', analytics_db.get_department_statistics
+        )
         
         return jsonify({
             'departments': dept_stats,
             'count': len(dept_stats)
         }), 200
         
+    except DegradedUnavailable:
+        return degraded_response()
     except Exception as e:
         current_app.logger.error(f"Get department stats error: {str(e)}")
         return jsonify({
@@ -119,19 +141,24 @@ def get_department_stats():
 
 @analytics_bp.route('/admin/dashboard', methods=['GET'])
 @require_authentication
+@limit_admin_scans
 @track_usage('get_metadata')
 def get_admin_dashboard(current_user):
     """Get comprehensive admin dashboard statistics"""
     try:
         # Verify user is admin (you can implement admin check here)
         analytics_db = get_analytics_db()
-        stats = analytics_db.get_admin_dashboard_stats()
-        
-        # Add usage limits info
         tracker = get_usage_tracker()
-        usage_stats = tracker.get_usage_stats()
         
-        stats['usage_stats'] = usage_stats
+        # Dashboard aggregates and usage limits info are fetched concurrently,
+        # and admins loading the dashboard at the same time share one run
+        results = get_singleflight('admin_dashboard').do('dashboard', lambda: fan_out({
+            'stats': lambda: disk_cached('admin_dashboard', analytics_db.get_admin_dashboard_stats),
+            'usage_stats': tracker.get_usage_stats,
+        }, timeout=30))
+        
+        stats = dict(results['stats'])
+        stats['usage_stats'] = results['usage_stats']
         stats['timestamp'] = __import__('datetime').datetime.now().isoformat()
         
         return jsonify(stats), 200
@@ -145,6 +172,7 @@ def get_admin_dashboard(current_user):
 
 @analytics_bp.route('/admin/users', methods=['GET'])
 @require_authentication
+@limit_admin_scans
 @track_usage('get_metadata')
 def get_users_list(current_user):
     """Get list of users with stats"""
@@ -170,6 +198,13 @@ def get_users_list(current_user):
             user_stats[uploader]['downloads'] += note.get('download_count', 0)
             user_stats[uploader]['total_file_size'] += note.get('file_size', 0)
         
+        # Names and emails for every uploader in one batched, cached lookup
+        users_info = get_users_info(list(user_stats))
+        for user_id, stats in user_stats.items():
+            info = users_info.get(user_id) or {}
+            stats['display_name'] = info.get('display_name')
+            stats['email'] = info.get('email')
+        
         users_list = list(user_stats.values())
         
         return jsonify({
@@ -186,6 +221,7 @@ def get_users_list(current_user):
 
 @analytics_bp.route('/admin/notes', methods=['GET'])
 @require_authentication
+@limit_admin_scans
 @track_usage('get_metadata')
 def get_notes_list(current_user):
     """Get list of all notes with stats"""
@@ -202,6 +238,12 @@ def get_notes_list(current_user):
         elif sort_by == 'size':
             all_notes.sort(key=lambda x: x.get('file_size', 0), reverse=True)
         
+        if request.args.get('include_uploaders') == 'true':
+            users_info = get_users_info([note.get('uploaded_by') for note in all_notes])
+            for note in all_notes:
+                info = users_info.get(note.get('uploaded_by')) or {}
+                note['uploader_display_name'] = info.get('display_name')
+        
         return jsonify({
             'notes': all_notes,
             'count': len(all_notes),
@@ -217,6 +259,7 @@ def get_notes_list(current_user):
 
 @analytics_bp.route('/admin/content-moderation', methods=['GET'])
 @require_authentication
+@limit_admin_scans
 @track_usage('get_metadata')
 def get_flagged_content(current_user):
     """Get flagged content for moderation"""
@@ -228,16 +271,15 @@ def get_flagged_content(current_user):
         db = firestore.client()
         
         # Get flagged notes
-        flagged_docs = db.collection('flagged_content').stream()
-        flagged = []
+        flagged = [doc.to_dict() for doc in db.collection('flagged_content').stream()]
         
-        for doc in flagged_docs:
-            flag_data = doc.to_dict()
-            note_id = flag_data.get('note_id')
-            note = firestore_db.get_note(note_id)
+        # Attach the flagged notes with one batched lookup
+        notes = firestore_db.get_notes_many([flag.get('note_id') for flag in flagged])
+        notes_by_id = {note['id']: note for note in notes}
+        for flag_data in flagged:
+            note = notes_by_id.get(flag_data.get('note_id'))
             if note:
                 flag_data['note'] = note
-            flagged.append(flag_data)
         
         return jsonify({
             'flagged_content': flagged,
@@ -255,11 +297,17 @@ def get_flagged_content(current_user):
 
 @analytics_bp.route('/users/<user_id>/stats', methods=['GET'])
 @track_usage('get_metadata')
-def get_user_stats(user_id):
+async def get_user_stats(user_id):
     """Get statistics for a specific user"""
     try:
-        firestore_db = get_firestore_db()
-        user_notes = firestore_db.get_notes_by_user(user_id, limit=1000)
+        async_db = get_async_notes_db()
+        user_profiles_db = get_user_profiles_db()
+        
+        # The profile does not depend on the notes, so fetch both concurrently
+        user_notes, profile = await gather(
+            async_db.get_notes_by_user(user_id, limit=1000),
+            asyncio.to_thread(user_profiles_db.get_user_profile, user_id)
+        )
         
         total_downloads = sum(note.get('download_count', 0) for note in user_notes)
         total_size = sum(note.get('file_size', 0) for note in user_notes)
@@ -267,19 +315,19 @@ def get_user_stats(user_id):
         
         # Calculate average rating for all user's notes
         if user_notes:
-            ratings_db = get_ratings_db()
-            ratings_list = []
-            for note in user_notes:
-                rating_stats = ratings_db.get_note_ratings(note['id'])
-                if rating_stats['average'] > 0:
-                    ratings_list.append(rating_stats['average'])
+            async_ratings_db = get_async_ratings_db(get_ratings_db())
+            ratings_by_note = await run_async(
+                async_ratings_db.get_ratings_for_notes([note['id'] for note in user_notes])
+            )
+            ratings_list = [
+                rating_stats['average']
+                for rating_stats in ratings_by_note.values()
+                if rating_stats['average'] > 0
+            ]
             
             if ratings_list:
                 avg_rating = round(sum(ratings_list) / len(ratings_list), 2)
         
-        user_profiles_db = get_user_profiles_db()
-        profile = user_profiles_db.get_user_profile(user_id)
-        
         return jsonify({
             'user_id': user_id,
             'total_uploads': len(user_notes),
@@ -300,11 +348,18 @@ def get_user_stats(user_id):
 
 @analytics_bp.route('/notes/<note_id>/stats', methods=['GET'])
 @track_usage('get_metadata')
-def get_note_stats(note_id):
+async def get_note_stats(note_id):
     """Get statistics for a specific note"""
     try:
-        firestore_db = get_firestore_db()
-        note = firestore_db.get_note(note_id)
+        async_db = get_async_notes_db()
+        async_ratings_db = get_async_ratings_db(get_ratings_db())
+        
+        # Note, ratings and comment count are independent reads
+        note, ratings_stats, comments_count = await gather(
+            async_db.get_note(note_id),
+            async_ratings_db.get_note_ratings(note_id),
+            async_ratings_db.count_note_comments(note_id)
+        )
         
         if not note:
             return jsonify({
@@ -312,18 +367,13 @@ def get_note_stats(note_id):
                 'code': 'NOTE_NOT_FOUND'
             }), 404
         
-        ratings_db = get_ratings_db()
-        ratings_stats = ratings_db.get_note_ratings(note_id)
-        
-        comments = ratings_db.get_note_comments(note_id, limit=1000)
-        
         return jsonify({
             'note_id': note_id,
             'downloads': note.get('download_count', 0),
             'file_size_mb': round(note.get('file_size', 0) / (1024 * 1024), 2),
             'created_at': note.get('created_at'),
             'ratings': ratings_stats,
-            'comments_count': len(comments),
+            'comments_count': comments_count,
             'subject': note.get('subject'),
             'department': note.get('department')
         }), 200
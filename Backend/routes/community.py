@@ -8,6 +8,8 @@ from utils.firestore_db import get_firestore_db
 from utils.analytics import AnalyticsDB
 from utils.usage_db import track_usage
 from utils.security import ContentValidator, rate_limit
+from utils.async_db import gather, get_async_notes_db
+import asyncio
 
 community_bp = Blueprint('community', __name__)
 
@@ -66,7 +68,9 @@ def rate_note(current_user, note_id):
         analytics_db.track_action('rate', current_user['uid'], note_id, {'rating': rating})
         
         # Get updated ratings
-        ratings_stats = ratings_db.get_note_ratings(note_id)
+        ratings_stats = ratings_db.get_note_ratings(
+            note_id, own_rating={'user_id': current_user['uid'], 'rating': rating}
+        )
         
         return jsonify({
             'message': 'Rating added successfully',
@@ -109,7 +113,7 @@ def get_note_ratings(note_id):
 
 @community_bp.route('/notes/<note_id>/comments', methods=['POST'])
 @require_authentication
-@rate_limit(max_requests=50, window_seconds=3600)
+@rate_limit(max_requests=50, window_seconds=3600, per_user_max_requests=50)
 @track_usage('comment')
 def add_comment(current_user, note_id):
     """Add a comment to a note"""
@@ -242,11 +246,16 @@ def like_comment(comment_id):
 
 @community_bp.route('/users/<user_id>/profile', methods=['GET'])
 @track_usage('get_metadata')
-def get_user_profile(user_id):
+async def get_user_profile(user_id):
     """Get user profile"""
     try:
         user_profiles_db = get_user_profiles_db()
-        profile = user_profiles_db.get_user_profile(user_id)
+        
+        # Fetch the profile and the user's recent notes concurrently
+        profile, user_notes = await gather(
+            asyncio.to_thread(user_profiles_db.get_user_profile, user_id),
+            get_async_notes_db().get_notes_by_user(user_id, limit=10)
+        )
         
         if not profile:
             return jsonify({
@@ -254,9 +263,6 @@ def get_user_profile(user_id):
                 'code': 'USER_NOT_FOUND'
             }), 404
         
-        # Get user's notes
-        firestore_db = get_firestore_db()
-        user_notes = firestore_db.get_notes_by_user(user_id, limit=10)
         profile['recent_notes'] = user_notes
         
         return jsonify(profile), 200
@@ -390,13 +396,9 @@ def get_favorites(current_user):
         favorites_db = get_favorites_db()
         favorite_note_ids = favorites_db.get_user_favorites(current_user['uid'], limit)
         
-        # Get full note details
+        # Get full note details in batched round trips
         firestore_db = get_firestore_db()
-        favorites = []
-        for note_id in favorite_note_ids:
-            note = firestore_db.get_note(note_id)
-            if note:
-                favorites.append(note)
+        favorites = firestore_db.get_notes_many(favorite_note_ids)
         
         return jsonify({
             'favorites': favorites,
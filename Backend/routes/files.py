@@ -1,9 +1,18 @@
 from flask import Blueprint, request, jsonify, current_app
 from utils.helpers import allowed_file, get_file_size 
-from utils.auth import require_authentication, require_authentication_optional
+from utils.auth import require_admin, require_authentication, require_authentication_optional
 from utils.storage import get_storage 
 from utils.firestore_db import get_firestore_db
 from utils.usage_db import get_usage_tracker, track_usage
+from utils.usage_history import MAX_PERIODS
+from utils.operations import UsageLimitExceeded
+from utils.degradation import DegradedUnavailable, degraded_response, get_degradation_policy
+from utils.suggest import SUGGEST_FIELDS, get_suggest_index
+from utils.shared_catalog import get_shared_catalog
+from utils.query_cache import get_query_cache, make_query_key
+from utils.singleflight import get_singleflight
+from utils.disk_cache import disk_cached
+from utils.async_db import gather, get_async_notes_db, get_async_storage, run_async
 from werkzeug.utils import secure_filename
 
 files_bp = Blueprint('files', __name__)
@@ -97,6 +106,8 @@ def upload_file(current_user):
             'usage_stats': tracker.get_usage_stats()
         }), 201
         
+    except UsageLimitExceeded:
+        raise  # answered with 429 by track_usage
     except Exception as e:
         current_app.logger.error(f"Upload error: {str(e)}")
         print(f"❌ Upload error: {str(e)}")
@@ -116,17 +127,44 @@ def get_notes(current_user=None):
         my_notes_only = request.args.get('my_notes') == 'true'
         limit = int(request.args.get('limit', 100))
         
-        firestore_db = get_firestore_db()
-        
-        if my_notes_only and current_user:
-            # Get user's own notes
-            notes = firestore_db.get_notes_by_user(current_user['uid'], limit)
-        elif subject or department:
-            # Get filtered notes
-            notes = firestore_db.get_notes_by_filters(subject, department, limit)
-        else:
-            # Get all notes
-            notes = firestore_db.get_all_notes(limit)
+        uploaded_by = current_user['uid'] if my_notes_only and current_user else None
+        
+        # Serve from the cross-worker shared catalog when the refresher keeps it fresh
+        notes = None
+        catalog = get_shared_catalog()
+        if catalog is not None:
+            if uploaded_by:
+                notes = catalog.query(uploaded_by=uploaded_by, limit=limit)
+            else:
+                notes = catalog.query(subject=subject, department=department, limit=limit)
+        
+        policy = get_degradation_policy()
+        key = make_query_key(subject, department, uploaded_by, limit)
+        query_cache = get_query_cache()
+        if notes is None and query_cache is not None and policy.cache_only():
+            # Degraded: a cached listing of any age beats a query
+            notes = query_cache.peek(key)
+        
+        if notes is None:
+            firestore_db = get_firestore_db()
+            
+            def load_notes():
+                if uploaded_by:
+                    # Get user's own notes
+                    return firestore_db.get_notes_by_user(uploaded_by, limit)
+                elif subject or department:
+                    # Get filtered notes
+                    return firestore_db.get_notes_by_filters(subject, department, limit)
+                # Get all notes
+                return firestore_db.get_all_notes(limit)
+            
+            def load():
+                if query_cache is not None:
+                    return query_cache.get_or_load(key, load_notes)
+                return load_notes()
+            
+            mirror = getattr(firestore_db, 'mirror', None)
+            notes = policy.cached_or_compute(('notes', key), load, free=bool(mirror and mirror.is_healthy()))
         
         return jsonify({
             'notes': notes,
@@ -135,6 +173,8 @@ def get_notes(current_user=None):
             'user_id': current_user['uid'] if current_user else None
         }), 200
         
+    except DegradedUnavailable:
+        return degraded_response()
     except Exception as e:
         current_app.logger.error(f"Get notes error: {str(e)}")
         return jsonify({
@@ -144,12 +184,12 @@ def get_notes(current_user=None):
 
 @files_bp.route('/download/<note_id>', methods=['GET'])
 @track_usage('download')
-def download_file(note_id):
+async def download_file(note_id):
     """Download file directly from R2 storage"""
     try:
         # Get note metadata from Firestore
-        firestore_db = get_firestore_db()
-        note = firestore_db.get_note(note_id)
+        async_db = get_async_notes_db()
+        note = await run_async(async_db.get_note(note_id))
         
         if not note:
             return jsonify({
@@ -157,12 +197,32 @@ def download_file(note_id):
                 'code': 'NOTE_NOT_FOUND'
             }), 404
         
-        # Increment download count
-        firestore_db.increment_download_count(note_id)
-        
-        # Get file content from storage backend
-        storage = get_storage()
-        file_content = storage.get_file_content(note['file_key'])
+        from flask import Response, redirect
+        
+        # File keys are unique per upload, so the key identifies the content
+        policy = get_degradation_policy()
+        degraded = policy.redirect_downloads()
+        if degraded:
+            # Let clients reuse their copy, or fetch it from R2 without going through us
+            if request.if_none_match.contains(note['file_key']):
+                response = Response(status=304)
+                response.set_etag(note['file_key'])
+                return response
+            storage = get_storage()
+            if getattr(storage, 'supports_presigned_redirects', False):
+                url = storage.generate_presigned_url(note['file_key'], expiration=policy.download_cache_seconds)
+                if url:
+                    await run_async(async_db.increment_download_count(note_id, note))
+                    response = redirect(url, 302)
+                    response.cache_control.private = True
+                    response.cache_control.max_age = policy.download_cache_seconds
+                    return response
+        
+        # Increment download count while the file content is fetched from storage
+        _, file_content = await gather(
+            async_db.increment_download_count(note_id, note),
+            get_async_storage().get_file_content(note['file_key'])
+        )
         
         if not file_content:
             return jsonify({
@@ -170,8 +230,6 @@ def download_file(note_id):
                 'code': 'FILE_RETRIEVAL_ERROR'
             }), 500
         
-        from flask import Response
-        
         safe_filename = secure_filename(note["file_name"])
         
         response = Response(
@@ -182,9 +240,15 @@ def download_file(note_id):
                 'Content-Length': str(len(file_content))
             }
         )
+        response.set_etag(note['file_key'])
+        if degraded:
+            response.cache_control.private = True
+            response.cache_control.max_age = policy.download_cache_seconds
         
         return response
 
+    except UsageLimitExceeded:
+        raise  # answered with 429 by track_usage
     except Exception as e:
         current_app.logger.error(f"Download error: {str(e)}")
         return jsonify({
@@ -193,7 +257,7 @@ def download_file(note_id):
         }), 500
 
 @files_bp.route('/delete/<note_id>', methods=['DELETE'])
-@require_authentication
+@require_authentication(check_revoked=True)
 @track_usage('delete')
 def delete_note(current_user, note_id):
     """Delete note and associated file from R2"""
@@ -224,7 +288,7 @@ def delete_note(current_user, note_id):
         if not file_deleted:
             print(f"⚠️ Warning: Could not delete file from R2: {note['file_key']}")
         
-        metadata_deleted = db.delete_note(note_id)
+        metadata_deleted = db.delete_note(note_id, note)
 
         if not metadata_deleted:
             return jsonify({
@@ -256,13 +320,20 @@ def get_my_notes(current_user):
         limit = int(request.args.get('limit', 100))
         
         firestore_db = get_firestore_db()
-        notes = firestore_db.get_notes_by_user(current_user['uid'], limit)
+        mirror = getattr(firestore_db, 'mirror', None)
+        notes = get_degradation_policy().cached_or_compute(
+            ('my_notes', current_user['uid'], limit),
+            lambda: firestore_db.get_notes_by_user(current_user['uid'], limit),
+            free=bool(mirror and mirror.is_healthy())
+        )
         
         return jsonify({
             'notes': notes,
             'count': len(notes)
         }), 200
         
+    except DegradedUnavailable:
+        return degraded_response()
     except Exception as e:
         current_app.logger.error(f"Get my notes error: {str(e)}")
         return jsonify({
@@ -275,50 +346,105 @@ def get_my_notes(current_user):
 def get_stats():
     """Get basic statistics about notes and usage"""
     try:
-        firestore_db = get_firestore_db()
-        
-        # Get all notes to calculate stats
-        all_notes = firestore_db.get_all_notes(1000)  # Get more for accurate stats
-        
-        # Calculate statistics
-        total_notes = len(all_notes)
-        total_downloads = sum(note.get('download_count', 0) for note in all_notes)
+        def compute_stats():
+            firestore_db = get_firestore_db()
+            
+            # Get all notes to calculate stats
+            all_notes = firestore_db.get_all_notes(1000)  # Get more for accurate stats
+            
+            # Calculate statistics
+            total_notes = len(all_notes)
+            total_downloads = sum(note.get('download_count', 0) for note in all_notes)
+            
+            # Calculate total file size
+            total_size = sum(note.get('file_size', 0) for note in all_notes)
+            
+            # Get top uploaders (if available)
+            uploaders = {}
+            for note in all_notes:
+                uploader = note.get('uploader', 'Unknown')
+                uploaders[uploader] = uploaders.get(uploader, 0) + 1
+            
+            # Sort by count (descending)
+            top_uploaders = sorted(uploaders.items(), key=lambda x: x[1], reverse=True)[:5]
+            
+            # Get usage statistics
+            tracker = get_usage_tracker()
+            usage_stats = tracker.get_usage_stats()
+            near_limits = tracker.is_near_limit()
+            # Convert Firestore timestamps to ISO strings: the result is shared
+            # between workers as JSON (disk cache, single-flight result file)
+            for field in ('last_updated', 'reset_date'):
+                if hasattr(usage_stats.get(field), 'isoformat'):
+                    usage_stats[field] = usage_stats[field].isoformat()
+            
+            return {
+                'total_notes': total_notes,
+                'total_downloads': total_downloads,
+                'total_file_size': total_size,
+                'total_file_size_mb': round(total_size / (1024 * 1024), 2),
+                'uploaders': {
+                    'distribution': uploaders,
+                    'top_5': top_uploaders
+                },
+                'usage_stats': usage_stats,
+                'near_limits': near_limits
+            }
+            
+        # Concurrent dashboard loads share one scan; degraded, the last result is served
+        stats = get_degradation_policy().cached_or_compute('files_stats', lambda: get_singleflight('files_stats').do(
+            'stats', lambda: disk_cached('files_stats', compute_stats)
+        ))
         
-        # Calculate total file size
-        total_size = sum(note.get('file_size', 0) for note in all_notes)
+        return jsonify(stats), 200
         
-        # Get top uploaders (if available)
-        uploaders = {}
-        for note in all_notes:
-            uploader = note.get('uploader', 'Unknown')
-            uploaders[uploader] = uploaders.get(uploader, 0) + 1
+    except DegradedUnavailable:
+        return degraded_response()
+    except Exception as e:
+        current_app.logger.error(f"Get stats error: {str(e)}")
+        return jsonify({
+            'error': 'Failed to retrieve statistics',
+            'code': 'STATS_ERROR',
+        }), 500
+
+@files_bp.route('/subjects', methods=['GET'])
+@track_usage('get_metadata')
+def get_subjects():
+    """Get all subjects with note counts (single facet document read)"""
+    try:
+        facets = get_firestore_db().get_facets()['subjects']
         
-        # Sort by count (descending)
-        top_uploaders = sorted(uploaders.items(), key=lambda x: x[1], reverse=True)[:5]
+        return jsonify({
+            'subjects': sorted(facets),
+            'counts': facets,
+            'count': len(facets)
+        }), 200
         
-        # Get usage statistics
-        tracker = get_usage_tracker()
-        usage_stats = tracker.get_usage_stats()
-        near_limits = tracker.is_near_limit()
+    except Exception as e:
+        current_app.logger.error(f"Get subjects error: {str(e)}")
+        return jsonify({
+            'error': 'Failed to retrieve subjects',
+            'code': 'SUBJECTS_ERROR',
+        }), 500
+
+@files_bp.route('/departments', methods=['GET'])
+@track_usage('get_metadata')
+def get_departments():
+    """Get all departments with note counts (single facet document read)"""
+    try:
+        facets = get_firestore_db().get_facets()['departments']
         
         return jsonify({
-            'total_notes': total_notes,
-            'total_downloads': total_downloads,
-            'total_file_size': total_size,
-            'total_file_size_mb': round(total_size / (1024 * 1024), 2),
-            'uploaders': {
-                'distribution': uploaders,
-                'top_5': top_uploaders
-            },
-            'usage_stats': usage_stats,
-            'near_limits': near_limits
+            'departments': sorted(facets),
+            'counts': facets,
+            'count': len(facets)
         }), 200
         
     except Exception as e:
-        current_app.logger.error(f"Get stats error: {str(e)}")
+        current_app.logger.error(f"Get departments error: {str(e)}")
         return jsonify({
-            'error': 'Failed to retrieve statistics',
-            'code': 'STATS_ERROR',
+            'error': 'Failed to retrieve departments',
+            'code': 'DEPARTMENTS_ERROR',
         }), 500
 
 @files_bp.route('/search', methods=['GET'])
@@ -353,6 +479,40 @@ def search_notes(current_user=None):
             'code': 'SEARCH_ERROR',
         }), 500
 
+@files_bp.route('/suggest', methods=['GET'])
+def suggest_notes():
+    """Autocomplete titles, subjects and departments from the in-memory index"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({
+                'error': 'Search query is required',
+                'code': 'MISSING_QUERY'
+            }), 400
+        
+        limit = min(int(request.args.get('limit', 8)), 20)
+        field = request.args.get('field')
+        if field and field not in SUGGEST_FIELDS:
+            return jsonify({
+                'error': f'Field must be one of: {", ".join(SUGGEST_FIELDS)}',
+                'code': 'INVALID_FIELD'
+            }), 400
+        
+        suggestions = get_suggest_index().suggest(query, limit, field)
+        
+        return jsonify({
+            'suggestions': suggestions,
+            'count': len(suggestions),
+            'query': query
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Suggest error: {str(e)}")
+        return jsonify({
+            'error': 'Failed to fetch suggestions',
+            'code': 'SUGGEST_ERROR',
+        }), 500
+
 @files_bp.route('/note/<note_id>', methods=['GET'])
 @require_authentication_optional
 @track_usage('get_metadata')
@@ -403,7 +563,8 @@ def get_usage_info(current_user=None):
             'near_limits': near_limits,
             'limits': tracker.LIMITS,
             'month': usage_stats['current_month'],
-            'last_reset': usage_stats.get('reset_date')
+            'last_reset': usage_stats.get('reset_date'),
+            'degradation': get_degradation_policy().status()
         }), 200
         
     except Exception as e:
@@ -412,3 +573,35 @@ def get_usage_info(current_user=None):
             'error': 'Failed to retrieve usage information',
             'code': 'USAGE_INFO_ERROR',
         }), 500
+
+@files_bp.route('/usage/history', methods=['GET'])
+@require_admin
+@track_usage('get_metadata', check_limits=False)
+def get_usage_history(current_user):
+    """Get usage as an hourly, daily or monthly series with end-of-period projections"""
+    try:
+        granularity = request.args.get('granularity', 'hour')
+        if granularity not in MAX_PERIODS:
+            return jsonify({
+                'error': f'Granularity must be one of: {", ".join(MAX_PERIODS)}',
+                'code': 'INVALID_GRANULARITY'
+            }), 400
+        periods = request.args.get('periods', type=int)
+        
+        tracker = get_usage_tracker()
+        series = tracker.history.series(granularity, periods) if tracker.history is not None else []
+        
+        return jsonify({
+            'granularity': granularity,
+            'series': series,
+            'count': len(series),
+            'projection': tracker.get_usage_projection(),
+            'limits': tracker.LIMITS
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Get usage history error: {str(e)}")
+        return jsonify({
+            'error': 'Failed to retrieve usage history',
+            'code': 'USAGE_HISTORY_ERROR',
+        }), 500
@@ -4,6 +4,11 @@ from typing import Dict, List
 from flask import current_app
 import logging
 from datetime import datetime, timedelta
+from utils.facets import NoteFacets, compute_download_totals, compute_facets
+from utils.fanout import fan_out
+from utils.disk_cache import disk_cached
+from utils.firestore_db import get_firestore_db
+from utils.write_queue import get_write_queue
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +18,7 @@ class AnalyticsDB:
         try:
             self.db = firestore.client()
             self.analytics_collection = 'analytics'
+            self.facets = NoteFacets(self.db)
             logger.info("Analytics DB initialized successfully")
         except Exception as e:
             logger.error("Failed to initialize Analytics DB")
@@ -44,7 +50,15 @@ class AnalyticsDB:
                 'metadata': metadata or {}
             }
             
-            self.db.collection(self.analytics_collection).document(event_id).set(event_data)
+            doc_ref = self.db.collection(self.analytics_collection).document(event_id)
+            queue = get_write_queue()
+            if queue is not None:
+                # Events are append-only and never read back by the request
+                writer = queue.writer(group_id=f"analytics:{event_id}")
+                writer.set(doc_ref, event_data)
+                writer.commit()
+            else:
+                doc_ref.set(event_data)
             return True
         except Exception as e:
             logger.error(f"Error tracking action: {e}")
@@ -55,6 +69,12 @@ class AnalyticsDB:
         try:
             from_date = datetime.now() - timedelta(days=days)
             
+            if getattr(get_firestore_db(), 'download_counter', None):
+                # With sharded counters new downloads land in the shards, not
+                # the base field, so the field can't be ordered on
+                notes = sorted(self._scan_notes(), key=lambda note: note.get('download_count', 0), reverse=True)
+                return notes[:limit]
+            
             # This requires getting data from notes collection and sorting by downloads
             # Implementation depends on access to firestore
             query = self.db.collection('notes').order_by('download_count', direction=firestore.Query.DESCENDING).limit(limit)
@@ -70,77 +90,99 @@ class AnalyticsDB:
             logger.error(f"Error getting popular notes: {e}")
             return []
 
-    def get_subject_statistics(self) -> Dict:
+    def _get_facets(self) -> Dict:
+        """Read materialized facets, scanning notes only if they were never built"""
+        def read_facets():
+            facets = self.facets.read()
+            if facets is None:
+                logger.warning("Note facets missing, computing from a full scan")
+                facets = compute_facets(doc.to_dict() for doc in self.db.collection('notes').stream())
+            return facets
+        return disk_cached('note_facets', read_facets)
+
+    def _scan_notes(self) -> List[Dict]:
+        """Every note, with sharded and buffered download counts folded in"""
+        return get_firestore_db().scan_notes()
+
+    def _get_download_totals(self, notes: List[Dict] = None) -> Dict:
+        """
+        Downloads per subject and department
+
+        Computed from the given notes when the caller already scanned them,
+        otherwise read from the facet download shards (a few documents,
+        whatever the number of notes; backfilled by `flask rebuild-facets`).
+        """
+        if notes is not None:
+            return compute_download_totals(notes)
+        return disk_cached('note_download_totals', self.facets.read_downloads)
+
+    def get_subject_statistics(self, notes: List[Dict] = None) -> Dict:
         """Get statistics by subject"""
         try:
-            notes = self.db.collection('notes').stream()
-            
+            downloads = self._get_download_totals(notes)['subjects']
             subject_stats = {}
-            for doc in notes:
-                note = doc.to_dict()
-                subject = note.get('subject', 'Unknown')
-                
-                if subject not in subject_stats:
-                    subject_stats[subject] = {
-                        'count': 0,
-                        'total_downloads': 0,
-                        'avg_rating': 0
-                    }
-                
-                subject_stats[subject]['count'] += 1
-                subject_stats[subject]['total_downloads'] += note.get('download_count', 0)
+            for subject, facet in self._get_facets()['subjects'].items():
+                subject_stats[subject] = {
+                    'count': facet.get('count', 0),
+                    'total_downloads': downloads.get(subject, 0),
+                    'avg_rating': 0
+                }
             
             return subject_stats
         except Exception as e:
             logger.error(f"Error getting subject statistics: {e}")
             return {}
 
-    def get_department_statistics(self) -> Dict:
+    def get_department_statistics(self, notes: List[Dict] = None) -> Dict:
         """Get statistics by department"""
         try:
-            notes = self.db.collection('notes').stream()
-            
+            downloads = self._get_download_totals(notes)['departments']
             dept_stats = {}
-            for doc in notes:
-                note = doc.to_dict()
-                dept = note.get('department', 'Unknown')
-                
-                if dept not in dept_stats:
-                    dept_stats[dept] = {
-                        'count': 0,
-                        'total_downloads': 0
-                    }
-                
-                dept_stats[dept]['count'] += 1
-                dept_stats[dept]['total_downloads'] += note.get('download_count', 0)
+            for dept, facet in self._get_facets()['departments'].items():
+                dept_stats[dept] = {
+                    'count': facet.get('count', 0),
+                    'total_downloads': downloads.get(dept, 0)
+                }
             
             return dept_stats
         except Exception as e:
             logger.error(f"Error getting department statistics: {e}")
             return {}
 
+    def _count_users(self) -> int:
+        """Count user documents with an aggregation query instead of streaming them"""
+        results = self.db.collection('users').count().get()
+        return int(results[0][0].value)
+
     def get_admin_dashboard_stats(self) -> Dict:
         """Get comprehensive admin dashboard statistics"""
         try:
-            notes = list(self.db.collection('notes').stream())
-            users = list(self.db.collection('users').stream())
+            # The reads are independent: run them concurrently so the
+            # dashboard costs the slowest one rather than their sum
+            results = fan_out({
+                'notes': self._scan_notes,
+                'total_users': self._count_users,
+            }, timeout={'notes': 30, 'total_users': 10})
             
-            total_notes = len(notes)
-            total_downloads = sum(doc.to_dict().get('download_count', 0) for doc in notes)
-            total_file_size = sum(doc.to_dict().get('file_size', 0) for doc in notes)
+            notes_dict = results['notes']
+            # Subject/department download totals come from the notes already scanned
+            results['subject_stats'] = self.get_subject_statistics(notes_dict)
+            results['department_stats'] = self.get_department_statistics(notes_dict)
+            total_notes = len(notes_dict)
+            total_downloads = sum(note.get('download_count', 0) for note in notes_dict)
+            total_file_size = sum(note.get('file_size', 0) for note in notes_dict)
             
             # Get trending notes (most downloaded in last 7 days)
-            notes_dict = [doc.to_dict() for doc in notes]
             trending = sorted(notes_dict, key=lambda x: x.get('download_count', 0), reverse=True)[:5]
             
             return {
                 'total_notes': total_notes,
-                'total_users': len(users),
+                'total_users': results['total_users'],
                 'total_downloads': total_downloads,
                 'total_file_size_mb': round(total_file_size / (1024 * 1024), 2),
                 'trending_notes': trending,
-                'subject_stats': self.get_subject_statistics(),
-                'department_stats': self.get_department_statistics()
+                'subject_stats': results['subject_stats'],
+                'department_stats': results['department_stats']
             }
         except Exception as e:
             logger.error(f"Error getting admin dashboard stats: {e}")
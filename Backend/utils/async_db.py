@@ -0,0 +1,191 @@
+# Backend/utils/async_db.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+
+from utils.firestore_db import get_firestore_db
+from utils.ratings_comments import RatingsCommentsDB
+from utils.operations import record_backend_operation
+from utils.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRunner:
+    """
+    A single long-lived event loop on a daemon thread.
+
+    Flask runs every async view in a fresh event loop, but gRPC (Firestore
+    AsyncClient) clients are bound to the loop they were created on. All async data access therefore runs here, and views await
+    it through run_async(), so clients and their connections are shared by
+    every request in the process.
+
+    Blocking calls made from the loop run in its own thread pools rather than
+    asyncio's default one: ASYNC_DB_MAX_WORKERS threads for data reads and a
+    separate ASYNC_FILE_MAX_WORKERS for file downloads, so slow downloads
+    queue behind each other and can't hold up note, stats or profile reads.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=int(os.getenv('ASYNC_DB_MAX_WORKERS', 16)),
+            thread_name_prefix='async-db'
+        ))
+        self.file_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('ASYNC_FILE_MAX_WORKERS', 8)),
+            thread_name_prefix='async-file'
+        )
+        self._thread = threading.Thread(target=self.loop.run_forever, name='async-db-loop', daemon=True)
+        self._thread.start()
+
+    def run(self, coro) -> Awaitable:
+        """Schedule a coroutine on the shared loop and return an awaitable for the caller's loop"""
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def to_file_thread(self, fn: Callable, *args) -> Any:
+        """asyncio.to_thread on the file-download pool"""
+        # Copy contextvars like to_thread, so per-request operation counts see the call
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await self.loop.run_in_executor(self.file_executor, call)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> AsyncRunner:
+    """The process-wide AsyncRunner"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = AsyncRunner()
+    return _runner
+
+
+def run_async(coro) -> Awaitable:
+    """Await a data-layer coroutine from an async view"""
+    return get_runner().run(coro)
+
+
+async def gather(*coros):
+    """asyncio.gather on the shared loop, awaitable from an async view"""
+    return await run_async(_gather(*coros))
+
+
+async def _gather(*coros):
+    return await asyncio.gather(*coros)
+
+
+class AsyncNotesDB:
+    """
+    Async counterpart of the notes store used by async route handlers.
+
+    Reads go through the sync store in a worker thread, so they get the same
+    note cache, disk cache, notes mirror, download buffer and Firestore
+    deadline, circuit breaker and hedging as the sync routes. A note already
+    in the in-memory cache is returned without leaving the event loop.
+    """
+
+    def __init__(self, sync_db):
+        self.sync_db = sync_db
+        self.cache = getattr(sync_db, 'cache', None)
+
+    async def get_note(self, note_id: str) -> Optional[Dict]:
+        if self.cache is not None:
+            cached = self.cache.get(note_id)
+            if cached is not None:
+                return dict(cached)
+        return await asyncio.to_thread(self.sync_db.get_note, note_id)
+
+    async def get_notes_by_user(self, user_id: str, limit: int = 100) -> List[Dict]:
+        return await asyncio.to_thread(self.sync_db.get_notes_by_user, user_id, limit)
+
+    async def increment_download_count(self, note_id: str, note: Dict = None) -> bool:
+        return await asyncio.to_thread(self.sync_db.increment_download_count, note_id, note)
+
+
+class AsyncRatingsCommentsDB:
+    """Async reads of ratings and comments through the Firestore AsyncClient"""
+
+    def __init__(self, sync_db: RatingsCommentsDB):
+        from firebase_admin import firestore_async
+        self.sync_db = sync_db
+        self.db = firestore_async.client()
+
+    async def get_note_ratings(self, note_id: str) -> Dict:
+        try:
+            query = self.db.collection(self.sync_db.ratings_collection).where('note_id', '==', note_id)
+            ratings = [doc.to_dict() async for doc in query.stream()]
+            record_backend_operation('firestore', 'read', max(1, len(ratings)))
+            return RatingsCommentsDB._summarize_ratings(ratings)
+        except Exception as e:
+            logger.error(f"Async error getting ratings: {e}")
+            return RatingsCommentsDB._summarize_ratings([])
+
+    async def count_note_comments(self, note_id: str) -> int:
+        """Count comments with an aggregation query (billed per 1000 entries, not per comment)"""
+        try:
+            query = self.db.collection(self.sync_db.comments_collection).where('note_id', '==', note_id)
+            results = await query.count().get()
+            count = int(results[0][0].value)
+            record_backend_operation('firestore', 'read', max(1, -(-count // 1000)))
+            return count
+        except Exception as e:
+            logger.error(f"Async error counting comments: {e}")
+            return 0
+
+    async def get_ratings_for_notes(self, note_ids: List[str]) -> Dict[str, Dict]:
+        return await asyncio.to_thread(self.sync_db.get_ratings_for_notes, note_ids)
+
+
+class AsyncStorage:
+    """
+    Async file access for the configured storage backend.
+
+    The sync backend runs in a worker thread, keeping its R2 deadlines,
+    circuit breaker, hedging and usage accounting. Downloads use the runner's
+    file pool; metadata lookups are short and share the data-read pool.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get_file_content(self, file_key: str) -> Optional[bytes]:
+        return await get_runner().to_file_thread(self.storage.get_file_content, file_key)
+
+    async def get_file_metadata(self, file_key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_file_metadata, file_key)
+
+
+_async_notes_db = None
+_async_ratings_db = None
+_async_storage = None
+
+
+def get_async_notes_db() -> AsyncNotesDB:
+    global _async_notes_db
+    if _async_notes_db is None:
+        _async_notes_db = AsyncNotesDB(get_firestore_db())
+    return _async_notes_db
+
+
+def get_async_ratings_db(sync_db: RatingsCommentsDB) -> AsyncRatingsCommentsDB:
+    global _async_ratings_db
+    if _async_ratings_db is None:
+        _async_ratings_db = AsyncRatingsCommentsDB(sync_db)
+    return _async_ratings_db
+
+
+def get_async_storage() -> AsyncStorage:
+    global _async_storage
+    storage = get_storage()
+    if _async_storage is None or _async_storage.storage is not storage:
+        _async_storage = AsyncStorage(storage)
+    return _async_storage
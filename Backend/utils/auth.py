@@ -3,10 +3,26 @@ from firebase_admin import credentials, auth
 from functools import wraps
 from flask import request, jsonify, current_app
 import os
+import threading
 import logging
+import time
+
+from utils.cache import TTLCache
+from utils.fanout import fan_map
+from utils.metrics import register_metrics
+from utils.signing_keys import get_signing_keys, verify_id_token_locally
+from utils.token_cache import get_token_cache
 
 logger = logging.getLogger(__name__)
 
+# Firebase Auth accepts at most 100 identifiers per get_users call
+GET_USERS_BATCH_SIZE = 100
+
+# Cached marker for users that don't exist
+_USER_NOT_FOUND = object()
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
 # Initialize Firebase Admin SDK 
 def initialize_firebase():
     """Initialize Firebase Admin SDK with service account credentials"""
@@ -64,22 +80,84 @@ def initialize_firebase():
                 raise
     else:
         logger.info("Firebase Admin SDK already initialized")
+    
+    # Start fetching token signing keys before the first request needs them
+    get_signing_keys()
+
+def _project_id():
+    project_id = os.environ.get('FIREBASE_PROJECT_ID')
+    if not project_id and firebase_admin._apps:
+        project_id = firebase_admin.get_app().project_id
+    return project_id
+
+def _verify_locally(id_token):
+    """
+    Verify a token against the background-refreshed signing keys
+    
+    Returns None (defer to the Admin SDK) while no keys are loaded or when the
+    token was signed by a key we have not fetched yet.
+    """
+    refresher = get_signing_keys()
+    project_id = _project_id()
+    keys = refresher.keys() if refresher and project_id else None
+    if not keys:
+        return None
+    try:
+        return verify_id_token_locally(id_token, keys, project_id,
+                                       clock_skew=int(os.getenv('FIREBASE_CLOCK_SKEW_SECONDS', 0)))
+    except KeyError:
+        # Keys rotated since the last fetch
+        refresher.request_refresh()
+        return None
 
-def verify_firebase_token(id_token):
+def _check_revoked(decoded_token):
+    """Raise if the user was disabled or signed out everywhere after the token was issued"""
+    user_record = auth.get_user(decoded_token['uid'])
+    if user_record.disabled:
+        raise auth.UserDisabledError('The user record is disabled.')
+    valid_after = user_record.tokens_valid_after_timestamp
+    if valid_after and decoded_token.get('iat', 0) * 1000 < valid_after:
+        raise auth.RevokedIdTokenError('The Firebase ID token has been revoked.')
+
+def verify_firebase_token(id_token, check_revoked=False):
     """
     Verify a Firebase ID token and return the decoded token
+    
+    Verified claims are cached until the token expires. With check_revoked,
+    the token is also checked for revocation if that was last done more than
+    AUTH_REVOCATION_CHECK_SECONDS ago.
     """
+    cache = get_token_cache()
+    cache_key = cache.key(id_token) if cache else None
     try:
+        if cache:
+            decoded_token = cache.get(cache_key, check_revoked=check_revoked)
+            if decoded_token:
+                return decoded_token
+        
         # Check if Firebase is initialized
         if not firebase_admin._apps:
             logger.error("Firebase Admin SDK not initialized!")
             return None
             
-        # Verify the ID token
-        decoded_token = auth.verify_id_token(id_token)
+        # Verify the ID token, locally when the signing keys are loaded
+        started = time.perf_counter()
+        decoded_token = _verify_locally(id_token)
+        if decoded_token is None:
+            decoded_token = auth.verify_id_token(id_token, check_revoked=check_revoked)
+        elif check_revoked:
+            _check_revoked(decoded_token)
+        if cache:
+            cache.record_verification(time.perf_counter() - started, revocation_checked=check_revoked)
+            cache.put(cache_key, decoded_token, revocation_checked=check_revoked)
         logger.debug("Token verified successfully")
         return decoded_token
-    except auth.InvalidIdTokenError as e:
+    except (auth.RevokedIdTokenError, auth.UserDisabledError) as e:
+        logger.warning("Revoked ID token provided")
+        if cache:
+            cache.invalidate(cache_key)
+        return None
+    except (auth.InvalidIdTokenError, ValueError) as e:
         logger.warning("Invalid ID token provided")
         return None
     except auth.ExpiredIdTokenError as e:
@@ -118,10 +196,16 @@ def get_token_from_header():
         logger.error("Error parsing Authorization header")
         return None
 
-def require_authentication(f):
+def require_authentication(f=None, *, check_revoked=False):
     """
     Decorator to require Firebase authentication for a route
+    
+    Sensitive routes can use @require_authentication(check_revoked=True) to
+    reject revoked tokens (checked at most every AUTH_REVOCATION_CHECK_SECONDS)
     """
+    if f is None:
+        return lambda func: require_authentication(func, check_revoked=check_revoked)
+    
     @wraps(f)
     def decorated_function(*args, **kwargs):
         logger.debug("Performing authentication check")
@@ -136,7 +220,7 @@ def require_authentication(f):
             }), 401
         
         # Verify token
-        decoded_token = verify_firebase_token(id_token)
+        decoded_token = verify_firebase_token(id_token, check_revoked=check_revoked)
         if not decoded_token:
             logger.info("Authentication failed: Invalid token")
             return jsonify({
@@ -146,10 +230,41 @@ def require_authentication(f):
         
         logger.debug("Authentication successful")
         # Add current user to kwargs and call the original function
-        return f(current_user=decoded_token, *args, **kwargs)
+        return current_app.ensure_sync(f)(current_user=decoded_token, *args, **kwargs)
     
     return decorated_function
 
+def is_admin(current_user):
+    """
+    Check whether a verified user is an administrator
+    
+    Admins carry the `admin` custom claim, or have a verified email listed in
+    ADMIN_EMAILS (comma-separated).
+    """
+    if not current_user:
+        return False
+    if current_user.get('admin') is True:
+        return True
+    admin_emails = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+    email = (current_user.get('email') or '').lower()
+    return bool(email) and email in admin_emails and current_user.get('email_verified', False)
+
+def require_admin(f):
+    """
+    Decorator to require an authenticated administrator for a route
+    """
+    @wraps(f)
+    def decorated_function(*args, current_user=None, **kwargs):
+        if not is_admin(current_user):
+            logger.info("Admin check failed")
+            return jsonify({
+                'error': 'Administrator access required',
+                'code': 'ADMIN_REQUIRED'
+            }), 403
+        return current_app.ensure_sync(f)(current_user=current_user, *args, **kwargs)
+    
+    return require_authentication(decorated_function)
+
 def require_authentication_optional(f):
     """
     Decorator that provides user info if authenticated, but doesn't require it
@@ -169,34 +284,85 @@ def require_authentication_optional(f):
                 logger.debug("Optional authentication failed - continuing without auth")
         
         # Call the original function with current_user (None if not authenticated)
-        return f(current_user=current_user, *args, **kwargs)
+        return current_app.ensure_sync(f)(current_user=current_user, *args, **kwargs)
     
     return decorated_function
 
+def _get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                cache = TTLCache(
+                    max_entries=int(os.getenv('AUTH_USER_CACHE_SIZE', 4096)),
+                    ttl_seconds=float(os.getenv('AUTH_USER_CACHE_SECONDS', 300)),
+                    name='auth_users'
+                )
+                register_metrics('auth_users', cache.stats)
+                _user_cache = cache
+    return _user_cache
+
+def _user_record_to_info(user_record):
+    return {
+        'uid': user_record.uid,
+        'email': user_record.email,
+        'display_name': user_record.display_name,
+        'email_verified': user_record.email_verified,
+        'disabled': user_record.disabled,
+        'created_at': user_record.user_metadata.creation_timestamp,
+        'last_sign_in': user_record.user_metadata.last_sign_in_timestamp
+    }
+
+def _get_users_chunk(user_ids):
+    """One get_users call; a failed chunk resolves nothing instead of failing the batch"""
+    try:
+        result = auth.get_users([auth.UidIdentifier(user_id) for user_id in user_ids])
+        return result.users, [identifier.uid for identifier in result.not_found]
+    except Exception as e:
+        logger.error("Error getting user info batch")
+        if current_app and current_app.debug:
+            logger.error(f"Get users error: {e}")
+        return [], []
+
+def get_users_info(user_ids):
+    """
+    Get user information for many users with batched Firebase Auth lookups
+    
+    Records are cached for AUTH_USER_CACHE_SECONDS and missing users for
+    AUTH_USER_NEGATIVE_CACHE_SECONDS; the rest are fetched in chunks of 100.
+    
+    Returns:
+        dict: uid -> user info, or None if the user doesn't exist or the lookup failed
+    """
+    cache = _get_user_cache()
+    unique_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+    users = {}
+    missing = []
+    for user_id in unique_ids:
+        cached = cache.get(user_id)
+        if cached is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = None if cached is _USER_NOT_FOUND else dict(cached)
+    
+    if missing:
+        chunks = [missing[i:i + GET_USERS_BATCH_SIZE] for i in range(0, len(missing), GET_USERS_BATCH_SIZE)]
+        negative_ttl = float(os.getenv('AUTH_USER_NEGATIVE_CACHE_SECONDS', 60))
+        for records, not_found in fan_map(_get_users_chunk, chunks):
+            for user_record in records:
+                info = _user_record_to_info(user_record)
+                cache.set(user_record.uid, info)
+                users[user_record.uid] = dict(info)
+            for user_id in not_found:
+                cache.set(user_id, _USER_NOT_FOUND, ttl_seconds=negative_ttl)
+    
+    return {user_id: users.get(user_id) for user_id in unique_ids}
+
 def get_user_info(user_id):
     """
     Get additional user information from Firebase Auth
     """
-    try:
-        user_record = auth.get_user(user_id)
-        return {
-            'uid': user_record.uid,
-            'email': user_record.email,
-            'display_name': user_record.display_name,
-            'email_verified': user_record.email_verified,
-            'disabled': user_record.disabled,
-            'created_at': user_record.user_metadata.creation_timestamp,
-            'last_sign_in': user_record.user_metadata.last_sign_in_timestamp
-        }
-    except auth.UserNotFoundError:
-        # SECURITY FIX: Don't log user ID in error message
-        logger.warning("Requested user not found")
-        return None
-    except Exception as e:
-        logger.error("Error getting user info")
-        # SECURITY FIX: Only log detailed error in debug mode
-        if current_app and current_app.debug:
-            logger.error(f"Get user info error: {e}")
-        return None
+    # SECURITY FIX: Don't log user IDs; batch lookups log failures without them
+    return get_users_info([user_id]).get(user_id)
 
 logger.info("Auth module loaded - call initialize_firebase() from your main app")
@@ -0,0 +1,431 @@
+# Backend/utils/counters.py
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from utils.cache import TTLCache
+from utils.operations import record_backend_operation
+import atexit
+import logging
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Firestore allows 500 writes per batch
+FLUSH_BATCH_SIZE = 400
+
+# Shard documents fetched per get_all() round trip when summing counters
+SHARD_READ_CHUNK_SIZE = 300
+
+
+class ShardedCounter:
+    """
+    Firestore distributed counter spread over N shard documents.
+
+    A counter field on document D is stored as D/<field>_shards/{0..N-1}, each
+    holding a partial 'count'. Writes increment one shard chosen at random,
+    so a hot document absorbs roughly N times the single-document write rate;
+    reads sum the shards (one batched get_all) and cache the total for
+    cache_ttl seconds. Any value already stored in the field on D itself is
+    kept as the base, so enabling sharding needs no migration. With
+    timestamp_field, each shard also records when it was last incremented and
+    reads report the latest of those as D's timestamp_field, so D itself is
+    never written.
+
+    Shards are never folded back into the base field, so every uncached
+    total costs num_shards document reads (missing shards are billed too):
+    finalizing a 100-note listing reads up to 100 * num_shards documents
+    once per cache_ttl.
+    """
+
+    def __init__(self, db, field: str, num_shards: int = 10, cache_ttl: float = 10.0,
+                 timestamp_field: Optional[str] = None):
+        self.db = db
+        self.field = field
+        self.timestamp_field = timestamp_field
+        self.num_shards = max(1, num_shards)
+        self.shards_collection = f"{field}_shards"
+        # parent path -> (total, latest shard timestamp as ISO string or None)
+        self.cache = TTLCache(max_entries=4096, ttl_seconds=cache_ttl, name=self.shards_collection)
+
+    def shard_refs(self, doc_ref) -> List:
+        """All shard document references of a counter"""
+        shards = doc_ref.collection(self.shards_collection)
+        return [shards.document(str(i)) for i in range(self.num_shards)]
+
+    def increment(self, doc_ref, count: int = 1, writer=None):
+        """
+        Add to a counter through a random shard
+
+        Args:
+            doc_ref: Document the counter belongs to
+            count: Amount to add
+            writer: WriteBatch/Transaction to queue the write on; when given the
+                caller must call applied() once it has been committed
+        """
+        shard_ref = doc_ref.collection(self.shards_collection).document(str(random.randrange(self.num_shards)))
+        payload = {'count': firestore.Increment(count)}
+        if self.timestamp_field:
+            payload['updated_at'] = firestore.SERVER_TIMESTAMP
+        if writer is not None:
+            writer.set(shard_ref, payload, merge=True)
+            return
+        shard_ref.set(payload, merge=True)
+        self.applied(doc_ref, count)
+
+    def applied(self, doc_ref, count: int):
+        """Keep the cached total in step with a committed increment"""
+        now = datetime.now(timezone.utc).isoformat() if self.timestamp_field else None
+        self.cache.update(doc_ref.path, lambda state: (state[0] + count, now or state[1]))
+
+    def forget(self, doc_ref):
+        """Drop a cached total whose committed increments are not known exactly"""
+        self.cache.invalidate(doc_ref.path)
+
+    def delete(self, doc_ref, writer):
+        """Queue deletion of every shard (subcollections outlive their parent)"""
+        for shard_ref in self.shard_refs(doc_ref):
+            writer.delete(shard_ref)
+        self.cache.invalidate(doc_ref.path)
+
+    def get_total(self, doc_ref) -> int:
+        """Summed shard value of one counter"""
+        return self.get_totals([doc_ref]).get(doc_ref.path, 0)
+
+    def get_totals(self, doc_refs: List) -> Dict[str, int]:
+        """
+        Summed shard values for many counters, reading only uncached ones
+
+        Returns:
+            dict: Totals keyed by parent document path
+        """
+        return {path: state[0] for path, state in self._get_states(doc_refs).items()}
+
+    def _get_states(self, doc_refs: List) -> Dict[str, Tuple[int, Optional[str]]]:
+        states = {}
+        missing = []
+        for doc_ref in doc_refs:
+            cached = self.cache.get(doc_ref.path)
+            if cached is None:
+                missing.append(doc_ref)
+            else:
+                states[doc_ref.path] = cached
+
+        if missing:
+            summed = {doc_ref.path: [0, None] for doc_ref in missing}
+            shard_refs = [shard_ref for doc_ref in missing for shard_ref in self.shard_refs(doc_ref)]
+            for i in range(0, len(shard_refs), SHARD_READ_CHUNK_SIZE):
+                for shard in self.db.get_all(shard_refs[i:i + SHARD_READ_CHUNK_SIZE]):
+                    if shard.exists:
+                        state = summed[shard.reference.parent.parent.path]
+                        data = shard.to_dict()
+                        state[0] += data.get('count', 0) or 0
+                        updated_at = data.get('updated_at')
+                        if updated_at and (state[1] is None or updated_at.isoformat() > state[1]):
+                            state[1] = updated_at.isoformat()
+            for path, state in summed.items():
+                self.cache.set(path, tuple(state))
+                states[path] = tuple(state)
+
+        return states
+
+    def merge_into(self, items: List[Dict], doc_ref_for) -> List[Dict]:
+        """
+        Add shard totals onto the counter field of already loaded documents
+
+        Args:
+            items: Document dicts (the base value is read from self.field)
+            doc_ref_for: Callable mapping an item to its DocumentReference
+        """
+        if not items:
+            return items
+        refs = [doc_ref_for(item) for item in items]
+        states = self._get_states(refs)
+        for item, doc_ref in zip(items, refs):
+            total, latest = states.get(doc_ref.path, (0, None))
+            item[self.field] = (item.get(self.field, 0) or 0) + total
+            if self.timestamp_field and latest and latest > (item.get(self.timestamp_field) or ''):
+                item[self.timestamp_field] = latest
+        return items
+
+    def stats(self) -> Dict:
+        return {'field': self.field, 'num_shards': self.num_shards, 'cache': self.cache.stats()}
+
+
+class DownloadCounterBuffer:
+    """
+    Coalesces note download increments in memory and flushes them in batches.
+
+    A hot note would otherwise cost one write per download to the same
+    document, which Firestore throttles at about one sustained write per
+    second. Increments are aggregated per note id and written as a single
+    Increment(n) per note whenever the flush interval elapses or max_pending
+    notes are waiting. Pending and in-flight deltas are exposed through
+    pending() so reads can stay accurate, and the buffer drains on
+    interpreter shutdown. With a write queue, flushes hand the increments to
+    its durable file instead of committing them directly (one group per
+    note, so a deleted note only drops its own increment); they keep counting
+    as pending until the queue reports them committed, or until a later
+    flush finds that another worker's queue thread committed them. With
+    facets, every flushed batch also adds its downloads to the subject and
+    department download totals (one facet shard write per batch, or per note
+    through the write queue so a deleted note drops its facet delta too).
+    """
+
+    def __init__(self, db, notes_collection: str, flush_interval: float = 5.0, max_pending: int = 500,
+                 counter: Optional[ShardedCounter] = None, queue=None, facets=None):
+        self.db = db
+        self.notes_collection = notes_collection
+        self.counter = counter
+        self.queue = queue
+        self.facets = facets
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        # note_id -> {'count', 'note' (subject and department, for the facets)}
+        self._pending: Dict[str, Dict] = {}
+        # Deltas swapped out of _pending but not yet committed
+        self._inflight: Dict[str, int] = {}
+        # Deltas handed to the write queue: group id -> (note_id, count), and totals per note
+        self._queued: Dict[str, Tuple[str, int]] = {}
+        self._queued_by_note: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        self.flushes = 0
+        self.flushed_increments = 0
+        self.failures = 0
+        self.last_flush_at = None
+
+        if queue is not None:
+            queue.add_settle_listener(self._settled)
+
+        self._thread = threading.Thread(target=self._run, name='download-counter-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, note_id: str, count: int = 1, note: Optional[Dict] = None):
+        """Record downloads for a note; the write happens on the next flush"""
+        with self._lock:
+            entry = self._pending.setdefault(note_id, {'count': 0, 'note': None})
+            entry['count'] += count
+            if note:
+                entry['note'] = {'subject': note.get('subject'), 'department': note.get('department')}
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending(self, note_id: str) -> int:
+        """Downloads recorded for a note that Firestore does not reflect yet"""
+        with self._lock:
+            entry = self._pending.get(note_id)
+            return ((entry['count'] if entry else 0) + self._inflight.get(note_id, 0)
+                    + self._queued_by_note.get(note_id, 0))
+
+    def merge_into(self, note: Dict) -> Dict:
+        """Add pending downloads to a note dict read from Firestore"""
+        delta = self.pending(note.get('id'))
+        if delta:
+            note['download_count'] = (note.get('download_count', 0) or 0) + delta
+        return note
+
+    def flush(self) -> int:
+        """
+        Write all pending increments
+
+        Returns:
+            int: Number of downloads written
+        """
+        with self._flush_lock:
+            with self._lock:
+                items = self._pending
+                self._pending = {}
+                for note_id, entry in items.items():
+                    self._inflight[note_id] = self._inflight.get(note_id, 0) + entry['count']
+            if not items:
+                return 0
+
+            written = 0
+            entries = list(items.items())
+            for i in range(0, len(entries), FLUSH_BATCH_SIZE):
+                written += self._commit(entries[i:i + FLUSH_BATCH_SIZE])
+
+            self.flushes += 1
+            self.flushed_increments += written
+            self.last_flush_at = time.time()
+            logger.debug(f"Flushed {written} downloads for {len(items)} notes")
+            return written
+
+    def _release(self, entries):
+        """Stop counting entries as in flight (committed, dropped or re-queued)"""
+        with self._lock:
+            for note_id, entry in entries:
+                remaining = self._inflight.get(note_id, 0) - entry['count']
+                if remaining > 0:
+                    self._inflight[note_id] = remaining
+                else:
+                    self._inflight.pop(note_id, None)
+
+    def _commit(self, entries) -> int:
+        """Commit one batch, falling back to per-note writes if the batch fails"""
+        if self.queue is not None:
+            try:
+                return self._enqueue(entries)
+            except Exception as e:
+                logger.warning(f"Could not enqueue downloads, writing them directly: {e}")
+        try:
+            batch = self.db.batch()
+            self._queue_writes(batch, entries)
+            record_backend_operation('firestore', 'write', len(entries) + (1 if self.facets else 0))
+            batch.commit()
+            self._applied(entries)
+            self._release(entries)
+            return sum(entry['count'] for _, entry in entries)
+        except Exception as e:
+            logger.warning(f"Batched download flush failed, retrying per note: {e}")
+
+        written = 0
+        for note_id, entry in entries:
+            try:
+                batch = self.db.batch()
+                self._queue_writes(batch, [(note_id, entry)])
+                record_backend_operation('firestore', 'write', 2 if self.facets else 1)
+                batch.commit()
+                self._applied([(note_id, entry)])
+                written += entry['count']
+            except NotFound:
+                # Note was deleted after it was downloaded; nothing to count
+                logger.info("Dropping buffered downloads for a deleted note")
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Failed to flush downloads, re-queueing: {e}")
+                self._requeue(note_id, entry)
+        self._release(entries)
+        return written
+
+    def _enqueue(self, entries) -> int:
+        writers = []
+        for note_id, entry in entries:
+            writer = self.queue.writer(f"downloads-{uuid.uuid4().hex}")
+            self._queue_note_write(writer, note_id, entry['count'])
+            if self.facets:
+                self.facets.add_downloads(writer, [(entry.get('note'), entry['count'])])
+            writers.append((writer, note_id, entry['count']))
+        # Move the deltas from in flight to queued before the queue thread can commit them
+        with self._lock:
+            for writer, note_id, count in writers:
+                self._queued[writer.group_id] = (note_id, count)
+                self._queued_by_note[note_id] = self._queued_by_note.get(note_id, 0) + count
+        self._release(entries)
+        try:
+            self.queue.enqueue([writer for writer, _, _ in writers])
+        except Exception:
+            with self._lock:
+                for writer, note_id, count in writers:
+                    self._unqueue(writer.group_id)
+                    self._inflight[note_id] = self._inflight.get(note_id, 0) + count
+            raise
+        return sum(entry['count'] for _, entry in entries)
+
+    def _unqueue(self, group_id: str) -> Optional[Tuple[str, int]]:
+        """Forget a queued group (caller holds _lock)"""
+        queued = self._queued.pop(group_id, None)
+        if queued is not None:
+            note_id, count = queued
+            remaining = self._queued_by_note.get(note_id, 0) - count
+            if remaining > 0:
+                self._queued_by_note[note_id] = remaining
+            else:
+                self._queued_by_note.pop(note_id, None)
+        return queued
+
+    def _settled(self, group_ids: List[str], committed: bool):
+        """Write queue listener: queued downloads were committed (or dropped)"""
+        with self._lock:
+            settled = [queued for queued in map(self._unqueue, group_ids) if queued is not None]
+        if committed and settled:
+            self._applied([(note_id, {'count': count}) for note_id, count in settled])
+
+    def _reconcile(self):
+        """Forget queued downloads that another worker's queue thread committed"""
+        with self._lock:
+            group_ids = list(self._queued)
+        if not group_ids:
+            return
+        still_queued = self.queue.queued_groups(group_ids)
+        with self._lock:
+            settled = [self._unqueue(group_id) for group_id in group_ids if group_id not in still_queued]
+        if self.counter:
+            for note_id, _ in filter(None, settled):
+                # Whether they were committed is unknown here; re-read the shards
+                self.counter.forget(self.db.collection(self.notes_collection).document(note_id))
+
+    def _queue_note_write(self, batch, note_id: str, count: int):
+        doc_ref = self.db.collection(self.notes_collection).document(note_id)
+        if self.counter:
+            self.counter.increment(doc_ref, count, writer=batch)
+        else:
+            batch.update(doc_ref, {
+                'download_count': firestore.Increment(count),
+                'last_downloaded': firestore.SERVER_TIMESTAMP
+            })
+
+    def _queue_writes(self, batch, entries):
+        for note_id, entry in entries:
+            self._queue_note_write(batch, note_id, entry['count'])
+        if self.facets:
+            self.facets.add_downloads(batch, [(entry.get('note'), entry['count']) for _, entry in entries])
+
+    def _applied(self, entries):
+        if self.counter:
+            for note_id, entry in entries:
+                doc_ref = self.db.collection(self.notes_collection).document(note_id)
+                self.counter.applied(doc_ref, entry['count'])
+
+    def _requeue(self, note_id: str, entry: Dict):
+        with self._lock:
+            current = self._pending.get(note_id)
+            if current is None:
+                self._pending[note_id] = dict(entry)
+            else:
+                current['count'] += entry['count']
+                current['note'] = current.get('note') or entry.get('note')
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self.queue is not None:
+                    self._reconcile()
+            except Exception as e:
+                logger.error(f"Download counter flush error: {e}")
+
+    def close(self):
+        """Stop the background flusher and drain what is left"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending_notes': len(self._pending),
+                'pending_downloads': sum(entry['count'] for entry in self._pending.values()),
+                'inflight_downloads': sum(self._inflight.values()),
+                'queued_downloads': sum(self._queued_by_note.values()),
+                'flushes': self.flushes,
+                'flushed_downloads': self.flushed_increments,
+                'failures': self.failures,
+                'last_flush_at': self.last_flush_at,
+                'flush_interval': self.flush_interval,
+            }
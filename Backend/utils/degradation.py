@@ -0,0 +1,237 @@
+# Backend/utils/degradation.py
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Optional
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, jsonify
+
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+from utils.security import RateLimiter, SecurityUtils
+from utils.usage_db import get_usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Modes, from least to most restricted
+MODE_NORMAL = 'normal'
+MODE_CONSERVE = 'conserve'   # listings and stats from caches, admin scans rate-limited
+MODE_CRITICAL = 'critical'   # additionally, downloads are redirected or served from client caches
+MODES = (MODE_NORMAL, MODE_CONSERVE, MODE_CRITICAL)
+
+
+class DegradedUnavailable(Exception):
+    """The response is not cached and computing it is not allowed in this mode"""
+
+
+class DegradationPolicy:
+    """
+    Graduated response to usage budgets running out.
+
+    The mode follows the most used budget (storage, R2 Class A/B, Firestore
+    reads/writes): at conserve_percent listing and stats endpoints are
+    answered only from caches and admin scans are rate-limited, at
+    critical_percent downloads also stop streaming file content through the
+    server. The mode is re-evaluated every check_seconds and immediately when
+    the month (or Firestore day) rolls over, so the app returns to normal on
+    its own at the reset. The hard 429 at 100% is still applied by
+    track_usage.
+    """
+
+    def __init__(self, tracker, conserve_percent: float = 80.0, critical_percent: float = 95.0,
+                 check_seconds: float = 30.0, admin_scans_per_hour: int = 10,
+                 download_cache_seconds: int = 3600, forced_mode: Optional[str] = None):
+        self.tracker = tracker
+        self.conserve_percent = conserve_percent
+        self.critical_percent = critical_percent
+        self.check_seconds = check_seconds
+        # Presigned URL lifetime and client cache max-age for degraded downloads
+        self.download_cache_seconds = download_cache_seconds
+        self.forced_mode = forced_mode if forced_mode in MODES else None
+
+        self._mode = MODE_NORMAL
+        self._pressure: Dict[str, float] = {}
+        self._period = None
+        self._checked_at = 0.0
+        self._since = datetime.now(timezone.utc).isoformat()
+        self._lock = threading.Lock()
+
+        # Last good responses, served while computing them is not allowed
+        self._last_good = TTLCache(max_entries=256, ttl_seconds=float('inf'), name='degraded_responses')
+        self._scan_limiter = RateLimiter(admin_scans_per_hour, 3600)
+
+        self.transitions = 0
+        self.served_from_cache = 0
+        self.unavailable = 0
+        self.scans_limited = 0
+
+    def _budget_pressure(self) -> Dict[str, float]:
+        stats = self.tracker.get_usage_stats()
+        return {
+            'storage': stats['storage']['percentage_used'],
+            'class_a_operations': stats['class_a_operations']['percentage_used'],
+            'class_b_operations': stats['class_b_operations']['percentage_used'],
+            'firestore_reads': stats['firestore']['reads_percentage_used'],
+            'firestore_writes': stats['firestore']['writes_percentage_used'],
+        }
+
+    def _evaluate(self):
+        pressure = self._budget_pressure()
+        worst = max(pressure.values())
+        if self.forced_mode:
+            mode = self.forced_mode
+        elif worst >= self.critical_percent:
+            mode = MODE_CRITICAL
+        elif worst >= self.conserve_percent:
+            mode = MODE_CONSERVE
+        else:
+            mode = MODE_NORMAL
+
+        self._pressure = pressure
+        if mode != self._mode:
+            logger.warning(f"Degradation mode {self._mode} -> {mode} (highest budget use {worst}%)")
+            self._mode = mode
+            self._since = datetime.now(timezone.utc).isoformat()
+            self.transitions += 1
+
+    def mode(self) -> str:
+        """Current mode (re-evaluated at most every check_seconds, and at each reset)"""
+        if self.tracker.disabled:
+            return self.forced_mode or MODE_NORMAL
+        period = (self.tracker.get_current_month_key(), self.tracker.get_firestore_document_id())
+        now = time.monotonic()
+        if period == self._period and now - self._checked_at < self.check_seconds:
+            return self._mode
+        # One thread re-evaluates; the others keep using the current mode
+        if self._lock.acquire(blocking=self._period is None or period != self._period):
+            try:
+                if period != self._period or now - self._checked_at >= self.check_seconds:
+                    try:
+                        self._evaluate()
+                    except Exception as e:
+                        logger.error(f"Failed to evaluate degradation mode: {e}")
+                    self._period = period
+                    self._checked_at = time.monotonic()
+            finally:
+                self._lock.release()
+        return self._mode
+
+    def cache_only(self) -> bool:
+        return self.mode() != MODE_NORMAL
+
+    def redirect_downloads(self) -> bool:
+        return self.mode() == MODE_CRITICAL
+
+    def cached_or_compute(self, key: Hashable, compute: Callable[[], Any], free: bool = False) -> Any:
+        """
+        Compute a response in normal mode (remembering it), or serve the last one
+
+        Args:
+            key: Identifies the response (endpoint and parameters)
+            compute: Produces the response, possibly querying the backends
+            free: Computing is known not to hit a billed backend (e.g. the
+                notes mirror is healthy), so it is allowed in any mode
+
+        Raises:
+            DegradedUnavailable: Degraded, not free, and nothing cached
+        """
+        if free or not self.cache_only():
+            value = compute()
+            self._last_good.set(key, value)
+            return value
+        value = self._last_good.get_stale(key)
+        if value is None:
+            self.unavailable += 1
+            raise DegradedUnavailable(f"{key} is not cached")
+        self.served_from_cache += 1
+        return value
+
+    def allow_scan(self, identifier: str) -> bool:
+        """Admin scans are unlimited in normal mode and rate-limited otherwise"""
+        if not self.cache_only() or self._scan_limiter.is_allowed(identifier):
+            return True
+        self.scans_limited += 1
+        return False
+
+    def status(self) -> Dict:
+        """Mode report for the usage endpoint"""
+        mode = self.mode()
+        return {
+            'mode': mode,
+            'since': self._since,
+            'forced': self.forced_mode is not None,
+            'budget_percentage_used': dict(self._pressure),
+            'thresholds': {
+                MODE_CONSERVE: self.conserve_percent,
+                MODE_CRITICAL: self.critical_percent,
+            },
+            'restrictions': {
+                'cache_only_listings': mode != MODE_NORMAL,
+                'admin_scans_rate_limited': mode != MODE_NORMAL,
+                'downloads_redirected': mode == MODE_CRITICAL,
+            },
+        }
+
+    def stats(self) -> Dict:
+        return {
+            'mode': self.mode(),
+            'transitions': self.transitions,
+            'served_from_cache': self.served_from_cache,
+            'unavailable': self.unavailable,
+            'scans_limited': self.scans_limited,
+            'cached_responses': len(self._last_good),
+        }
+
+
+def degraded_response():
+    """503 for a response that cannot be served in the current mode"""
+    policy = get_degradation_policy()
+    response = jsonify({
+        'error': 'Temporarily unavailable while usage is close to its limits',
+        'code': 'DEGRADED_MODE',
+        'mode': policy.mode()
+    })
+    response.headers['Retry-After'] = str(int(policy.check_seconds))
+    return response, 503
+
+
+def limit_admin_scans(f):
+    """Rate-limit an expensive admin endpoint while the app is degraded"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        current_user = kwargs.get('current_user') or {}
+        identifier = current_user.get('uid') or SecurityUtils.get_client_ip()
+        if not get_degradation_policy().allow_scan(identifier):
+            return jsonify({
+                'error': 'Admin scans are rate-limited while usage is close to its limits',
+                'code': 'DEGRADED_RATE_LIMIT'
+            }), 429
+        return current_app.ensure_sync(f)(*args, **kwargs)
+
+    return decorated_function
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_degradation_policy() -> DegradationPolicy:
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                policy = DegradationPolicy(
+                    get_usage_tracker(),
+                    conserve_percent=float(os.getenv('DEGRADE_CONSERVE_PERCENT', 80)),
+                    critical_percent=float(os.getenv('DEGRADE_CRITICAL_PERCENT', 95)),
+                    check_seconds=float(os.getenv('DEGRADE_CHECK_SECONDS', 30)),
+                    admin_scans_per_hour=int(os.getenv('DEGRADE_ADMIN_SCANS_PER_HOUR', 10)),
+                    download_cache_seconds=int(os.getenv('DEGRADE_DOWNLOAD_CACHE_SECONDS', 3600)),
+                    forced_mode=os.getenv('DEGRADE_FORCE_MODE') or None,
+                )
+                register_metrics('degradation', policy.stats)
+                _policy = policy
+    return _policy
@@ -0,0 +1,273 @@
+# Backend/utils/disk_cache.py
+from typing import Any, Callable, Dict, Iterable, Optional
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Namespaces shared by the note cache and aggregate endpoints
+NOTES_NAMESPACE = 'notes'
+AGGREGATES_NAMESPACE = 'aggregates'
+
+# Prune expired/over-limit rows after this many writes
+PRUNE_EVERY_WRITES = 200
+
+# Don't rewrite accessed_at on reads more often than this (seconds)
+TOUCH_INTERVAL = 60
+
+_MISSING = object()
+
+
+class DiskCache:
+    """
+    Persistent SQLite-backed cache tier shared by all workers on a host.
+
+    Values are stored as JSON per (namespace, key) with an expiry. Every
+    namespace has a version number; bump_namespace() invalidates all of its
+    entries at once without touching them (stale versions read as misses
+    and are pruned later). Size is bounded by max_bytes, evicting the least
+    recently accessed rows. Because the file survives restarts, a recycled
+    worker warms up from local disk instead of from Firestore.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._versions: Dict[str, tuple] = {}
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.errors = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS namespaces (
+                namespace TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )''')
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets workers read while one writes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _version(self, namespace: str) -> int:
+        """Current namespace version, re-read at most once a second (other workers may bump it)"""
+        cached = self._versions.get(namespace)
+        now = time.monotonic()
+        if cached and now - cached[1] < 1.0:
+            return cached[0]
+        row = self._conn().execute(
+            'SELECT version FROM namespaces WHERE namespace = ?', (namespace,)
+        ).fetchone()
+        version = row[0] if row else 0
+        self._versions[namespace] = (version, now)
+        return version
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        values = self.get_many(namespace, [key])
+        return values.get(key, default)
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """Fresh values for the keys that are cached (missing keys are omitted)"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            version = self._version(namespace)
+            now = time.time()
+            conn = self._conn()
+            placeholders = ','.join('?' * len(keys))
+            rows = conn.execute(
+                f'SELECT key, value, accessed_at FROM entries '
+                f'WHERE namespace = ? AND version = ? AND expires_at > ? AND key IN ({placeholders})',
+                (namespace, version, now, *keys)
+            ).fetchall()
+            found = {key: json.loads(value) for key, value, _ in rows}
+            touched = [key for key, _, accessed_at in rows if now - accessed_at > TOUCH_INTERVAL]
+            if touched:
+                conn.executemany(
+                    'UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                    [(now, namespace, key) for key in touched]
+                )
+        except (sqlite3.Error, ValueError) as e:
+            self.errors += 1
+            logger.warning(f"Disk cache read failed: {e}")
+            found = {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, namespace: str, key: str, value: Any, ttl_seconds: float):
+        self.set_many(namespace, {key: value}, ttl_seconds)
+
+    def set_many(self, namespace: str, values: Dict[str, Any], ttl_seconds: float,
+                 version: Optional[int] = None):
+        """
+        Store JSON-serializable values; values that cannot be serialized are skipped
+
+        Pass the namespace version read before computing the values so a bump
+        that happened meanwhile leaves them invalid.
+        """
+        now = time.time()
+        rows = []
+        for key, value in values.items():
+            try:
+                encoded = json.dumps(value)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Disk cache skipped {namespace}/{key}, not JSON-serializable: {e}")
+                continue
+            rows.append((namespace, key, encoded, len(encoded), now + ttl_seconds, now))
+        if not rows:
+            return
+        try:
+            if version is None:
+                version = self._version(namespace)
+            self._conn().executemany(
+                'INSERT OR REPLACE INTO entries (namespace, key, version, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(ns, key, version, encoded, size, expires, now) for ns, key, encoded, size, expires, now in rows]
+            )
+            self.sets += len(rows)
+            self._writes += len(rows)
+            if self._writes >= PRUNE_EVERY_WRITES:
+                self._writes = 0
+                self.prune()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Disk cache write failed: {e}")
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self._conn().execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Disk cache delete failed: {e}")
+
+    def namespace_version(self, namespace: str) -> Optional[int]:
+        """Current version of a namespace, or None if it can't be read"""
+        try:
+            return self._version(namespace)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Disk cache version read failed: {e}")
+            return None
+
+    def bump_namespace(self, namespace: str):
+        """Invalidate every entry in a namespace by moving it to a new version"""
+        try:
+            self._conn().execute(
+                'INSERT INTO namespaces (namespace, version) VALUES (?, 1) '
+                'ON CONFLICT(namespace) DO UPDATE SET version = version + 1',
+                (namespace,)
+            )
+            self._versions.pop(namespace, None)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Disk cache namespace bump failed: {e}")
+
+    def get_or_compute(self, namespace: str, key: str, fn: Callable[[], Any], ttl_seconds: float) -> Any:
+        value = self.get(namespace, key, _MISSING)
+        if value is _MISSING:
+            version = self._version(namespace)
+            value = fn()
+            self.set_many(namespace, {key: value}, ttl_seconds, version=version)
+        return value
+
+    def prune(self):
+        """Drop expired and stale-version rows, then the least recently used rows over max_bytes"""
+        conn = self._conn()
+        conn.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM entries WHERE version < '
+            '(SELECT version FROM namespaces WHERE namespaces.namespace = entries.namespace)'
+        )
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - int(self.max_bytes * 0.9)
+            conn.execute(
+                'DELETE FROM entries WHERE rowid IN ('
+                ' SELECT rowid FROM (SELECT rowid, SUM(size) OVER ('
+                '  ORDER BY accessed_at ROWS UNBOUNDED PRECEDING) - size AS before FROM entries)'
+                ' WHERE before < ?)',
+                (excess,)
+            )
+
+    def stats(self) -> Dict:
+        try:
+            rows, size = self._conn().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+            ).fetchone()
+        except sqlite3.Error:
+            rows, size = None, None
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'rows': rows,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'sets': self.sets,
+            'errors': self.errors,
+        }
+
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache() -> Optional[DiskCache]:
+    """Get the persistent cache, or None when DISK_CACHE_PATH is not set"""
+    global _disk_cache
+    path = os.getenv('DISK_CACHE_PATH')
+    if not path:
+        return None
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                cache = DiskCache(path, max_bytes=int(os.getenv('DISK_CACHE_MAX_MB', 64)) * 1024 * 1024)
+                register_metrics('disk_cache', cache.stats)
+                _disk_cache = cache
+    return _disk_cache
+
+
+def disk_cached(key: str, fn: Callable[[], Any], ttl_seconds: float = None) -> Any:
+    """
+    Serve an aggregate result from the disk cache, computing it on a miss
+
+    Aggregates are invalidated together whenever a note is written.
+    """
+    cache = get_disk_cache()
+    if cache is None:
+        return fn()
+    if ttl_seconds is None:
+        ttl_seconds = float(os.getenv('DISK_CACHE_AGGREGATE_TTL_SECONDS', 30))
+    return cache.get_or_compute(AGGREGATES_NAMESPACE, key, fn, ttl_seconds)
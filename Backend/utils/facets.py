@@ -0,0 +1,198 @@
+# Backend/utils/facets.py
+from firebase_admin import firestore
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+import os
+import random
+
+logger = logging.getLogger(__name__)
+
+FACETS_COLLECTION = 'note_facets'
+FACETS_DOCUMENT = 'catalog'
+# Download totals live in shard documents under the facet document
+DOWNLOAD_SHARDS_COLLECTION = 'download_shards'
+
+
+FACET_FIELDS = (('subjects', 'subject'), ('departments', 'department'))
+
+
+def facet_key(value) -> Optional[str]:
+    """Normalize a subject/department value into its facet key (None for empty values)"""
+    return str(value or '').strip() or None
+
+
+def compute_facets(notes: Iterable[Dict]) -> Dict:
+    """
+    Build facet counts from a full list of notes
+
+    Returns:
+        dict: {'subjects': {name: {count}}, 'departments': {...}}
+    """
+    facets = {'subjects': {}, 'departments': {}}
+    for note in notes:
+        for group, field in FACET_FIELDS:
+            key = facet_key(note.get(field))
+            if key:
+                facets[group].setdefault(key, {'count': 0})['count'] += 1
+    return facets
+
+
+def compute_download_totals(notes: Iterable[Dict]) -> Dict:
+    """
+    Sum download counts per subject and department
+
+    Returns:
+        dict: {'subjects': {name: downloads}, 'departments': {...}}
+    """
+    totals = {'subjects': {}, 'departments': {}}
+    for note in notes:
+        for group, field in FACET_FIELDS:
+            key = facet_key(note.get(field))
+            if key:
+                totals[group][key] = totals[group].get(key, 0) + (note.get('download_count', 0) or 0)
+    return totals
+
+
+class NoteFacets:
+    """
+    Materialized per-subject and per-department note counts and download totals.
+
+    Note counts live in a single Firestore document so listing subjects or
+    building subject/department statistics is one document read instead of a
+    scan of the notes collection. Writers apply increments in the same batch
+    or transaction as the note write they describe. Only creates, deletes and
+    subject/department changes touch the document. Downloads go to one of
+    download_shards shard documents chosen at random (summed on read with one
+    get_all), so they never make the facet document an app-wide hot spot.
+    Lowering FACET_DOWNLOAD_SHARDS loses the totals in the dropped shards;
+    run `flask rebuild-facets` after changing it.
+    """
+
+    def __init__(self, db, download_shards: Optional[int] = None):
+        self.db = db
+        self.doc_ref = db.collection(FACETS_COLLECTION).document(FACETS_DOCUMENT)
+        if download_shards is None:
+            download_shards = int(os.getenv('FACET_DOWNLOAD_SHARDS', 10))
+        self.download_shards = max(1, download_shards)
+
+    def download_shard_refs(self):
+        shards = self.doc_ref.collection(DOWNLOAD_SHARDS_COLLECTION)
+        return [shards.document(str(i)) for i in range(self.download_shards)]
+
+    def _write(self, writer, deltas: Dict[str, Dict[str, int]]):
+        payload = {
+            group: {key: {'count': firestore.Increment(n)} for key, n in counts.items() if n}
+            for group, counts in deltas.items()
+        }
+        payload = {group: counts for group, counts in payload.items() if counts}
+        if not payload:
+            return
+        payload['updated_at'] = firestore.SERVER_TIMESTAMP
+        writer.set(self.doc_ref, payload, merge=True)
+
+    def apply(self, writer, note: Dict, notes: int):
+        """
+        Queue facet increments on a WriteBatch or Transaction
+
+        Args:
+            writer: Firestore WriteBatch or Transaction the note write is part of
+            note: Note data (subject and department are used)
+            notes: Change in note count
+        """
+        deltas = {'subjects': {}, 'departments': {}}
+        for group, field in FACET_FIELDS:
+            key = facet_key(note.get(field))
+            if key:
+                deltas[group][key] = notes
+        self._write(writer, deltas)
+
+    def apply_change(self, writer, old_note: Dict, new_note: Dict):
+        """
+        Queue the move of a note between subjects/departments as one write
+
+        Args:
+            writer: Firestore WriteBatch or Transaction the note update is part of
+            old_note: Note data before the update
+            new_note: Note data after the update
+        """
+        deltas = {'subjects': {}, 'departments': {}}
+        for group, field in FACET_FIELDS:
+            old_key, new_key = facet_key(old_note.get(field)), facet_key(new_note.get(field))
+            if old_key == new_key:
+                continue
+            if old_key:
+                deltas[group][old_key] = -1
+            if new_key:
+                deltas[group][new_key] = 1
+        self._write(writer, deltas)
+
+    def add_downloads(self, writer, downloads: Iterable[Tuple[Optional[Dict], int]]):
+        """
+        Queue download total increments on one random shard
+
+        Args:
+            writer: Firestore WriteBatch, Transaction or queued writer
+            downloads: (note data, downloads) pairs; notes without data are skipped
+        """
+        deltas = {'subjects': {}, 'departments': {}}
+        for note, count in downloads:
+            if not note or not count:
+                continue
+            for group, field in FACET_FIELDS:
+                key = facet_key(note.get(field))
+                if key:
+                    deltas[group][key] = deltas[group].get(key, 0) + count
+        payload = {
+            group: {key: firestore.Increment(n) for key, n in counts.items() if n}
+            for group, counts in deltas.items()
+        }
+        payload = {group: counts for group, counts in payload.items() if counts}
+        if payload:
+            writer.set(random.choice(self.download_shard_refs()), payload, merge=True)
+
+    def read_downloads(self) -> Dict:
+        """
+        Sum the download shards
+
+        Returns:
+            dict: {'subjects': {name: downloads}, 'departments': {...}}
+        """
+        totals = {'subjects': {}, 'departments': {}}
+        for shard in self.db.get_all(self.download_shard_refs()):
+            if not shard.exists:
+                continue
+            data = shard.to_dict()
+            for group in totals:
+                for key, n in (data.get(group) or {}).items():
+                    totals[group][key] = totals[group].get(key, 0) + (n or 0)
+        return {group: {k: n for k, n in counts.items() if n > 0} for group, counts in totals.items()}
+
+    def read(self) -> Optional[Dict]:
+        """Read the facet document, or None if it has never been built"""
+        doc = self.doc_ref.get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        return {
+            'subjects': {k: v for k, v in data.get('subjects', {}).items() if v.get('count', 0) > 0},
+            'departments': {k: v for k, v in data.get('departments', {}).items() if v.get('count', 0) > 0},
+        }
+
+    def rebuild(self, notes: Iterable[Dict]) -> Dict:
+        """
+        Overwrite the facet document and download shards from a full list of notes (backfill)
+
+        download_count of each note must already include its sharded downloads.
+        """
+        notes = list(notes)
+        facets = compute_facets(notes)
+        batch = self.db.batch()
+        batch.set(self.doc_ref, {**facets, 'updated_at': firestore.SERVER_TIMESTAMP})
+        for i, shard_ref in enumerate(self.download_shard_refs()):
+            batch.set(shard_ref, compute_download_totals(notes) if i == 0 else {})
+        batch.commit()
+        logger.info(
+            f"Rebuilt note facets: {len(facets['subjects'])} subjects, "
+            f"{len(facets['departments'])} departments"
+        )
+        return facets
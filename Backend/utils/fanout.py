@@ -0,0 +1,170 @@
+# Backend/utils/fanout.py
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Default deadline (seconds) for a fanned-out call
+FANOUT_DEFAULT_TIMEOUT = float(os.getenv('FANOUT_TIMEOUT_SECONDS', 10))
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+_stats = {'fanouts': 0, 'calls': 0, 'timeouts': 0, 'errors': 0, 'inline': 0}
+
+
+def _mark_pool_thread():
+    _local.in_pool = True
+
+
+def get_fanout_executor() -> ThreadPoolExecutor:
+    """
+    The process-wide bounded pool used for concurrent I/O.
+
+    Sharing one pool (instead of a pool per request) caps the number of
+    threads a burst of requests can create; FANOUT_MAX_WORKERS sets the bound.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('FANOUT_MAX_WORKERS', 16)),
+                    thread_name_prefix='fanout',
+                    initializer=_mark_pool_thread
+                )
+                register_metrics('fanout', fanout_stats)
+    return _executor
+
+
+def _in_pool() -> bool:
+    return getattr(_local, 'in_pool', False)
+
+
+def _claim(future) -> bool:
+    """
+    True if a nested call should run in the current thread instead
+
+    A fan-out issued from a pool thread must never block on children still
+    queued behind it (with every worker waiting that is a deadlock), so the
+    parent takes back any child no worker has started yet.
+    """
+    if _in_pool() and future.cancel():
+        _stats['inline'] += 1
+        return True
+    return False
+
+
+def _submit(fn: Callable, *args):
+    # Copy contextvars so Flask's app/request context is visible in the worker
+    return get_fanout_executor().submit(contextvars.copy_context().run, fn, *args)
+
+
+def fan_out(calls: Dict[str, Callable[[], Any]],
+            timeout: Union[float, Dict[str, float], None] = None,
+            defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run independent zero-argument calls concurrently
+
+    Args:
+        calls: Name -> callable
+        timeout: Deadline in seconds for every call, or a per-name mapping
+        defaults: Name -> value returned when that call fails or misses its
+            deadline; calls without a default re-raise
+
+    Returns:
+        dict: Name -> result
+    """
+    defaults = defaults or {}
+    _stats['fanouts'] += 1
+    _stats['calls'] += len(calls)
+
+    if len(calls) <= 1:
+        futures = None
+    else:
+        futures = {name: _submit(fn) for name, fn in calls.items()}
+
+    started = time.monotonic()
+    results = {}
+    for name, fn in calls.items():
+        deadline = timeout.get(name, FANOUT_DEFAULT_TIMEOUT) if isinstance(timeout, dict) else timeout
+        if deadline is None:
+            deadline = FANOUT_DEFAULT_TIMEOUT
+        try:
+            if futures is None or _claim(futures[name]):
+                results[name] = fn()
+            else:
+                results[name] = futures[name].result(timeout=max(0.0, started + deadline - time.monotonic()))
+        except FuturesTimeout:
+            _stats['timeouts'] += 1
+            futures[name].cancel()
+            if name not in defaults:
+                raise
+            logger.warning(f"Fan-out call '{name}' missed its {deadline}s deadline")
+            results[name] = defaults[name]
+        except Exception as e:
+            _stats['errors'] += 1
+            if name not in defaults:
+                raise
+            logger.error(f"Fan-out call '{name}' failed: {e}")
+            results[name] = defaults[name]
+    return results
+
+
+def fan_map(fn: Callable[[Any], Any], items: Iterable, max_parallel: int = None,
+            timeout: float = None) -> List[Any]:
+    """
+    Apply fn to every item concurrently, keeping at most max_parallel in flight
+
+    Returns:
+        list: Results in the order of items (the first failure is re-raised)
+    """
+    items = list(items)
+    _stats['fanouts'] += 1
+    _stats['calls'] += len(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+
+    deadline = time.monotonic() + (timeout if timeout is not None else FANOUT_DEFAULT_TIMEOUT)
+    window = max_parallel or len(items)
+    results: List[Any] = [None] * len(items)
+    pending = {}
+    next_index = 0
+    try:
+        while next_index < len(items) or pending:
+            while next_index < len(items) and len(pending) < window:
+                pending[_submit(fn, items[next_index])] = next_index
+                next_index += 1
+            for future in [future for future in pending if _claim(future)]:
+                index = pending.pop(future)
+                results[index] = fn(items[index])
+            if not pending:
+                continue
+            done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                _stats['timeouts'] += 1
+                raise FuturesTimeout(f"fan_map missed its deadline with {len(pending)} calls pending")
+            for future in done:
+                results[pending.pop(future)] = future.result()
+    except Exception:
+        for future in pending:
+            future.cancel()
+        raise
+    return results
+
+
+def fanout_stats() -> Dict:
+    executor = get_fanout_executor()
+    return {
+        **_stats,
+        'max_workers': executor._max_workers,
+        'threads': len(executor._threads),
+        'queued': executor._work_queue.qsize(),
+    }
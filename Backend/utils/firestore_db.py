@@ -7,16 +7,119 @@ import os
 import json
 import uuid
 from pathlib import Path
+from utils.facets import NoteFacets, compute_facets
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+from utils.fanout import fan_map
+from utils.disk_cache import AGGREGATES_NAMESPACE, NOTES_NAMESPACE, DiskCache, disk_cached, get_disk_cache
+from utils.counters import DownloadCounterBuffer, ShardedCounter
+from utils.notes_mirror import NotesMirror
+from utils.write_queue import get_write_queue
+from utils.operations import record_backend_operation
+from utils.resilience import get_dependency
 
 
 logger = logging.getLogger(__name__)
 
+# Documents per get_all() round trip and how many round trips run at once
+GET_ALL_CHUNK_SIZE = 100
+GET_ALL_MAX_PARALLEL = 4
+
+# Callbacks notified after every note write, see add_note_listener()
+_note_listeners = []
+
+
+def add_note_listener(callback):
+    """
+    Register a callback for note writes
+
+    Args:
+        callback: Callable taking (event, note_id, note) where event is one of
+            'created', 'updated' or 'deleted'. For 'updated' the note only
+            contains the changed fields.
+    """
+    if callback not in _note_listeners:
+        _note_listeners.append(callback)
+
+
+def _notify_note_listeners(event: str, note_id: str, note: Optional[Dict]):
+    """Fan a note write out to registered listeners without failing the write"""
+    for callback in list(_note_listeners):
+        try:
+            callback(event, note_id, note or {})
+        except Exception as e:
+            logger.error(f"Note listener error on {event}: {e}")
+
+
+@firestore.transactional
+def _delete_note_in_transaction(transaction, doc_ref, facets: NoteFacets,
+                                counter: Optional[ShardedCounter] = None,
+                                sharded_downloads: int = 0) -> Optional[Dict]:
+    """Delete a note (and its counter shards) and release its facet counts and downloads atomically"""
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    note = snapshot.to_dict()
+    if counter:
+        counter.delete(doc_ref, transaction)
+    transaction.delete(doc_ref)
+    facets.apply(transaction, note, notes=-1)
+    facets.add_downloads(transaction, [(note, -((note.get('download_count', 0) or 0) + sharded_downloads))])
+    return note
+
+
+@firestore.transactional
+def _update_note_in_transaction(transaction, doc_ref, update_data: Dict, facets: NoteFacets,
+                                sharded_downloads: int = 0) -> bool:
+    """Update a note and move its facet counts and downloads to its new subject/department atomically"""
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+    note = snapshot.to_dict()
+    updated = {**note, **update_data}
+    transaction.update(doc_ref, update_data)
+    facets.apply_change(transaction, note, updated)
+    downloads = (note.get('download_count', 0) or 0) + sharded_downloads
+    facets.add_downloads(transaction, [(note, -downloads), (updated, downloads)])
+    return True
+
+
 class FirestoreNotesDB:
     def __init__(self):
         """Initialize Firestore database client"""
         try:
             self.db = firestore.client()
             self.notes_collection = 'notes'
+            self.facets = NoteFacets(self.db)
+            self.download_counter = None
+            if int(os.getenv('DOWNLOAD_COUNT_SHARDS', 0)) > 0:
+                self.download_counter = ShardedCounter(
+                    self.db,
+                    'download_count',
+                    num_shards=int(os.getenv('DOWNLOAD_COUNT_SHARDS')),
+                    cache_ttl=float(os.getenv('SHARDED_COUNTER_CACHE_SECONDS', 10)),
+                    timestamp_field='last_downloaded'
+                )
+                register_metrics('download_count_shards', self.download_counter.stats)
+            self.download_buffer = None
+            if os.getenv('DOWNLOAD_BUFFER_ENABLED', 'true').lower() == 'true':
+                self.download_buffer = DownloadCounterBuffer(
+                    self.db,
+                    self.notes_collection,
+                    flush_interval=float(os.getenv('DOWNLOAD_BUFFER_FLUSH_SECONDS', 5)),
+                    max_pending=int(os.getenv('DOWNLOAD_BUFFER_MAX_PENDING', 500)),
+                    counter=self.download_counter,
+                    queue=get_write_queue(),
+                    facets=self.facets
+                )
+                register_metrics('download_buffer', self.download_buffer.stats)
+            # Deadlines, circuit breaker and last-good fallback for every RPC below
+            self.resilience = get_dependency('firestore')
+            self.mirror = None
+            if os.getenv('NOTES_MIRROR_ENABLED', 'false').lower() == 'true':
+                self.mirror = NotesMirror(self.db.collection(self.notes_collection), self._snapshot_to_note)
+                self.mirror.start()
+                register_metrics('notes_mirror', self.mirror.stats)
             logger.info("Firestore client initialized successfully")
         except Exception as e:
             logger.error("Failed to initialize Firestore client")
@@ -42,11 +145,17 @@ class FirestoreNotesDB:
             doc_data['created_at'] = firestore.SERVER_TIMESTAMP
             doc_data['updated_at'] = firestore.SERVER_TIMESTAMP
             
-            # Create document with auto-generated ID
+            # Create document with auto-generated ID, counting it in the facets atomically
             doc_ref = self.db.collection(self.notes_collection).document()
-            doc_ref.set(doc_data)
+            batch = self.db.batch()
+            batch.set(doc_ref, doc_data)
+            self.facets.apply(batch, doc_data, notes=1)
+            record_backend_operation('firestore', 'write', 2)
+            # Not abandoned at a deadline: the note may still be committed
+            self.resilience.guard('create_note', batch.commit)
             
             logger.info("Note created successfully")
+            _notify_note_listeners('created', doc_ref.id, note_data)
             return doc_ref.id
             
         except Exception as e:
@@ -68,7 +177,11 @@ class FirestoreNotesDB:
         """
         try:
             doc_ref = self.db.collection(self.notes_collection).document(note_id)
-            doc = doc_ref.get()
+            doc = self.resilience.call(
+                'get_note', lambda timeout: doc_ref.get(timeout=timeout), key=('note', note_id), hedge=True,
+                on_hedge=lambda: record_backend_operation('firestore', 'read')
+            )
+            record_backend_operation('firestore', 'read')
             
             if doc.exists:
                 note_data = doc.to_dict()
@@ -80,7 +193,7 @@ class FirestoreNotesDB:
                     note_data['updated_at'] = note_data['updated_at'].isoformat()
                 if 'last_downloaded' in note_data and note_data['last_downloaded']:
                     note_data['last_downloaded'] = note_data['last_downloaded'].isoformat()
-                return note_data
+                return self._finalize_notes([note_data])[0]
             else:
                 return None
                 
@@ -90,6 +203,67 @@ class FirestoreNotesDB:
                 logger.error(f"Get note error: {e}")
             return None
     
+    def _finalize_notes(self, notes: List[Dict]) -> List[Dict]:
+        """Fold sharded and buffered (not yet flushed) downloads into notes read from Firestore"""
+        if self.download_counter:
+            notes_ref = self.db.collection(self.notes_collection)
+            self.download_counter.merge_into(notes, lambda note: notes_ref.document(note['id']))
+        if self.download_buffer:
+            for note in notes:
+                self.download_buffer.merge_into(note)
+        return notes
+    
+    def _snapshot_to_note(self, doc) -> Dict:
+        """Convert a document snapshot into a JSON-serializable note dict"""
+        note_data = doc.to_dict()
+        note_data['id'] = doc.id
+        for field in ('created_at', 'updated_at', 'last_downloaded'):
+            if note_data.get(field):
+                note_data[field] = note_data[field].isoformat()
+        return note_data
+    
+    def get_notes_many(self, note_ids: List[str]) -> List[Dict]:
+        """
+        Get several notes by ID in batched round trips
+        
+        Args:
+            note_ids: Document IDs of the notes
+            
+        Returns:
+            list: Notes in the order of note_ids (duplicates and missing notes skipped)
+        """
+        try:
+            unique_ids = list(dict.fromkeys(note_id for note_id in note_ids if note_id))
+            if not unique_ids:
+                return []
+            
+            notes_ref = self.db.collection(self.notes_collection)
+            chunks = [unique_ids[i:i + GET_ALL_CHUNK_SIZE] for i in range(0, len(unique_ids), GET_ALL_CHUNK_SIZE)]
+            
+            def fetch(chunk):
+                refs = [notes_ref.document(note_id) for note_id in chunk]
+                return self.resilience.call(
+                    'get_notes_many', lambda timeout: list(self.db.get_all(refs, timeout=timeout)), hedge=True,
+                    on_hedge=lambda: record_backend_operation('firestore', 'read', len(chunk))
+                )
+            
+            batches = fan_map(fetch, chunks, max_parallel=GET_ALL_MAX_PARALLEL)
+            record_backend_operation('firestore', 'read', len(unique_ids))
+            
+            found = {}
+            for batch in batches:
+                for doc in batch:
+                    if doc.exists:
+                        found[doc.id] = self._snapshot_to_note(doc)
+            
+            return self._finalize_notes([found[note_id] for note_id in unique_ids if note_id in found])
+            
+        except Exception as e:
+            logger.error("Error getting notes from Firestore")
+            if current_app and current_app.debug:
+                logger.error(f"Get notes many error: {e}")
+            return []
+    
     def get_all_notes(self, limit: int = 100) -> List[Dict]:
         """
         Get all notes, ordered by creation date (newest first)
@@ -101,9 +275,17 @@ class FirestoreNotesDB:
             list: List of note dictionaries with IDs included
         """
         try:
+            if self.mirror and self.mirror.is_healthy():
+                return self._finalize_notes(self.mirror.get_all_notes(limit))
+            
             notes_ref = self.db.collection(self.notes_collection)
             query = notes_ref.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
-            docs = query.stream()
+            # A duplicate query is counted at its limit, the most it can bill
+            docs = self.resilience.call(
+                'get_all_notes', lambda timeout: list(query.stream(timeout=timeout)), key=('all', limit), hedge=True,
+                on_hedge=lambda: record_backend_operation('firestore', 'read', limit)
+            )
+            record_backend_operation('firestore', 'read', max(1, len(docs)))
             
             notes = []
             for doc in docs:
@@ -118,7 +300,7 @@ class FirestoreNotesDB:
                     note_data['last_downloaded'] = note_data['last_downloaded'].isoformat()
                 notes.append(note_data)
             
-            return notes
+            return self._finalize_notes(notes)
             
         except Exception as e:
             logger.error("Error getting notes from Firestore")
@@ -126,6 +308,24 @@ class FirestoreNotesDB:
                 logger.error(f"Get all notes error: {e}")
             return []
     
+    def scan_notes(self) -> List[Dict]:
+        """
+        Get every note, with sharded and buffered downloads folded in
+        
+        Returns:
+            list: All note dictionaries (from the mirror when it is healthy)
+            
+        Raises:
+            Exception: The collection could not be read
+        """
+        if self.mirror and self.mirror.is_healthy():
+            return self._finalize_notes(self.mirror.get_all_notes(limit=None))
+        
+        notes_ref = self.db.collection(self.notes_collection)
+        docs = self.resilience.call('scan_notes', lambda timeout: list(notes_ref.stream(timeout=timeout)), deadline=30)
+        record_backend_operation('firestore', 'read', max(1, len(docs)))
+        return self._finalize_notes([self._snapshot_to_note(doc) for doc in docs])
+    
     def get_notes_by_user(self, user_id: str, limit: int = 100) -> List[Dict]:
         """
         Get notes uploaded by a specific user
@@ -138,12 +338,20 @@ class FirestoreNotesDB:
             list: List of note dictionaries
         """
         try:
+            if self.mirror and self.mirror.is_healthy():
+                return self._finalize_notes(self.mirror.get_notes_by_user(user_id, limit))
+            
             notes_ref = self.db.collection(self.notes_collection)
             query = (notes_ref
                     .where('uploaded_by', '==', user_id)
                     .order_by('created_at', direction=firestore.Query.DESCENDING)
                     .limit(limit))
-            docs = query.stream()
+            docs = self.resilience.call(
+                'get_notes_by_user', lambda timeout: list(query.stream(timeout=timeout)),
+                key=('user', user_id, limit), hedge=True,
+                on_hedge=lambda: record_backend_operation('firestore', 'read', limit)
+            )
+            record_backend_operation('firestore', 'read', max(1, len(docs)))
             
             notes = []
             for doc in docs:
@@ -157,7 +365,7 @@ class FirestoreNotesDB:
                     note_data['last_downloaded'] = note_data['last_downloaded'].isoformat()
                 notes.append(note_data)
             
-            return notes
+            return self._finalize_notes(notes)
             
         except Exception as e:
             logger.error("Error getting user notes from Firestore")
@@ -178,6 +386,9 @@ class FirestoreNotesDB:
             list: List of filtered note dictionaries
         """
         try:
+            if self.mirror and self.mirror.is_healthy():
+                return self._finalize_notes(self.mirror.get_notes_by_filters(subject, department, limit))
+            
             notes_ref = self.db.collection(self.notes_collection)
             query = notes_ref
             
@@ -189,7 +400,12 @@ class FirestoreNotesDB:
             
             # Order and limit
             query = query.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
-            docs = query.stream()
+            docs = self.resilience.call(
+                'get_notes_by_filters', lambda timeout: list(query.stream(timeout=timeout)),
+                key=('filters', subject, department, limit), hedge=True,
+                on_hedge=lambda: record_backend_operation('firestore', 'read', limit)
+            )
+            record_backend_operation('firestore', 'read', max(1, len(docs)))
             
             notes = []
             for doc in docs:
@@ -203,7 +419,7 @@ class FirestoreNotesDB:
                     note_data['last_downloaded'] = note_data['last_downloaded'].isoformat()
                 notes.append(note_data)
             
-            return notes
+            return self._finalize_notes(notes)
             
         except Exception as e:
             logger.error("Error filtering notes from Firestore")
@@ -227,9 +443,22 @@ class FirestoreNotesDB:
             update_data['updated_at'] = firestore.SERVER_TIMESTAMP
             
             doc_ref = self.db.collection(self.notes_collection).document(note_id)
-            doc_ref.update(update_data)
+            if 'subject' in update_data or 'department' in update_data:
+                # Transaction: read the note, update it, move its facet counts and downloads
+                sharded_downloads = self.download_counter.get_total(doc_ref) if self.download_counter else 0
+                record_backend_operation('firestore', 'read')
+                record_backend_operation('firestore', 'write', 3)
+                if not self.resilience.guard('update_note', lambda: _update_note_in_transaction(
+                    self.db.transaction(), doc_ref, update_data, self.facets, sharded_downloads
+                )):
+                    return False
+            else:
+                record_backend_operation('firestore', 'write')
+                self.resilience.call('update_note', lambda timeout: doc_ref.update(update_data, timeout=timeout))
+            self.resilience.forget(('note', note_id))
             
             logger.info("Note updated successfully")
+            _notify_note_listeners('updated', note_id, update_data)
             return True
             
         except Exception as e:
@@ -238,21 +467,32 @@ class FirestoreNotesDB:
                 logger.error(f"Update note error: {e}")
             return False
     
-    def delete_note(self, note_id: str) -> bool:
+    def delete_note(self, note_id: str, note: Optional[Dict] = None) -> bool:
         """
         Delete a note document
         
         Args:
             note_id: Document ID of the note
+            note: Already loaded note data, passed on to note listeners
             
         Returns:
             bool: True if successful, False otherwise
         """
         try:
             doc_ref = self.db.collection(self.notes_collection).document(note_id)
-            doc_ref.delete()
+            sharded_downloads = self.download_counter.get_total(doc_ref) if self.download_counter else 0
+            # Not under a deadline: a delete abandoned at the deadline could still commit
+            deleted_note = self.resilience.guard('delete_note', lambda: _delete_note_in_transaction(
+                self.db.transaction(), doc_ref, self.facets, self.download_counter, sharded_downloads
+            ))
+            self.resilience.forget(('note', note_id))
+            # Transaction: read the note, delete it and its shards, update the facets and download totals
+            record_backend_operation('firestore', 'read')
+            shards = self.download_counter.num_shards if self.download_counter else 0
+            record_backend_operation('firestore', 'write', 3 + shards)
             
             logger.info("Note deleted successfully")
+            _notify_note_listeners('deleted', note_id, deleted_note or note)
             return True
             
         except Exception as e:
@@ -261,22 +501,37 @@ class FirestoreNotesDB:
                 logger.error(f"Delete note error: {e}")
             return False
     
-    def increment_download_count(self, note_id: str) -> bool:
+    def increment_download_count(self, note_id: str, note: Optional[Dict] = None) -> bool:
         """
         Increment the download count for a note
         
         Args:
             note_id: Document ID of the note
+            note: Already loaded note data
             
         Returns:
             bool: True if successful, False otherwise
         """
         try:
+            if self.download_buffer:
+                # Coalesced into one Increment(n) per note on the next flush
+                self.download_buffer.add(note_id, note=note)
+                return True
+            
             doc_ref = self.db.collection(self.notes_collection).document(note_id)
-            doc_ref.update({
-                'download_count': firestore.Increment(1),
-                'last_downloaded': firestore.SERVER_TIMESTAMP
-            })
+            batch = self.db.batch()
+            if self.download_counter:
+                self.download_counter.increment(doc_ref, 1, writer=batch)
+            else:
+                batch.update(doc_ref, {
+                    'download_count': firestore.Increment(1),
+                    'last_downloaded': firestore.SERVER_TIMESTAMP
+                })
+            self.facets.add_downloads(batch, [(note, 1)])
+            record_backend_operation('firestore', 'write', 2 if note else 1)
+            self.resilience.call('increment_download_count', lambda timeout: batch.commit(timeout=timeout))
+            if self.download_counter:
+                self.download_counter.applied(doc_ref, 1)
             
             logger.debug("Download count incremented")
             return True
@@ -300,7 +555,12 @@ class FirestoreNotesDB:
         """
         try:
             notes_ref = self.db.collection(self.notes_collection)
-            all_docs = notes_ref.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit * 3).stream()
+            search_query = notes_ref.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit * 3)
+            all_docs = self.resilience.call(
+                'search_notes', lambda timeout: list(search_query.stream(timeout=timeout)), hedge=True,
+                on_hedge=lambda: record_backend_operation('firestore', 'read', limit * 3)
+            )
+            record_backend_operation('firestore', 'read', max(1, len(all_docs)))
             
             query_lower = query.lower()
             matching_notes = []
@@ -332,7 +592,7 @@ class FirestoreNotesDB:
                     matching_notes.append(note_data)
             
             logger.info(f"Search completed: found {len(matching_notes)} matching notes")
-            return matching_notes
+            return self._finalize_notes(matching_notes)
             
         except Exception as e:
             logger.error("Error searching notes")
@@ -341,31 +601,52 @@ class FirestoreNotesDB:
                 logger.error(f"Search notes error: {e}")
             return []
     
-    def get_unique_subjects(self) -> List[str]:
+    def get_facets(self) -> Dict:
         """
-        Get list of all unique subjects
+        Get per-subject and per-department note counts
         
         Returns:
-            list: List of unique subject names
+            dict: {'subjects': {...}, 'departments': {...}} from the facet document
         """
         try:
-            notes_ref = self.db.collection(self.notes_collection)
-            docs = notes_ref.stream()
+            facets = self.facets.read()
+            record_backend_operation('firestore', 'read')
+            if facets is not None:
+                return facets
             
-            subjects = set()
-            for doc in docs:
-                data = doc.to_dict()
-                subject = data.get('subject')
-                if subject and subject.strip():
-                    subjects.add(subject.strip())
-            
-            return list(subjects)
+            # Not backfilled yet: fall back to a scan (run `flask rebuild-facets`)
+            logger.warning("Note facets missing, computing from a full scan")
+            notes = [doc.to_dict() for doc in self.db.collection(self.notes_collection).stream()]
+            return compute_facets(notes)
             
         except Exception as e:
-            logger.error("Error getting unique subjects")
+            logger.error("Error getting note facets")
             if current_app and current_app.debug:
-                logger.error(f"Get unique subjects error: {e}")
-            return []
+                logger.error(f"Get facets error: {e}")
+            return {'subjects': {}, 'departments': {}}
+    
+    def rebuild_facets(self) -> Dict:
+        """
+        Recompute the facet document from the notes collection (backfill/repair)
+        
+        Returns:
+            dict: The rebuilt facets
+        """
+        notes = [self._snapshot_to_note(doc) for doc in self.db.collection(self.notes_collection).stream()]
+        if self.download_counter:
+            # Buffered downloads are left out: their flush adds them to the totals
+            notes_ref = self.db.collection(self.notes_collection)
+            self.download_counter.merge_into(notes, lambda note: notes_ref.document(note['id']))
+        return self.facets.rebuild(notes)
+    
+    def get_unique_subjects(self) -> List[str]:
+        """
+        Get list of all unique subjects
+        
+        Returns:
+            list: List of unique subject names
+        """
+        return list(self.get_facets()['subjects'])
     
     def get_unique_departments(self) -> List[str]:
         """
@@ -374,24 +655,7 @@ class FirestoreNotesDB:
         Returns:
             list: List of unique department names
         """
-        try:
-            notes_ref = self.db.collection(self.notes_collection)
-            docs = notes_ref.stream()
-            
-            departments = set()
-            for doc in docs:
-                data = doc.to_dict()
-                department = data.get('department')
-                if department and department.strip():
-                    departments.add(department.strip())
-            
-            return list(departments)
-            
-        except Exception as e:
-            logger.error("Error getting unique departments")
-            if current_app and current_app.debug:
-                logger.error(f"Get unique departments error: {e}")
-            return []
+        return list(self.get_facets()['departments'])
         
     def increment(self, value=1):
         """Helper method for Firestore increment operations"""
@@ -423,6 +687,7 @@ class LocalNotesDB:
         note_copy['id'] = note_id
         notes.append(note_copy)
         self._save(notes)
+        _notify_note_listeners('created', note_id, note_copy)
         return note_id
 
     def get_note(self, note_id: str) -> Optional[Dict]:
@@ -431,9 +696,16 @@ class LocalNotesDB:
                 return n
         return None
 
+    def get_notes_many(self, note_ids: List[str]) -> List[Dict]:
+        by_id = {n.get('id'): n for n in self._load()}
+        return [by_id[note_id] for note_id in dict.fromkeys(note_ids) if note_id in by_id]
+
     def get_all_notes(self, limit: int = 100) -> List[Dict]:
         return list(self._load())[:limit]
 
+    def scan_notes(self) -> List[Dict]:
+        return self._load()
+
     def get_notes_by_user(self, user_id: str, limit: int = 100) -> List[Dict]:
         return [n for n in self._load() if n.get('uploaded_by') == user_id][:limit]
 
@@ -445,7 +717,7 @@ class LocalNotesDB:
             notes = [n for n in notes if n.get('department') == department]
         return notes[:limit]
 
-    def increment_download_count(self, note_id: str):
+    def increment_download_count(self, note_id: str, note: Optional[Dict] = None):
         notes = self._load()
         for n in notes:
             if n.get('id') == note_id:
@@ -453,14 +725,33 @@ class LocalNotesDB:
                 break
         self._save(notes)
 
-    def delete_note(self, note_id: str) -> bool:
+    def update_note(self, note_id: str, update_data: Dict) -> bool:
+        notes = self._load()
+        for n in notes:
+            if n.get('id') == note_id:
+                n.update(update_data)
+                self._save(notes)
+                _notify_note_listeners('updated', note_id, update_data)
+                return True
+        return False
+
+    def delete_note(self, note_id: str, note: Optional[Dict] = None) -> bool:
         notes = self._load()
         new_notes = [n for n in notes if n.get('id') != note_id]
         deleted = len(new_notes) != len(notes)
         if deleted:
             self._save(new_notes)
+            removed = next(n for n in notes if n.get('id') == note_id)
+            _notify_note_listeners('deleted', note_id, note or removed)
         return deleted
 
+    def get_facets(self) -> Dict:
+        # The whole store is one file read, so facets are computed on the fly
+        return compute_facets(self._load())
+
+    def rebuild_facets(self) -> Dict:
+        return self.get_facets()
+
     def get_unique_subjects(self) -> List[str]:
         return list({n.get('subject') for n in self._load() if n.get('subject')})
 
@@ -468,6 +759,120 @@ class LocalNotesDB:
         return list({n.get('department') for n in self._load() if n.get('department')})
 
 
+class CachedNotesDB:
+    """
+    Read-through cache of note metadata in front of a notes store.
+
+    get_note (and the per-id part of get_notes_many) is served from a bounded
+    TTL/LRU cache; update_note, delete_note and increment_download_count drop
+    the cached entry after writing (or, when downloads are buffered, bump the
+    cached download_count in place). Invalidation is per process, so other
+    workers see a change after at most the TTL unless snapshot invalidation
+    is enabled with watch_invalidations(). Every other method is passed
+    straight through to the wrapped store.
+    """
+
+    def __init__(self, store, cache: TTLCache, disk: Optional[DiskCache] = None,
+                 disk_ttl_seconds: float = 300.0):
+        self._store = store
+        self.cache = cache
+        self.disk = disk
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self._watch = None
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    def get_note(self, note_id: str) -> Optional[Dict]:
+        note = self.cache.get(note_id)
+        if note is None and self.disk:
+            note = self.disk.get(NOTES_NAMESPACE, note_id)
+            if note is not None:
+                self.cache.set(note_id, note)
+        if note is None:
+            note = self._store.get_note(note_id)
+            if note is None:
+                return None
+            self.cache.set(note_id, note)
+            if self.disk:
+                self.disk.set(NOTES_NAMESPACE, note_id, note, self.disk_ttl_seconds)
+        # Callers decorate the returned dict, so never hand out the cached one
+        return dict(note)
+
+    def get_notes_many(self, note_ids: List[str]) -> List[Dict]:
+        unique_ids = list(dict.fromkeys(note_id for note_id in note_ids if note_id))
+        found = {}
+        for note_id in unique_ids:
+            note = self.cache.get(note_id)
+            if note is not None:
+                found[note_id] = note
+        missing = [note_id for note_id in unique_ids if note_id not in found]
+        if missing and self.disk:
+            for note_id, note in self.disk.get_many(NOTES_NAMESPACE, missing).items():
+                self.cache.set(note_id, note)
+                found[note_id] = note
+            missing = [note_id for note_id in missing if note_id not in found]
+        loaded = self._store.get_notes_many(missing) if missing else []
+        for note in loaded:
+            self.cache.set(note['id'], note)
+            found[note['id']] = note
+        if loaded and self.disk:
+            self.disk.set_many(NOTES_NAMESPACE, {note['id']: note for note in loaded}, self.disk_ttl_seconds)
+        return [dict(found[note_id]) for note_id in unique_ids if note_id in found]
+
+    def _invalidate(self, note_id: str):
+        self.cache.invalidate(note_id)
+        if self.disk:
+            self.disk.delete(NOTES_NAMESPACE, note_id)
+
+    def update_note(self, note_id: str, update_data: Dict) -> bool:
+        try:
+            return self._store.update_note(note_id, update_data)
+        finally:
+            self._invalidate(note_id)
+
+    def delete_note(self, note_id: str, note: Optional[Dict] = None) -> bool:
+        try:
+            return self._store.delete_note(note_id, note)
+        finally:
+            self._invalidate(note_id)
+
+    def increment_download_count(self, note_id: str, note: Optional[Dict] = None):
+        try:
+            return self._store.increment_download_count(note_id, note)
+        finally:
+            if getattr(self._store, 'download_buffer', None):
+                # Cached notes already include buffered downloads, so keep
+                # them in step instead of forcing a re-read on every download
+                self.cache.update(note_id, lambda cached: {
+                    **cached, 'download_count': (cached.get('download_count', 0) or 0) + 1
+                })
+            else:
+                self._invalidate(note_id)
+
+    def watch_invalidations(self):
+        """
+        Invalidate cached notes from a Firestore on_snapshot listener so writes
+        made by other workers are seen immediately. Costs one read per note
+        when the listener starts, plus one per change.
+        """
+        if self._watch is not None or not hasattr(self._store, 'db'):
+            return
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            for change in changes:
+                self._invalidate(change.document.id)
+
+        self._watch = self._store.db.collection(self._store.notes_collection).on_snapshot(on_snapshot)
+        logger.info("Note cache snapshot invalidation started")
+
+    def get_facets(self) -> Dict:
+        return disk_cached('note_facets', self._store.get_facets)
+
+    def stats(self) -> Dict:
+        return {**self.cache.stats(), 'snapshot_invalidation': self._watch is not None}
+
+
 _firestore_db_instance = None
 
 
@@ -477,10 +882,26 @@ def get_firestore_db():
     if _firestore_db_instance is None:
         env = os.getenv("ENV", "local").lower()
         if env == "production":
-            _firestore_db_instance = FirestoreNotesDB()
+            store = FirestoreNotesDB()
         else:
             logger.info("Using LocalNotesDB (filesystem) for non-production environment")
-            _firestore_db_instance = LocalNotesDB()
+            store = LocalNotesDB()
+        
+        disk = get_disk_cache()
+        if disk is not None:
+            # Any note write can change counts and listings behind cached aggregates
+            add_note_listener(lambda event, note_id, note: disk.bump_namespace(AGGREGATES_NAMESPACE))
+        
+        if os.getenv("NOTE_CACHE_ENABLED", "true").lower() == "true":
+            store = CachedNotesDB(store, TTLCache(
+                max_entries=int(os.getenv("NOTE_CACHE_MAX_ENTRIES", 2048)),
+                ttl_seconds=float(os.getenv("NOTE_CACHE_TTL_SECONDS", 30)),
+                name='note_cache'
+            ), disk=disk, disk_ttl_seconds=float(os.getenv("DISK_CACHE_NOTE_TTL_SECONDS", 300)))
+            register_metrics('note_cache', store.stats)
+            if env == "production" and os.getenv("NOTE_CACHE_SNAPSHOT_INVALIDATION", "false").lower() == "true":
+                store.watch_invalidations()
+        _firestore_db_instance = store
     return _firestore_db_instance
 
 
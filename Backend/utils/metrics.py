@@ -0,0 +1,31 @@
+# Backend/utils/metrics.py
+from typing import Callable, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# name -> zero-argument callable returning a JSON-serializable dict
+_metric_sources: Dict[str, Callable[[], Dict]] = {}
+
+
+def register_metrics(name: str, source: Callable[[], Dict]):
+    """
+    Expose a component's runtime metrics on /api/health/metrics
+
+    Args:
+        name: Key the metrics are reported under
+        source: Callable returning the current metrics as a dict
+    """
+    _metric_sources[name] = source
+
+
+def collect_metrics() -> Dict:
+    """Snapshot every registered metrics source"""
+    snapshot = {}
+    for name, source in list(_metric_sources.items()):
+        try:
+            snapshot[name] = source()
+        except Exception as e:
+            logger.error(f"Error collecting {name} metrics: {e}")
+            snapshot[name] = {'error': str(e)}
+    return snapshot
@@ -0,0 +1,119 @@
+# Backend/utils/notes_mirror.py
+from typing import Callable, Dict, List, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class NotesMirror:
+    """
+    In-memory copy of the notes collection kept fresh by a Firestore listener.
+
+    The first on_snapshot callback delivers every note (one read each), and
+    after that only changed documents are streamed, so listing and filtering
+    can be answered from memory with zero reads. Callers must check
+    is_healthy() and fall back to direct queries while the mirror is still
+    seeding or the listener has dropped; a dropped listener is restarted at
+    most once every restart_interval seconds.
+    """
+
+    def __init__(self, notes_ref, to_note: Callable, restart_interval: float = 30.0):
+        self.notes_ref = notes_ref
+        self.to_note = to_note
+        self.restart_interval = restart_interval
+
+        self._notes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self._last_start = 0.0
+
+        self.snapshots = 0
+        self.changes = 0
+        self.restarts = 0
+        self.fallbacks = 0
+        self.last_snapshot_at: Optional[float] = None
+        self.last_read_time = None
+
+    def start(self):
+        """Attach the snapshot listener (non-blocking)"""
+        self._last_start = time.monotonic()
+        self._ready.clear()
+        self._watch = self.notes_ref.on_snapshot(self._on_snapshot)
+        logger.info("Notes mirror listener started")
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            if not self._ready.is_set():
+                # (Re)seed from the full snapshot so nothing removed while we
+                # were disconnected survives
+                self._notes = {doc.id: self.to_note(doc) for doc in docs}
+            else:
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        self._notes.pop(change.document.id, None)
+                    else:
+                        self._notes[change.document.id] = self.to_note(change.document)
+            self.snapshots += 1
+            self.changes += len(changes)
+            self.last_snapshot_at = time.time()
+            self.last_read_time = read_time
+        self._ready.set()
+
+    def is_healthy(self) -> bool:
+        """True when the mirror is seeded and its listener is still connected"""
+        active = self._watch is not None and self._watch.is_active
+        if active and self._ready.is_set():
+            return True
+
+        self.fallbacks += 1
+        if not active and time.monotonic() - self._last_start >= self.restart_interval:
+            try:
+                self.stop()
+                self.restarts += 1
+                self.start()
+            except Exception as e:
+                logger.error(f"Notes mirror restart failed: {e}")
+        return False
+
+    def _select(self, predicate: Callable[[Dict], bool], limit: Optional[int]) -> List[Dict]:
+        with self._lock:
+            matches = [note for note in self._notes.values() if predicate(note)]
+        matches.sort(key=lambda note: note.get('created_at') or '', reverse=True)
+        return [dict(note) for note in matches[:limit]]
+
+    def get_all_notes(self, limit: Optional[int] = 100) -> List[Dict]:
+        """Newest notes first; limit=None returns all of them"""
+        return self._select(lambda note: True, limit)
+
+    def get_notes_by_user(self, user_id: str, limit: int = 100) -> List[Dict]:
+        return self._select(lambda note: note.get('uploaded_by') == user_id, limit)
+
+    def get_notes_by_filters(self, subject: str = None, department: str = None, limit: int = 100) -> List[Dict]:
+        return self._select(
+            lambda note: (not subject or note.get('subject') == subject)
+            and (not department or note.get('department') == department),
+            limit
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = len(self._notes)
+        return {
+            'notes': size,
+            'ready': self._ready.is_set(),
+            'listener_active': self._watch is not None and self._watch.is_active,
+            'seconds_since_snapshot': round(time.time() - self.last_snapshot_at, 3) if self.last_snapshot_at else None,
+            'last_read_time': self.last_read_time.isoformat() if self.last_read_time else None,
+            'snapshots': self.snapshots,
+            'changes': self.changes,
+            'restarts': self.restarts,
+            'fallbacks': self.fallbacks,
+        }
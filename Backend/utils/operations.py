@@ -0,0 +1,127 @@
+# Backend/utils/operations.py
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+import contextvars
+import logging
+import threading
+
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# R2 bills S3 API calls in two classes; DeleteObject is free
+R2_CLASS_A = {'put_object', 'create_multipart_upload', 'upload_part', 'complete_multipart_upload',
+              'list_objects', 'copy_object'}
+R2_CLASS_B = {'get_object', 'head_object', 'head_bucket', 'presigned_get'}
+
+# boto3's default TransferConfig: upload_fileobj switches to multipart above this
+R2_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+R2_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+class UsageLimitExceeded(Exception):
+    """A backend operation was refused because its budget is used up"""
+
+
+_sinks = []
+_totals: Dict[Tuple[str, str], int] = defaultdict(int)
+_lock = threading.Lock()
+_registered = False
+# Per-request counts (see operation_scope); shared with fan-out workers via contextvars
+_scope: contextvars.ContextVar = contextvars.ContextVar('backend_operations', default=None)
+
+
+def budget_field(backend: str, operation: str) -> Optional[str]:
+    """Usage counter a backend operation is charged to (None if it is free)"""
+    if backend == 'r2':
+        if operation in R2_CLASS_A:
+            return 'class_a_operations'
+        if operation in R2_CLASS_B:
+            return 'class_b_operations'
+    elif backend == 'firestore':
+        return 'firestore_reads' if operation == 'read' else 'firestore_writes'
+    return None
+
+
+def r2_upload_operations(file_size: int) -> Dict[str, int]:
+    """R2 requests upload_fileobj makes for a file of this size"""
+    if file_size <= R2_MULTIPART_THRESHOLD:
+        return {'put_object': 1}
+    parts = -(-file_size // R2_MULTIPART_CHUNKSIZE)
+    return {'create_multipart_upload': 1, 'upload_part': parts, 'complete_multipart_upload': 1}
+
+
+def add_operation_sink(callback: Callable[[str, int], None]):
+    """
+    Register callback(field, count) for every billable operation
+
+    The usage tracker uses this to charge its budgets; a sink may raise
+    UsageLimitExceeded to stop the operation before it is sent.
+    """
+    _sinks.append(callback)
+
+
+def record_backend_operation(backend: str, operation: str, count: int = 1):
+    """
+    Count operations sent to a backend (call it before sending them)
+
+    Args:
+        backend: 'r2', 'firestore' or 'local'
+        operation: S3 API call name for R2, 'read'/'write' for Firestore
+        count: Number of billed units (requests, or documents for Firestore)
+    """
+    global _registered
+    if count <= 0:
+        return
+    if not _registered:
+        _registered = True
+        register_metrics('backend_operations', operation_stats)
+
+    # Sinks run first: a refused operation is never sent, so it is not counted
+    field = budget_field(backend, operation)
+    if field:
+        for sink in _sinks:
+            sink(field, count)
+
+    key = (backend, operation)
+    with _lock:
+        _totals[key] += count
+        scope = _scope.get()
+        if scope is not None:
+            scope[key] = scope.get(key, 0) + count
+
+
+@contextmanager
+def operation_scope():
+    """
+    Collect the backend operations made while handling one request
+
+    Yields:
+        dict: (backend, operation) -> count, filled in as operations happen
+    """
+    counts: Dict[Tuple[str, str], int] = {}
+    token = _scope.set(counts)
+    try:
+        yield counts
+    finally:
+        _scope.reset(token)
+
+
+def summarize(counts: Dict[Tuple[str, str], int]) -> Dict[str, int]:
+    """Fold (backend, operation) counts into budget fields (free operations are dropped)"""
+    summary: Dict[str, int] = {}
+    for (backend, operation), count in counts.items():
+        field = budget_field(backend, operation)
+        if field:
+            summary[field] = summary.get(field, 0) + count
+    return summary
+
+
+def operation_stats() -> Dict:
+    with _lock:
+        totals = dict(_totals)
+    by_backend: Dict[str, Dict[str, int]] = {}
+    for (backend, operation), count in totals.items():
+        by_backend.setdefault(backend, {})[operation] = count
+    return {'operations': by_backend, 'billable': summarize(totals)}
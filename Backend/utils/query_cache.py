@@ -0,0 +1,171 @@
+# Backend/utils/query_cache.py
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from utils.cache import TTLCache
+from utils.disk_cache import AGGREGATES_NAMESPACE, DiskCache, get_disk_cache
+from utils.fanout import get_fanout_executor
+from utils.firestore_db import add_note_listener
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# (subject, department, uploaded_by, limit)
+QueryKey = Tuple[Optional[str], Optional[str], Optional[str], int]
+
+
+def _normalize(value) -> Optional[str]:
+    return str(value or '').strip() or None
+
+
+def make_query_key(subject: str = None, department: str = None, uploaded_by: str = None,
+                   limit: int = 100) -> QueryKey:
+    """Normalize listing parameters so equivalent requests share a cache entry"""
+    return _normalize(subject), _normalize(department), _normalize(uploaded_by), max(1, min(int(limit), 1000))
+
+
+class QueryResultCache:
+    """
+    Cache of note listing results keyed by normalized query parameters.
+
+    Entries are fresh for ttl_seconds and may then be served for another
+    stale_seconds while a single background reload replaces them
+    (stale-while-revalidate), so expiry never puts a query on the request
+    path. Note writes in this process invalidate only the keys they can
+    affect: matching subject/department/uploader (or unfiltered) keys, plus
+    any cached result that contains the note. Writes in other workers bump
+    the disk cache's aggregates namespace; entries cached under an older
+    version of it are reloaded rather than served (seen within a second).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 15.0, stale_seconds: float = 300.0,
+                 disk: Optional[DiskCache] = None):
+        self.ttl_seconds = ttl_seconds
+        self.disk = disk
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds + stale_seconds,
+                               name='notes_query_cache')
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        # Bumped on every invalidation; loads that started earlier are not stored
+        self._generation = 0
+        self.stale_served = 0
+        self.refreshes = 0
+        self.shared_invalidations = 0
+
+    def _shared_version(self) -> Optional[int]:
+        """Version of the listings across workers (None without a disk cache)"""
+        return self.disk.namespace_version(AGGREGATES_NAMESPACE) if self.disk else None
+
+    def get_or_load(self, key: QueryKey, loader: Callable[[], List[Dict]]) -> List[Dict]:
+        entry = self._cache.get(key)
+        if entry is not None:
+            fresh_until, notes, _, shared_version = entry
+            if shared_version == self._shared_version():
+                if fresh_until <= time.monotonic():
+                    self.stale_served += 1
+                    self._refresh_async(key, loader)
+                return list(notes)
+            # Another worker wrote a note since this was cached
+            self.shared_invalidations += 1
+
+        return list(self._load(key, loader))
+
+    def peek(self, key: QueryKey) -> Optional[List[Dict]]:
+        """Cached result of any age, without loading or refreshing it"""
+        entry = self._cache.get_stale(key)
+        return list(entry[1]) if entry is not None else None
+
+    def _load(self, key: QueryKey, loader: Callable[[], List[Dict]]) -> List[Dict]:
+        generation = self._generation
+        shared_version = self._shared_version()
+        notes = loader()
+        self._store(key, notes, generation, shared_version)
+        return notes
+
+    def _store(self, key: QueryKey, notes: List[Dict], generation: int, shared_version: Optional[int]):
+        with self._lock:
+            if generation != self._generation:
+                return
+            ids = frozenset(note.get('id') for note in notes)
+            self._cache.set(key, (time.monotonic() + self.ttl_seconds, notes, ids, shared_version))
+
+    def _refresh_async(self, key: QueryKey, loader: Callable[[], List[Dict]]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, loader)
+                self.refreshes += 1
+            except Exception as e:
+                logger.error(f"Query cache refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        get_fanout_executor().submit(refresh)
+
+    def on_note_event(self, event: str, note_id: str, note: Dict):
+        """Note listener hook: drop the listings a write can change"""
+        subject = _normalize(note.get('subject'))
+        department = _normalize(note.get('department'))
+        uploaded_by = _normalize(note.get('uploaded_by'))
+        has = {field: field in note for field in ('subject', 'department', 'uploaded_by')}
+
+        def affected(key, entry) -> bool:
+            key_subject, key_department, key_uploader, _ = key
+            if note_id in entry[2]:
+                return True
+            if event == 'updated':
+                # Only changed fields are known: a note moving into a filter
+                # shows up under the new value
+                return ((has['subject'] and key_subject == subject) or
+                        (has['department'] and key_department == department))
+            return ((key_subject is None or key_subject == subject) and
+                    (key_department is None or key_department == department) and
+                    (key_uploader is None or key_uploader == uploaded_by))
+
+        with self._lock:
+            self._generation += 1
+            for key, entry in self._cache.items():
+                if affected(key, entry):
+                    self._cache.invalidate(key)
+
+    def stats(self) -> Dict:
+        return {
+            **self._cache.stats(),
+            'fresh_seconds': self.ttl_seconds,
+            'stale_served': self.stale_served,
+            'refreshes': self.refreshes,
+            'refreshing': len(self._refreshing),
+            'shared_invalidations': self.shared_invalidations,
+        }
+
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> Optional[QueryResultCache]:
+    """Get the listing result cache, or None when QUERY_CACHE_ENABLED is false"""
+    global _query_cache
+    if os.getenv('QUERY_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                cache = QueryResultCache(
+                    max_entries=int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 256)),
+                    ttl_seconds=float(os.getenv('QUERY_CACHE_TTL_SECONDS', 15)),
+                    stale_seconds=float(os.getenv('QUERY_CACHE_STALE_SECONDS', 300)),
+                    disk=get_disk_cache()
+                )
+                add_note_listener(cache.on_note_event)
+                register_metrics('notes_query_cache', cache.stats)
+                _query_cache = cache
+    return _query_cache
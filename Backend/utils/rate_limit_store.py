@@ -0,0 +1,245 @@
+# Backend/utils/rate_limit_store.py
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Prune expired counters after this many acquires
+PRUNE_EVERY_ACQUIRES = 500
+
+
+def sliding_window(now: float, window_seconds: float) -> Tuple[int, float]:
+    """Current fixed window index and the weight of the previous window's count"""
+    window, offset = divmod(now, window_seconds)
+    return int(window), 1.0 - offset / window_seconds
+
+
+def advance(state_window: Optional[int], count: int, previous: int, window: int) -> Tuple[int, int]:
+    """(count, previous) of a counter last written in state_window, as seen from window"""
+    if state_window is None or state_window == window:
+        return count, previous
+    return 0, count if state_window == window - 1 else 0
+
+
+class RateLimitStore:
+    """
+    Sliding-window counters shared by every worker.
+
+    acquire() checks a request against several (key, limit) pairs and counts
+    it against all of them in one atomic step, or against none if any limit
+    is reached, so the per-IP and per-user limits of a request cost a single
+    transaction or round trip. Counters use the same two-window estimate as
+    utils.security.RateLimiter, on wall-clock time so workers agree on the
+    window boundaries.
+    """
+
+    name = 'store'
+
+    def __init__(self):
+        self.acquires = 0
+        self.limited = 0
+        self.errors = 0
+
+    def _acquire(self, limits: Sequence[Tuple[str, int]], window_seconds: int, now: float) -> bool:
+        raise NotImplementedError
+
+    def acquire(self, limits: Sequence[Tuple[str, int]], window_seconds: int) -> bool:
+        """
+        Count a request if every key is under its limit
+
+        Args:
+            limits: (key, max requests) pairs
+            window_seconds: Time window in seconds
+
+        Raises:
+            Exception: The backend failed (callers fall back to per-process limits)
+        """
+        try:
+            allowed = self._acquire(limits, window_seconds, time.time())
+        except Exception:
+            self.errors += 1
+            raise
+        self.acquires += 1
+        if not allowed:
+            self.limited += 1
+        return allowed
+
+    def stats(self) -> Dict:
+        return {
+            'backend': self.name,
+            'acquires': self.acquires,
+            'limited': self.limited,
+            'errors': self.errors,
+        }
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Counters in a SQLite file, shared by the workers on one host"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._since_prune = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS counters (
+            key TEXT PRIMARY KEY,
+            window INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            previous INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS counters_expires ON counters (expires_at)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _acquire(self, limits: Sequence[Tuple[str, int]], window_seconds: int, now: float) -> bool:
+        window, weight = sliding_window(now, window_seconds)
+        keys = [key for key, _ in limits]
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front, so check-and-increment is atomic across workers
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            placeholders = ','.join('?' * len(keys))
+            rows = {
+                key: (state_window, count, previous)
+                for key, state_window, count, previous in conn.execute(
+                    f'SELECT key, window, count, previous FROM counters WHERE key IN ({placeholders})', keys
+                )
+            }
+            counts = {}
+            for key, max_requests in limits:
+                count, previous = advance(*rows.get(key, (None, 0, 0)), window)
+                if previous * weight + count >= max_requests:
+                    conn.execute('ROLLBACK')
+                    return False
+                counts[key] = (count, previous)
+
+            # Counters are useless once two windows have passed
+            expires_at = (window + 2) * window_seconds
+            conn.executemany(
+                'INSERT OR REPLACE INTO counters (key, window, count, previous, expires_at) VALUES (?, ?, ?, ?, ?)',
+                [(key, window, count + 1, previous, expires_at) for key, (count, previous) in counts.items()]
+            )
+            self._since_prune += 1
+            if self._since_prune >= PRUNE_EVERY_ACQUIRES:
+                self._since_prune = 0
+                conn.execute('DELETE FROM counters WHERE expires_at <= ?', (now,))
+            conn.execute('COMMIT')
+            return True
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def stats(self) -> Dict:
+        try:
+            keys = self._conn().execute('SELECT COUNT(*) FROM counters').fetchone()[0]
+        except sqlite3.Error:
+            keys = None
+        return {**super().stats(), 'path': self.path, 'keys': keys}
+
+
+# Check every limit, then count against all of them; runs atomically inside Redis
+_ACQUIRE_SCRIPT = '''
+local window = tonumber(ARGV[1])
+local weight = tonumber(ARGV[2])
+local counts = {}
+for i, key in ipairs(KEYS) do
+    local state = redis.call('HMGET', key, 'window', 'count', 'previous')
+    local state_window = tonumber(state[1])
+    local count = tonumber(state[2]) or 0
+    local previous = tonumber(state[3]) or 0
+    if state_window ~= nil and state_window ~= window then
+        if state_window == window - 1 then previous = count else previous = 0 end
+        count = 0
+    end
+    if previous * weight + count >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+    counts[i] = {count, previous}
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'window', window, 'count', counts[i][1] + 1, 'previous', counts[i][2])
+    redis.call('EXPIRE', key, ARGV[3])
+end
+return 1
+'''
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    Counters in Redis or a Redis-compatible server (one that runs Lua scripts)
+
+    All keys of a request are passed to one script, so on a cluster they
+    must hash to the same slot; this is meant for a single local instance.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url: str, prefix: str = 'ratelimit:'):
+        super().__init__()
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._script = self._client.register_script(_ACQUIRE_SCRIPT)
+
+    def _acquire(self, limits: Sequence[Tuple[str, int]], window_seconds: int, now: float) -> bool:
+        window, weight = sliding_window(now, window_seconds)
+        ttl = int(window_seconds * 2) + 1
+        keys = [self.prefix + key for key, _ in limits]
+        args: List = [window, repr(weight), ttl] + [max_requests for _, max_requests in limits]
+        return bool(self._script(keys=keys, args=args))
+
+    def stats(self) -> Dict:
+        return {**super().stats(), 'url': self.url.split('@')[-1]}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rate_limit_store() -> Optional[RateLimitStore]:
+    """
+    Get the shared counter store, or None when RATE_LIMIT_BACKEND is memory
+
+    With the memory backend (the default) every worker keeps its own counters.
+    """
+    global _store
+    backend = os.getenv('RATE_LIMIT_BACKEND', 'memory').lower()
+    if backend == 'memory':
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if backend == 'sqlite':
+                    store = SQLiteRateLimitStore(os.getenv('RATE_LIMIT_SQLITE_PATH') or os.path.join(
+                        tempfile.gettempdir(), 'edu-desk-rate-limits.sqlite'))
+                elif backend == 'redis':
+                    store = RedisRateLimitStore(os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'))
+                else:
+                    raise ValueError(f"Unknown RATE_LIMIT_BACKEND {backend!r}")
+                register_metrics('rate_limit_store', store.stats)
+                _store = store
+    return _store
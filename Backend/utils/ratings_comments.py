@@ -3,11 +3,20 @@ from firebase_admin import firestore
 from typing import Dict, List, Optional
 from flask import current_app
 import logging
+import os
 import uuid
 from datetime import datetime
+from utils.counters import ShardedCounter
+from utils.metrics import register_metrics
+from utils.fanout import fan_map
+from utils.write_queue import get_write_queue
 
 logger = logging.getLogger(__name__)
 
+# Firestore accepts at most 30 values in an 'in' filter
+RATINGS_IN_QUERY_LIMIT = 30
+RATINGS_MAX_PARALLEL = 4
+
 class RatingsCommentsDB:
     def __init__(self):
         """Initialize Firestore database client for ratings and comments"""
@@ -15,6 +24,15 @@ class RatingsCommentsDB:
             self.db = firestore.client()
             self.ratings_collection = 'ratings'
             self.comments_collection = 'comments'
+            self.likes_counter = None
+            if int(os.getenv('COMMENT_LIKE_SHARDS', 0)) > 0:
+                self.likes_counter = ShardedCounter(
+                    self.db,
+                    'likes',
+                    num_shards=int(os.getenv('COMMENT_LIKE_SHARDS')),
+                    cache_ttl=float(os.getenv('SHARDED_COUNTER_CACHE_SECONDS', 10))
+                )
+                register_metrics('comment_like_shards', self.likes_counter.stats)
             logger.info("Ratings and Comments DB initialized successfully")
         except Exception as e:
             logger.error("Failed to initialize Ratings and Comments DB")
@@ -47,19 +65,29 @@ class RatingsCommentsDB:
                 'updated_at': firestore.SERVER_TIMESTAMP
             }
             
-            self.db.collection(self.ratings_collection).document(rating_id).set(rating_data)
+            doc_ref = self.db.collection(self.ratings_collection).document(rating_id)
+            queue = get_write_queue()
+            if queue is not None:
+                writer = queue.writer()
+                writer.set(doc_ref, rating_data)
+                writer.commit()
+            else:
+                doc_ref.set(rating_data)
             logger.info(f"Rating added for note {note_id}")
             return True
         except Exception as e:
             logger.error(f"Error adding rating: {e}")
             return False
 
-    def get_note_ratings(self, note_id: str) -> Dict:
+    def get_note_ratings(self, note_id: str, own_rating: Optional[Dict] = None) -> Dict:
         """
         Get all ratings for a note with statistics
         
         Args:
             note_id: Document ID of the note
+            own_rating: Rating just submitted by a user ({'user_id', 'rating'}); it
+                replaces whatever is stored for that user, since a queued write
+                may not have reached Firestore yet
             
         Returns:
             dict: Ratings statistics
@@ -67,30 +95,63 @@ class RatingsCommentsDB:
         try:
             query = self.db.collection(self.ratings_collection).where('note_id', '==', note_id)
             ratings = [doc.to_dict() for doc in query.stream()]
+            if own_rating:
+                ratings = [r for r in ratings if r.get('user_id') != own_rating['user_id']] + [own_rating]
+            return self._summarize_ratings(ratings)
+        except Exception as e:
+            logger.error(f"Error getting ratings: {e}")
+            return {'average': 0, 'total_ratings': 0, 'distribution': {}}
+
+    def get_ratings_for_notes(self, note_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Get rating statistics for several notes with batched 'in' queries
+        
+        Args:
+            note_ids: Document IDs of the notes
             
-            if not ratings:
-                return {
-                    'average': 0,
-                    'total_ratings': 0,
-                    'distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-                }
-            
-            distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-            total = 0
+        Returns:
+            dict: Ratings statistics keyed by note ID (every requested note is present)
+        """
+        unique_ids = list(dict.fromkeys(note_ids))
+        grouped = {note_id: [] for note_id in unique_ids}
+        try:
+            ratings_ref = self.db.collection(self.ratings_collection)
+            chunks = [unique_ids[i:i + RATINGS_IN_QUERY_LIMIT] for i in range(0, len(unique_ids), RATINGS_IN_QUERY_LIMIT)]
             
-            for rating in ratings:
-                r = rating['rating']
-                distribution[r] += 1
-                total += r
+            def fetch(chunk):
+                return [doc.to_dict() for doc in ratings_ref.where('note_id', 'in', chunk).stream()]
             
+            for ratings in fan_map(fetch, chunks, max_parallel=RATINGS_MAX_PARALLEL):
+                for rating in ratings:
+                    grouped.setdefault(rating['note_id'], []).append(rating)
+        except Exception as e:
+            logger.error(f"Error getting ratings for notes: {e}")
+        
+        return {note_id: self._summarize_ratings(ratings) for note_id, ratings in grouped.items()}
+
+    @staticmethod
+    def _summarize_ratings(ratings: List[Dict]) -> Dict:
+        """Average, count and 1-5 distribution for a list of rating documents"""
+        if not ratings:
             return {
-                'average': round(total / len(ratings), 2),
-                'total_ratings': len(ratings),
-                'distribution': distribution
+                'average': 0,
+                'total_ratings': 0,
+                'distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
             }
-        except Exception as e:
-            logger.error(f"Error getting ratings: {e}")
-            return {'average': 0, 'total_ratings': 0, 'distribution': {}}
+        
+        distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
+        total = 0
+        
+        for rating in ratings:
+            r = rating['rating']
+            distribution[r] += 1
+            total += r
+        
+        return {
+            'average': round(total / len(ratings), 2),
+            'total_ratings': len(ratings),
+            'distribution': distribution
+        }
 
     def get_user_rating(self, note_id: str, user_id: str) -> Optional[int]:
         """Get a specific user's rating for a note"""
@@ -168,6 +229,10 @@ class RatingsCommentsDB:
                     comment['updated_at'] = comment['updated_at'].isoformat()
                 comments.append(comment)
             
+            if self.likes_counter:
+                comments_ref = self.db.collection(self.comments_collection)
+                self.likes_counter.merge_into(comments, lambda c: comments_ref.document(c['comment_id']))
+            
             return comments
         except Exception as e:
             logger.error(f"Error getting comments: {e}")
@@ -184,7 +249,12 @@ class RatingsCommentsDB:
             if comment['user_id'] != user_id:
                 return False
             
-            self.db.collection(self.comments_collection).document(comment_id).delete()
+            doc_ref = self.db.collection(self.comments_collection).document(comment_id)
+            batch = self.db.batch()
+            if self.likes_counter:
+                self.likes_counter.delete(doc_ref, batch)
+            batch.delete(doc_ref)
+            batch.commit()
             logger.info(f"Comment {comment_id} deleted")
             return True
         except Exception as e:
@@ -195,7 +265,15 @@ class RatingsCommentsDB:
         """Increment like count for a comment"""
         try:
             doc_ref = self.db.collection(self.comments_collection).document(comment_id)
-            doc_ref.update({'likes': firestore.Increment(1)})
+            if self.likes_counter:
+                # Shard writes would succeed for a missing comment, so check
+                # first (update() fails with NotFound on its own)
+                if not doc_ref.get().exists:
+                    logger.error(f"Error liking comment: {comment_id} not found")
+                    return False
+                self.likes_counter.increment(doc_ref)
+            else:
+                doc_ref.update({'likes': firestore.Increment(1)})
             return True
         except Exception as e:
             logger.error(f"Error liking comment: {e}")
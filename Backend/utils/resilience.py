@@ -0,0 +1,402 @@
+# Backend/utils/resilience.py
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, Optional
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per operation for the hedging percentile
+LATENCY_WINDOW = 200
+
+
+class DeadlineExceeded(TimeoutError):
+    """A dependency call did not finish within its deadline"""
+
+
+class CircuitOpenError(Exception):
+    """The dependency's circuit is open; the call was not attempted"""
+
+
+def is_dependency_failure(error: Exception) -> bool:
+    """
+    Whether an error says something about the dependency's health
+
+    Client errors (bad request, not found, permission denied, ...) are the
+    caller's problem and must not open the circuit; timeouts, throttling and
+    server/connection errors are.
+    """
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return True
+    # google.api_core exceptions carry the HTTP status as .code
+    code = getattr(error, 'code', None)
+    if not isinstance(code, int):
+        # botocore ClientError
+        response = getattr(error, 'response', None)
+        code = response.get('ResponseMetadata', {}).get('HTTPStatusCode') if isinstance(response, dict) else None
+    if isinstance(code, int) and 400 <= code < 500:
+        return code in (408, 429)
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the circuit opens and calls
+    fail fast for reset_timeout seconds; then a single probe is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+        self.opens = 0
+        self.short_circuits = 0
+        self.last_success_at = None
+        self.last_failure_at = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a call may be attempted now"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuits += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit '{self.name}' closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self.last_success_at = time.time()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self.last_failure_at = time.time()
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    self.opens += 1
+                    logger.warning(f"Circuit '{self.name}' opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._state(),
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'opens': self.opens,
+                'short_circuits': self.short_circuits,
+                'last_success_at': self.last_success_at,
+                'last_failure_at': self.last_failure_at,
+            }
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class Dependency:
+    """
+    Resilience policy for one backend (Firestore, R2, ...).
+
+    call() runs an operation on a bounded thread pool under a deadline and a
+    circuit breaker shared by all operations of the dependency. Reads that
+    pass a key remember their last good result; while the circuit is open or
+    the call fails, that result is served instead (up to stale_max_age
+    seconds old). Idempotent reads can be hedged: if the first attempt has
+    not answered by the operation's recent p95 latency, a duplicate is sent
+    and whichever returns first wins, within a budget of hedge_max_ratio
+    extra requests. guard() runs non-idempotent calls under the breaker alone.
+    """
+
+    def __init__(self, name: str, executor: ThreadPoolExecutor, default_deadline: float = 5.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, hedging: bool = False,
+                 hedge_min_samples: int = 20, hedge_max_ratio: float = 0.1,
+                 stale_entries: int = 512, stale_max_age: float = 3600.0):
+        self.name = name
+        self.executor = executor
+        self.default_deadline = default_deadline
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.hedging = hedging
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.stale_max_age = stale_max_age
+        self._stale = TTLCache(max_entries=stale_entries, ttl_seconds=stale_max_age, name=f'{name}_last_good')
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._deadlines: Dict[str, float] = {}
+
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.stale_served = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def deadline(self, op: str, default: Optional[float] = None) -> float:
+        """Deadline of an operation: <NAME>_<OP>_DEADLINE_SECONDS, else default, else the dependency default"""
+        deadline = self._deadlines.get(op)
+        if deadline is None:
+            deadline = self._deadlines[op] = float(os.getenv(
+                f'{self.name}_{op}_DEADLINE_SECONDS'.upper(),
+                self.default_deadline if default is None else default
+            ))
+        return deadline
+
+    def _tracker(self, op: str) -> LatencyTracker:
+        tracker = self._latency.get(op)
+        if tracker is None:
+            tracker = self._latency.setdefault(op, LatencyTracker())
+        return tracker
+
+    def call(self, op: str, fn: Callable[[float], Any], key: Optional[Hashable] = None,
+             hedge: bool = False, deadline: Optional[float] = None,
+             on_hedge: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Run fn(timeout) under the dependency's deadline and circuit breaker
+
+        Args:
+            op: Operation name (for deadlines, latency and metrics)
+            fn: The call; receives the deadline to pass on as the RPC timeout
+            key: Remember the result under this key and serve it when the
+                dependency is unavailable (reads only)
+            hedge: The call is an idempotent read that may be duplicated
+            deadline: Default deadline of this operation (e.g. longer for uploads)
+            on_hedge: Called before a duplicate is sent (e.g. to count it); if it
+                raises, the duplicate is not sent
+
+        Raises:
+            CircuitOpenError: The circuit is open and nothing stale is cached
+            DeadlineExceeded: The call missed its deadline
+        """
+        self.calls += 1
+        if not self.breaker.allow():
+            return self._fallback(op, key, CircuitOpenError(f"{self.name} circuit is open"))
+
+        try:
+            result = self._run(op, fn, self.deadline(op, deadline), hedge and self.hedging, on_hedge)
+        except Exception as e:
+            if is_dependency_failure(e):
+                self.failures += 1
+                self.breaker.record_failure()
+                return self._fallback(op, key, e)
+            # The dependency answered; the request itself was wrong
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        if key is not None:
+            self._stale.set(key, (time.monotonic(), result))
+        return result
+
+    def guard(self, op: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run a non-idempotent call (e.g. a transaction) under the circuit breaker only
+
+        It runs in the calling thread without a deadline: abandoning it at a
+        deadline would report a failure while it may still commit, so the
+        client's own timeouts and retries apply.
+
+        Raises:
+            CircuitOpenError: The circuit is open
+        """
+        self.calls += 1
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            if is_dependency_failure(e):
+                self.failures += 1
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self._tracker(op).record(time.monotonic() - started)
+        return result
+
+    def forget(self, key: Hashable):
+        """Drop a remembered result (e.g. after the underlying data was deleted)"""
+        self._stale.invalidate(key)
+
+    def _fallback(self, op: str, key: Optional[Hashable], error: Exception) -> Any:
+        if key is not None:
+            entry = self._stale.get_stale(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.stale_max_age:
+                self.stale_served += 1
+                logger.warning(f"{self.name}.{op} unavailable ({error}); serving last good result")
+                return entry[1]
+        raise error
+
+    def _hedge_delay(self, op: str) -> Optional[float]:
+        tracker = self._tracker(op)
+        if len(tracker) < self.hedge_min_samples or self.hedges >= self.calls * self.hedge_max_ratio:
+            return None
+        return tracker.percentile(0.95)
+
+    def _submit(self, fn: Callable[[float], Any], timeout: float):
+        return self.executor.submit(contextvars.copy_context().run, fn, timeout)
+
+    def _run(self, op: str, fn: Callable[[float], Any], deadline: float, hedge: bool,
+             on_hedge: Optional[Callable[[], None]] = None) -> Any:
+        started = time.monotonic()
+        end = started + deadline
+        first = self._submit(fn, deadline)
+        pending = {first}
+        hedge_delay = self._hedge_delay(op) if hedge else None
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        error = None
+
+        while pending:
+            now = time.monotonic()
+            if now >= end:
+                break
+            wait_until = min(end, hedge_at) if hedge_at is not None else end
+            done, pending = wait(pending, timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not first:
+                        self.hedge_wins += 1
+                    self._tracker(op).record(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+            if hedge_at is not None and time.monotonic() >= hedge_at and first in pending:
+                # Still waiting on the first attempt past p95: send a duplicate
+                hedge_at = None
+                try:
+                    if on_hedge is not None:
+                        on_hedge()
+                except Exception as e:
+                    logger.warning(f"Not hedging {self.name}.{op}: {e}")
+                    continue
+                self.hedges += 1
+                pending.add(self._submit(fn, max(0.0, end - time.monotonic())))
+
+        if error is not None and not pending:
+            raise error
+        for future in pending:
+            future.cancel()
+        self.timeouts += 1
+        raise DeadlineExceeded(f"{self.name}.{op} exceeded its {deadline}s deadline")
+
+    def stats(self) -> Dict:
+        return {
+            'circuit': self.breaker.stats(),
+            'calls': self.calls,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'stale_served': self.stale_served,
+            'hedging': self.hedging,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'p95_seconds': {
+                op: round(p95, 4) for op, p95 in
+                ((op, tracker.percentile(0.95)) for op, tracker in list(self._latency.items()))
+                if p95 is not None
+            },
+        }
+
+
+_dependencies: Dict[str, Dependency] = {}
+_dependencies_lock = threading.Lock()
+
+
+def get_dependency(name: str) -> Dependency:
+    """
+    Get (or create) the resilience policy of a dependency
+
+    Configured with <NAME>_DEADLINE_SECONDS plus the shared CIRCUIT_*, HEDGE_*
+    and RESILIENCE_* settings. Each dependency gets its own pool of
+    <NAME>_MAX_WORKERS (default RESILIENCE_MAX_WORKERS) threads, so a slow
+    dependency queues only its own calls and can't push another past its
+    deadlines.
+    """
+    dependency = _dependencies.get(name)
+    if dependency is None:
+        with _dependencies_lock:
+            dependency = _dependencies.get(name)
+            if dependency is None:
+                # Separate from the fan-out pool so calls made from fan-out
+                # workers never wait on their own pool
+                executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv(
+                        f'{name.upper()}_MAX_WORKERS', os.getenv('RESILIENCE_MAX_WORKERS', 32)
+                    )),
+                    thread_name_prefix=f'resilience-{name}'
+                )
+                dependency = _dependencies[name] = Dependency(
+                    name,
+                    executor,
+                    default_deadline=float(os.getenv(f'{name.upper()}_DEADLINE_SECONDS', 5)),
+                    failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+                    reset_timeout=float(os.getenv('CIRCUIT_RESET_SECONDS', 30)),
+                    hedging=os.getenv('HEDGE_READS_ENABLED', 'false').lower() == 'true',
+                    hedge_min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', 20)),
+                    hedge_max_ratio=float(os.getenv('HEDGE_MAX_RATIO', 0.1)),
+                    stale_entries=int(os.getenv('RESILIENCE_STALE_ENTRIES', 512)),
+                    stale_max_age=float(os.getenv('RESILIENCE_STALE_MAX_AGE_SECONDS', 3600))
+                )
+                register_metrics(f'resilience_{name}', dependency.stats)
+    return dependency
+
+
+def circuit_states() -> Dict[str, str]:
+    """Circuit state of every dependency used so far"""
+    return {name: dependency.breaker.state for name, dependency in list(_dependencies.items())}
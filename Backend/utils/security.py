@@ -1,24 +1,75 @@
 # Backend/utils/security.py
-from flask import request
+from flask import request, current_app
 from functools import wraps
+from typing import Callable, Dict, Optional, Sequence, Tuple
 import logging
-from datetime import datetime, timedelta
-from collections import defaultdict
+import threading
+import time
+from collections import OrderedDict
+
+from utils.rate_limit_store import advance, get_rate_limit_store, sliding_window
 
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    def __init__(self, max_requests: int = 100, window_seconds: int = 3600):
+    """
+    Sliding-window-counter rate limiter with O(1) time and memory per key.
+
+    Each key keeps the request counts of the current and previous fixed
+    windows; the previous count is weighted by how much of it still overlaps
+    the sliding window, which approximates a true sliding log without storing
+    a timestamp per request. Keys are kept in LRU order: keys idle for two
+    windows carry no state and are evicted as calls pass them, and at most
+    max_keys are tracked (least recently seen first out).
+    """
+
+    def __init__(self, max_requests: int = 100, window_seconds: int = 3600, max_keys: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
         """
         Initialize rate limiter
         
         Args:
             max_requests: Maximum requests allowed
             window_seconds: Time window in seconds
+            max_keys: Maximum identifiers tracked at once
+            clock: Time source in seconds (for tests and benchmarks)
         """
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests = defaultdict(list)
+        self.max_keys = max_keys
+        self._clock = clock
+        # identifier -> [window index, count in that window, count in the window before]
+        self._windows: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+    def _evict_idle(self, window: int):
+        # The least recently seen keys come first; stop at the first one still in use
+        for _ in range(2):
+            if not self._windows:
+                return
+            identifier, state = next(iter(self._windows.items()))
+            if state[0] >= window - 1:
+                return
+            del self._windows[identifier]
+            self.evictions += 1
+
+    def _state(self, identifier: str, window: int) -> list:
+        state = self._windows.get(identifier)
+        if state is None:
+            if len(self._windows) >= self.max_keys:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+            state = [window, 0, 0]
+            self._windows[identifier] = state
+        else:
+            self._windows.move_to_end(identifier)
+            state[1], state[2] = advance(state[0], state[1], state[2], window)
+            state[0] = window
+        return state
 
     def is_allowed(self, identifier: str) -> bool:
         """
@@ -30,20 +81,48 @@ class RateLimiter:
         Returns:
             bool: True if request is allowed
         """
-        now = datetime.now()
-        cutoff = now - timedelta(seconds=self.window_seconds)
+        return self.check([(identifier, self.max_requests)])
+
+    def check(self, limits: Sequence[Tuple[str, int]]) -> bool:
+        """
+        Check a request against several identifiers at once
         
-        # Remove old requests outside the window
-        self.requests[identifier] = [
-            req_time for req_time in self.requests[identifier]
-            if req_time > cutoff
-        ]
+        The request is counted against all of them only if every one is
+        under its limit.
         
-        if len(self.requests[identifier]) < self.max_requests:
-            self.requests[identifier].append(now)
+        Args:
+            limits: (identifier, max requests) pairs, e.g. the client IP and the user ID
+            
+        Returns:
+            bool: True if request is allowed
+        """
+        window, weight = sliding_window(self._clock(), self.window_seconds)
+
+        with self._lock:
+            self._evict_idle(window)
+            states = [self._state(identifier, window) for identifier, _ in limits]
+            if any(state[2] * weight + state[1] >= max_requests
+                   for state, (_, max_requests) in zip(states, limits)):
+                self.limited += 1
+                return False
+            for state in states:
+                state[1] += 1
+            self.allowed += 1
             return True
-        
-        return False
+
+    def __len__(self):
+        return len(self._windows)
+
+    def stats(self) -> Dict:
+        return {
+            'max_requests': self.max_requests,
+            'window_seconds': self.window_seconds,
+            'keys': len(self._windows),
+            'max_keys': self.max_keys,
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'evictions': self.evictions,
+        }
 
 class SecurityUtils:
     @staticmethod
@@ -53,29 +132,52 @@ class SecurityUtils:
             return request.environ.get('HTTP_X_FORWARDED_FOR').split(',')[0]
         return request.remote_addr
 
-def rate_limit(max_requests: int = 100, window_seconds: int = 3600):
+def rate_limit(max_requests: int = 100, window_seconds: int = 3600,
+               per_user_max_requests: Optional[int] = None):
     """
     Rate limiting decorator
     
+    Counters live in the shared store selected by RATE_LIMIT_BACKEND so the
+    limit holds across workers; with the memory backend, or while the store
+    is failing, each worker enforces it on its own.
+    
     Args:
-        max_requests: Maximum requests allowed
+        max_requests: Maximum requests allowed per client IP
         window_seconds: Time window in seconds
+        per_user_max_requests: Maximum requests allowed per authenticated
+            user (uid from require_authentication), checked alongside the IP limit
     """
     limiter = RateLimiter(max_requests, window_seconds)
     
     def decorator(f):
+        # Each decorated endpoint has its own counters
+        scope = f"{f.__module__}.{f.__name__}"
+        
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            client_ip = SecurityUtils.get_client_ip()
+            limits = [(f"{scope}:ip:{SecurityUtils.get_client_ip()}", max_requests)]
+            current_user = kwargs.get('current_user') or {}
+            if per_user_max_requests is not None and current_user.get('uid'):
+                limits.append((f"{scope}:uid:{current_user['uid']}", per_user_max_requests))
+            
+            allowed = None
+            store = get_rate_limit_store()
+            if store is not None:
+                try:
+                    allowed = store.acquire(limits, window_seconds)
+                except Exception as e:
+                    logger.warning(f"Rate limit store failed, limiting per worker: {e}")
+            if allowed is None:
+                allowed = limiter.check(limits)
             
-            if not limiter.is_allowed(client_ip):
+            if not allowed:
                 from flask import jsonify
                 return jsonify({
                     'error': 'Rate limit exceeded. Too many requests.',
                     'code': 'RATE_LIMIT_EXCEEDED'
                 }), 429
             
-            return f(*args, **kwargs)
+            return current_app.ensure_sync(f)(*args, **kwargs)
         
         return decorated_function
     return decorator
@@ -0,0 +1,331 @@
+# Backend/utils/shared_catalog.py
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional
+import logging
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EDUCAT01'
+
+# magic, seq, refreshed_at, row_count, string_count, blob_bytes
+HEADER = struct.Struct('<8sQdIII')
+HEADER_SIZE = 64
+SEQ_OFFSET = 8
+
+# Columns stored as interned string-table indexes (uint32 per row)
+STRING_COLUMNS = (
+    'id', 'title', 'subject', 'department', 'uploader', 'uploaded_by', 'uploader_email',
+    'file_name', 'file_key', 'file_url', 'content_type', 'bucket_name', 'storage_path',
+    'created_at', 'updated_at',
+)
+# Columns stored as int64 per row
+INT_COLUMNS = ('file_size', 'download_count')
+
+# Index reserved for "no value"
+NULL_INDEX = 0xFFFFFFFF
+
+# What decoding a region that is being rewritten can raise (bad offsets, split UTF-8)
+TORN_READ_ERRORS = (ValueError, IndexError, TypeError, struct.error)
+
+
+def _layout(rows: int, strings: int) -> Dict[str, int]:
+    """Byte offsets of each region for a given row and string count"""
+    ints = HEADER_SIZE
+    string_cols = ints + rows * 8 * len(INT_COLUMNS)
+    offsets = string_cols + rows * 4 * len(STRING_COLUMNS)
+    blob = offsets + (strings + 1) * 4
+    return {'ints': ints, 'string_cols': string_cols, 'offsets': offsets, 'blob': blob}
+
+
+class SharedCatalogWriter:
+    """
+    Publishes note metadata into a shared memory segment for every worker.
+
+    Rows are stored column-wise: int64 arrays for numeric fields and uint32
+    indexes into a de-duplicated (interned) UTF-8 string table for text
+    fields, sorted newest first. A publish is bracketed by a seqlock: the
+    sequence number is odd while the segment is being rewritten, so readers
+    never need a lock. Only one process (the refresher) may write.
+    """
+
+    def __init__(self, name: str, size: int):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            logger.info(f"Created shared catalog segment {name} ({size} bytes)")
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+            logger.info(f"Attached to existing shared catalog segment {name}")
+        self.size = self.shm.size
+
+    def publish(self, notes: List[Dict]) -> int:
+        """
+        Replace the catalog contents
+
+        Args:
+            notes: Note dicts, any order
+
+        Returns:
+            int: Number of rows published (rows that do not fit are dropped, oldest first)
+
+        Raises:
+            ValueError: Not even one note fits; the previous contents are kept
+        """
+        notes = sorted(notes, key=lambda note: str(note.get('created_at') or ''), reverse=True)
+
+        strings: List[bytes] = []
+        interned: Dict[str, int] = {}
+        blob_bytes = 0
+
+        def intern(value) -> int:
+            nonlocal blob_bytes
+            if value is None or value == '':
+                return NULL_INDEX
+            text = str(value)
+            index = interned.get(text)
+            if index is None:
+                index = interned[text] = len(strings)
+                strings.append(text.encode('utf-8'))
+                blob_bytes += len(strings[-1])
+            return index
+
+        # Strings are interned row by row, so the first n rows only reference
+        # the strings interned so far: sizes[n] is what those rows need
+        string_cols: List[List[int]] = [[] for _ in STRING_COLUMNS]
+        sizes = [(0, 0)]
+        for note in notes:
+            for col, values in zip(STRING_COLUMNS, string_cols):
+                values.append(intern(note.get(col)))
+            sizes.append((len(strings), blob_bytes))
+        int_cols = [[int(note.get(col) or 0) for note in notes] for col in INT_COLUMNS]
+
+        rows = len(notes)
+        while rows and _layout(rows, sizes[rows][0])['blob'] + sizes[rows][1] > self.size:
+            rows -= 1
+        if notes and not rows:
+            raise ValueError(f"Shared catalog segment ({self.size} bytes) is too small for a single note")
+        if rows < len(notes):
+            logger.warning(f"Shared catalog full, dropped {len(notes) - rows} oldest notes")
+
+        strings = strings[:sizes[rows][0]]
+        blob = b''.join(strings)
+        layout = _layout(rows, len(strings))
+        payload = bytearray(layout['blob'] + len(blob) - HEADER_SIZE)
+
+        def put(offset, fmt, values):
+            struct.pack_into(f'<{len(values)}{fmt}', payload, offset - HEADER_SIZE, *values)
+
+        for i, values in enumerate(int_cols):
+            put(layout['ints'] + i * rows * 8, 'q', values[:rows])
+        for i, values in enumerate(string_cols):
+            put(layout['string_cols'] + i * rows * 4, 'I', values[:rows])
+        offsets, position = [], 0
+        for encoded in strings:
+            offsets.append(position)
+            position += len(encoded)
+        offsets.append(position)
+        put(layout['offsets'], 'I', offsets)
+        payload[layout['blob'] - HEADER_SIZE:] = blob
+
+        buf = self.shm.buf
+        seq = struct.unpack_from('<Q', buf, SEQ_OFFSET)[0] if bytes(buf[:8]) == MAGIC else 0
+        seq += 1 if seq % 2 == 0 else 2
+        struct.pack_into('<Q', buf, SEQ_OFFSET, seq)          # odd: write in progress
+        buf[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+        HEADER.pack_into(buf, 0, MAGIC, seq, time.time(), rows, len(strings), len(blob))
+        struct.pack_into('<Q', buf, SEQ_OFFSET, seq + 1)      # even: consistent again
+        return rows
+
+    def close(self):
+        self.shm.close()
+
+
+class SharedCatalogReader:
+    """
+    Lock-free reader for a catalog published by SharedCatalogWriter.
+
+    Queries run directly against the shared buffer and only the matching rows
+    are decoded; if the sequence number moved during the query it is retried.
+    """
+
+    def __init__(self, name: str, max_age: float = 120.0):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Readers must not unlink the segment when they exit (Python < 3.13)
+        try:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        except Exception:
+            pass
+        self.max_age = max_age
+        self._lookup_seq = None
+        self._lookup: Dict[str, int] = {}
+        self.queries = 0
+        self.retries = 0
+
+    def _header(self):
+        magic, seq, refreshed_at, rows, strings, blob_bytes = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC:
+            return None
+        return seq, refreshed_at, rows, strings, blob_bytes
+
+    def is_fresh(self) -> bool:
+        header = self._header()
+        return bool(header) and header[0] % 2 == 0 and time.time() - header[1] <= self.max_age
+
+    def _string(self, layout, index: int) -> str:
+        start, end = struct.unpack_from('<II', self.shm.buf, layout['offsets'] + index * 4)
+        return bytes(self.shm.buf[layout['blob'] + start:layout['blob'] + end]).decode('utf-8')
+
+    def _index_of(self, seq: int, layout, strings: int, value: str) -> int:
+        """Interned index of a string (None-safe), memoized per catalog version"""
+        if self._lookup_seq != seq:
+            self._lookup_seq, self._lookup = seq, {}
+        if value not in self._lookup:
+            target = value.encode('utf-8')
+            buf = self.shm.buf
+            offsets = buf[layout['offsets']:layout['offsets'] + (strings + 1) * 4].cast('I')
+            try:
+                found = -1
+                for i in range(strings):
+                    if offsets[i + 1] - offsets[i] == len(target) and \
+                            buf[layout['blob'] + offsets[i]:layout['blob'] + offsets[i + 1]] == target:
+                        found = i
+                        break
+            finally:
+                offsets.release()
+            self._lookup[value] = found
+        return self._lookup[value]
+
+    def query(self, subject: str = None, department: str = None, uploaded_by: str = None,
+              limit: int = 100) -> Optional[List[Dict]]:
+        """
+        Newest-first notes matching the optional filters
+
+        Returns:
+            list: Matching notes, or None if no consistent snapshot could be read
+        """
+        self.queries += 1
+        for _ in range(5):
+            header = self._header()
+            if not header or header[0] % 2:
+                self.retries += 1
+                time.sleep(0)
+                continue
+            seq, _, rows, strings, _ = header
+            layout = _layout(rows, strings)
+
+            try:
+                filters = []
+                for col, value in (('subject', subject), ('department', department), ('uploaded_by', uploaded_by)):
+                    if value:
+                        filters.append((STRING_COLUMNS.index(col), self._index_of(seq, layout, strings, value)))
+                if any(index < 0 for _, index in filters):
+                    results = []
+                else:
+                    results = self._scan(layout, rows, filters, limit)
+            except TORN_READ_ERRORS:
+                # A publish started after the header was read; the seq check
+                # would reject whatever was decoded, so just retry
+                self._lookup_seq = None
+                self.retries += 1
+                continue
+
+            if struct.unpack_from('<Q', self.shm.buf, SEQ_OFFSET)[0] == seq:
+                return results
+            self.retries += 1
+        return None
+
+    def _scan(self, layout, rows: int, filters, limit: int) -> List[Dict]:
+        buf = self.shm.buf
+        string_cols = buf[layout['string_cols']:layout['string_cols'] + rows * 4 * len(STRING_COLUMNS)].cast('I')
+        try:
+            int_cols = buf[layout['ints']:layout['ints'] + rows * 8 * len(INT_COLUMNS)].cast('q')
+        except TypeError:
+            string_cols.release()
+            raise
+        try:
+            results = []
+            for row in range(rows):
+                if all(string_cols[col * rows + row] == index for col, index in filters):
+                    note = {}
+                    for i, col in enumerate(STRING_COLUMNS):
+                        index = string_cols[i * rows + row]
+                        if index != NULL_INDEX:
+                            note[col] = self._string(layout, index)
+                    for i, col in enumerate(INT_COLUMNS):
+                        note[col] = int_cols[i * rows + row]
+                    results.append(note)
+                    if len(results) >= limit:
+                        break
+            return results
+        finally:
+            string_cols.release()
+            int_cols.release()
+
+    def stats(self) -> Dict:
+        header = self._header()
+        return {
+            'segment_bytes': self.shm.size,
+            'seq': header[0] if header else None,
+            'rows': header[2] if header else 0,
+            'strings': header[3] if header else 0,
+            'age_seconds': round(time.time() - header[1], 3) if header else None,
+            'fresh': self.is_fresh(),
+            'queries': self.queries,
+            'retries': self.retries,
+        }
+
+
+_catalog_reader = None
+_catalog_unavailable_until = 0.0
+
+
+def get_shared_catalog() -> Optional[SharedCatalogReader]:
+    """
+    Get the shared catalog reader if the catalog is enabled, published and fresh
+
+    Returns None (callers query the notes store directly) otherwise.
+    """
+    global _catalog_reader, _catalog_unavailable_until
+    if os.getenv('SHARED_CATALOG_ENABLED', 'false').lower() != 'true':
+        return None
+    if _catalog_reader is None:
+        if time.monotonic() < _catalog_unavailable_until:
+            return None
+        try:
+            _catalog_reader = SharedCatalogReader(
+                os.getenv('SHARED_CATALOG_NAME', 'edu_desk_catalog'),
+                max_age=float(os.getenv('SHARED_CATALOG_MAX_AGE', 120))
+            )
+            from utils.metrics import register_metrics
+            register_metrics('shared_catalog', _catalog_reader.stats)
+        except FileNotFoundError:
+            # Refresher not running yet; don't retry the attach on every request
+            _catalog_unavailable_until = time.monotonic() + 10
+            return None
+    return _catalog_reader if _catalog_reader.is_fresh() else None
+
+
+def run_catalog_refresher(interval: float = 30.0, once: bool = False):
+    """Publish the notes catalogue into shared memory every `interval` seconds"""
+    from utils.firestore_db import get_firestore_db
+
+    writer = SharedCatalogWriter(
+        os.getenv('SHARED_CATALOG_NAME', 'edu_desk_catalog'),
+        int(os.getenv('SHARED_CATALOG_BYTES', 16 * 1024 * 1024))
+    )
+    max_rows = int(os.getenv('SHARED_CATALOG_MAX_ROWS', 10000))
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                rows = writer.publish(get_firestore_db().get_all_notes(limit=max_rows))
+                logger.info(f"Published {rows} notes to shared catalog")
+            except Exception as e:
+                logger.error(f"Shared catalog refresh failed: {e}")
+            if once:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        writer.close()
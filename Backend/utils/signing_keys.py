@@ -0,0 +1,193 @@
+# Backend/utils/signing_keys.py
+from typing import Dict, Optional, Tuple
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from google.auth import jwt
+
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# X.509 certificates Google signs Firebase ID tokens with, keyed by key id
+FIREBASE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+FIREBASE_ISSUER_PREFIX = 'https://securetoken.google.com/'
+
+
+class SigningKeyRefresher:
+    """
+    Firebase ID token signing keys, fetched ahead of their expiry.
+
+    A background thread downloads the certificates and schedules the next
+    download when refresh_fraction of their Cache-Control max-age has
+    passed, retrying with backoff on failure. Request threads only read the
+    current key set and never wait for a fetch: keys() returns None until
+    the first fetch succeeds (callers fall back to the Admin SDK) and keeps
+    returning the last keys for stale_grace seconds after they expire while
+    a refresh is failing. With key_file, keys are read from a local JSON
+    file of {key id: PEM certificate} instead (tests and offline runs) and
+    re-read whenever it changes.
+    """
+
+    def __init__(self, url: str = FIREBASE_CERTS_URL, key_file: Optional[str] = None,
+                 refresh_fraction: float = 0.8, min_interval: float = 60.0,
+                 stale_grace: float = 3600.0, timeout: float = 10.0):
+        self.url = url
+        self.key_file = key_file
+        self.refresh_fraction = refresh_fraction
+        self.min_interval = min_interval
+        self.stale_grace = stale_grace
+        self.timeout = timeout
+
+        self._keys: Optional[Dict[str, str]] = None
+        self._expires_at = 0.0
+        self._file_mtime = None
+        self._next_refresh = 0.0
+        self._last_attempt = float('-inf')
+        self._failures_in_row = 0
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh_at = None
+
+        self._thread = threading.Thread(target=self._run, name='signing-key-refresh', daemon=True)
+        self._thread.start()
+
+    def keys(self) -> Optional[Dict[str, str]]:
+        """Current keys, or None if there are none usable (never blocks)"""
+        if self._keys is None:
+            return None
+        if time.time() > self._expires_at + self.stale_grace:
+            return None
+        return self._keys
+
+    def request_refresh(self):
+        """Ask the background thread to refresh now (e.g. an unknown key id showed up)"""
+        # At most once per min_interval, so tokens with bogus key ids can't hammer the endpoint
+        if time.monotonic() - self._last_attempt >= self.min_interval:
+            self._next_refresh = 0.0
+            self._wake.set()
+
+    def _fetch(self) -> Tuple[Dict[str, str], float]:
+        """Download the keys; returns them and their max-age in seconds"""
+        if self.key_file:
+            with open(self.key_file) as f:
+                keys = json.load(f)
+            self._file_mtime = os.path.getmtime(self.key_file)
+            return keys, self.min_interval
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        return response.json(), float(match.group(1)) if match else self.min_interval
+
+    def refresh(self) -> bool:
+        self._last_attempt = time.monotonic()
+        try:
+            keys, max_age = self._fetch()
+            if not keys:
+                raise ValueError('empty key set')
+        except Exception as e:
+            self.failures += 1
+            self._failures_in_row += 1
+            backoff = min(300.0, 5.0 * 2 ** (self._failures_in_row - 1))
+            self._next_refresh = time.monotonic() + backoff
+            logger.warning(f"Signing key refresh failed, retrying in {backoff:.0f}s: {e}")
+            return False
+
+        self._keys = dict(keys)
+        self._expires_at = time.time() + max_age
+        self._failures_in_row = 0
+        self._next_refresh = time.monotonic() + max(self.min_interval, max_age * self.refresh_fraction)
+        self.refreshes += 1
+        self.last_refresh_at = time.time()
+        logger.info(f"Loaded {len(keys)} token signing keys (max-age {max_age:.0f}s)")
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self.key_file and self._keys is not None:
+                try:
+                    if os.path.getmtime(self.key_file) != self._file_mtime:
+                        self._next_refresh = 0.0
+                except OSError:
+                    pass
+            if time.monotonic() >= self._next_refresh:
+                self.refresh()
+            self._wake.wait(max(0.05, min(self.min_interval, self._next_refresh - time.monotonic())))
+            self._wake.clear()
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            'source': self.key_file or self.url,
+            'keys': len(self._keys) if self._keys else 0,
+            'expires_in_seconds': round(self._expires_at - time.time(), 1) if self._keys else None,
+            'next_refresh_in_seconds': round(max(0.0, self._next_refresh - time.monotonic()), 1),
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'last_refresh_at': self.last_refresh_at,
+        }
+
+
+def verify_id_token_locally(id_token: str, keys: Dict[str, str], project_id: str,
+                            clock_skew: int = 0) -> Dict:
+    """
+    Verify a Firebase ID token against the given signing keys
+
+    Performs the checks the Admin SDK does without revocation: RS256
+    signature by a known key, expiry and issue time, audience, issuer and
+    subject.
+
+    Raises:
+        KeyError: The token was signed by a key that is not in keys
+        ValueError: The token is malformed, expired or otherwise invalid
+    """
+    header = jwt.decode_header(id_token)
+    if header.get('alg') != 'RS256':
+        raise ValueError(f"Unexpected token algorithm {header.get('alg')}")
+    if header.get('kid') not in keys:
+        raise KeyError(header.get('kid'))
+
+    claims = jwt.decode(id_token, certs=keys, audience=project_id, clock_skew_in_seconds=clock_skew)
+    if claims.get('auth_time', 0) > time.time() + clock_skew:
+        raise ValueError('Token has an authentication time in the future')
+    if claims.get('iss') != FIREBASE_ISSUER_PREFIX + project_id:
+        raise ValueError('Token has an incorrect issuer')
+    subject = claims.get('sub')
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise ValueError('Token has an invalid subject')
+    claims['uid'] = subject
+    return claims
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_signing_keys() -> Optional[SigningKeyRefresher]:
+    """Get the signing key refresher, or None when FIREBASE_LOCAL_VERIFY is false"""
+    global _refresher
+    if os.getenv('FIREBASE_LOCAL_VERIFY', 'true').lower() != 'true':
+        return None
+    if _refresher is None:
+        with _refresher_lock:
+            if _refresher is None:
+                refresher = SigningKeyRefresher(
+                    url=os.getenv('FIREBASE_CERTS_URL', FIREBASE_CERTS_URL),
+                    key_file=os.getenv('FIREBASE_SIGNING_KEYS_FILE') or None,
+                    refresh_fraction=float(os.getenv('FIREBASE_KEYS_REFRESH_FRACTION', 0.8)),
+                    stale_grace=float(os.getenv('FIREBASE_KEYS_STALE_GRACE_SECONDS', 3600)),
+                )
+                register_metrics('signing_keys', refresher.stats)
+                _refresher = refresher
+    return _refresher
@@ -0,0 +1,176 @@
+# Backend/utils/singleflight.py
+from typing import Any, Callable, Dict, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import register_metrics
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: coalescing stays per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical computations into one execution.
+
+    The first caller for a key runs fn; callers arriving while it is in
+    flight wait and receive the same result (or exception), so the result is
+    shared and must be treated as read-only. With a lock_dir, the executing
+    caller also takes an fcntl lock file so other worker processes wait for
+    it and read its result from a JSON file next to the lock instead of
+    running the computation again; results must then be JSON-serializable.
+    """
+
+    def __init__(self, name: str, lock_dir: Optional[str] = None, wait_timeout: float = 30.0):
+        self.name = name
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.wait_timeout = wait_timeout
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+        self.executions = 0
+        self.shared = 0
+        self.shared_across_processes = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn for key, or wait for the execution already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight '{self.name}:{key}'")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _execute(self, key: str, fn: Callable[[], Any]) -> Any:
+        if not self.lock_dir:
+            self.executions += 1
+            return fn()
+
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(self.lock_dir, f"{self.name}-{digest}")
+        started = time.time()
+
+        with open(f"{base}.lock", 'a+') as lock_file:
+            waited = self._acquire(lock_file)
+            if waited is None:
+                # Another worker holds the lock past our deadline: don't wait any longer
+                self.executions += 1
+                return fn()
+            try:
+                if waited:
+                    # Another worker computed this while we waited; reuse its result
+                    cached = self._read_result(base, since=started)
+                    if cached is not None:
+                        self.shared_across_processes += 1
+                        return cached
+                self.executions += 1
+                result = fn()
+                self._write_result(base, result)
+                return result
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _acquire(self, lock_file) -> Optional[bool]:
+        """
+        Take the lock file, polling so a stuck holder cannot block us forever
+
+        Returns:
+            bool: Whether we had to wait for another holder (None on timeout)
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return waited
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return None
+                waited = True
+                time.sleep(0.02)
+
+    @staticmethod
+    def _read_result(base: str, since: float) -> Any:
+        try:
+            with open(f"{base}.json") as f:
+                payload = json.load(f)
+            return payload['result'] if payload.get('written_at', 0) >= since else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _write_result(base: str, result: Any):
+        try:
+            tmp_path = f"{base}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'written_at': time.time(), 'result': result}, f)
+            os.replace(tmp_path, f"{base}.json")
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not share single-flight result across workers: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': len(self._calls),
+            'executions': self.executions,
+            'shared': self.shared,
+            'shared_across_processes': self.shared_across_processes,
+            'cross_process': bool(self.lock_dir),
+        }
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_singleflight(name: str) -> SingleFlight:
+    """Get (or create) the named single-flight group; SINGLEFLIGHT_LOCK_DIR enables cross-process locking"""
+    group = _groups.get(name)
+    if group is None:
+        with _groups_lock:
+            group = _groups.get(name)
+            if group is None:
+                group = _groups[name] = SingleFlight(
+                    name,
+                    lock_dir=os.getenv('SINGLEFLIGHT_LOCK_DIR') or None,
+                    wait_timeout=float(os.getenv('SINGLEFLIGHT_WAIT_SECONDS', 30))
+                )
+                register_metrics(f'singleflight_{name}', group.stats)
+    return group
@@ -2,6 +2,7 @@
 import boto3
 import os
 import uuid
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
 from werkzeug.utils import secure_filename
 import mimetypes
@@ -9,6 +10,8 @@ from datetime import datetime, timedelta
 from flask import current_app
 import logging
 from pathlib import Path
+from utils.operations import UsageLimitExceeded, r2_upload_operations, record_backend_operation
+from utils.resilience import get_dependency
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,9 @@ logger = logging.getLogger(__name__)
 class LocalFileStorage:
     """Simple filesystem storage (used for local/dev and Render disk)."""
 
+    # generate_presigned_url returns a server path, not something clients can fetch
+    supports_presigned_redirects = False
+
     def __init__(self, base_path: str):
         self.base_path = Path(base_path)
         self.base_path.mkdir(parents=True, exist_ok=True)
@@ -30,6 +36,7 @@ class LocalFileStorage:
         file_key = self.generate_unique_key(original_filename)
         target_path = self.base_path / file_key
         logger.info(f"Saving file to: {target_path}")
+        record_backend_operation('local', 'put_object')
         file_obj.save(target_path)
 
         file_size = target_path.stat().st_size
@@ -49,6 +56,7 @@ class LocalFileStorage:
         if not target_path.exists():
             logger.warning("File not found for deletion: %s", target_path)
             return False
+        record_backend_operation('local', 'delete_object')
         target_path.unlink()
         return True
 
@@ -57,12 +65,14 @@ class LocalFileStorage:
         if not target_path.exists():
             logger.error("File not found: %s", target_path)
             return None
+        record_backend_operation('local', 'get_object')
         return target_path.read_bytes()
 
     def get_file_metadata(self, file_key: str):
         target_path = self.base_path / file_key
         if not target_path.exists():
             return None
+        record_backend_operation('local', 'head_object')
         stat = target_path.stat()
         return {
             "file_key": file_key,
@@ -80,6 +90,8 @@ class LocalFileStorage:
         return None
 
 class CloudflareR2Storage:
+    supports_presigned_redirects = True
+
     def __init__(self):
         """Initialize Cloudflare R2 storage client"""
         self.access_key_id = os.environ.get('R2_ACCESS_KEY_ID')
@@ -98,8 +110,17 @@ class CloudflareR2Storage:
                 endpoint_url=self.endpoint_url,
                 aws_access_key_id=self.access_key_id,
                 aws_secret_access_key=self.secret_access_key,
-                region_name='auto'  # R2 uses 'auto' for region
+                region_name='auto',  # R2 uses 'auto' for region
+                config=Config(
+                    connect_timeout=float(os.getenv('R2_CONNECT_TIMEOUT_SECONDS', 3)),
+                    read_timeout=float(os.getenv('R2_READ_TIMEOUT_SECONDS', 10)),
+                    retries={'max_attempts': int(os.getenv('R2_MAX_ATTEMPTS', 2)), 'mode': 'standard'},
+                    # One connection per worker of the R2 pool (see get_dependency)
+                    max_pool_connections=int(os.getenv('R2_MAX_WORKERS', os.getenv('RESILIENCE_MAX_WORKERS', 32)))
+                )
             )
+            # Deadlines and circuit breaker around every R2 request
+            self.resilience = get_dependency('r2')
             logger.info("Cloudflare R2 client initialized successfully")
         except Exception as e:
             logger.error("Failed to initialize Cloudflare R2 client")
@@ -111,7 +132,8 @@ class CloudflareR2Storage:
         """Test the R2 connection by listing buckets or checking bucket access"""
         try:
             # Try to check if our bucket exists and is accessible
-            self.s3_client.head_bucket(Bucket=self.bucket_name)
+            record_backend_operation('r2', 'head_bucket')
+            self.resilience.call('head_bucket', lambda timeout: self.s3_client.head_bucket(Bucket=self.bucket_name))
             return True
         except ClientError as e:
             error_code = e.response['Error']['Code']
@@ -193,8 +215,10 @@ class CloudflareR2Storage:
             if not content_type:
                 content_type = 'application/octet-stream'
             
-            # Upload to R2
-            self.s3_client.upload_fileobj(
+            # Upload to R2 (large files go up in multipart chunks, each billed)
+            for operation, count in r2_upload_operations(file_size).items():
+                record_backend_operation('r2', operation, count)
+            self.resilience.call('upload', lambda timeout: self.s3_client.upload_fileobj(
                 file,
                 self.bucket_name,
                 file_key,
@@ -205,7 +229,7 @@ class CloudflareR2Storage:
                         'upload_timestamp': datetime.now().isoformat()
                     }
                 }
-            )
+            ), deadline=120)
             
             # Generate public URL (if your bucket allows public access)
             file_url = f"{self.endpoint_url.replace('.r2.cloudflarestorage.com', '.r2.dev')}/{file_key}"
@@ -228,6 +252,8 @@ class CloudflareR2Storage:
         except NoCredentialsError:
             logger.error("No R2 credentials found")
             raise Exception("Cloud storage credentials not configured")
+        except UsageLimitExceeded:
+            raise
         except Exception as e:
             logger.error("Unexpected error uploading to R2")
             if current_app and current_app.debug:
@@ -249,10 +275,11 @@ class CloudflareR2Storage:
                 logger.warning("No file key provided for deletion")
                 return False
                 
-            self.s3_client.delete_object(
+            record_backend_operation('r2', 'delete_object')
+            self.resilience.call('delete', lambda timeout: self.s3_client.delete_object(
                 Bucket=self.bucket_name,
                 Key=file_key
-            )
+            ))
             logger.info("File deleted successfully from R2")
             return True
             
@@ -288,6 +315,8 @@ class CloudflareR2Storage:
                 expiration = max_expiration
                 logger.warning(f"Expiration time limited to {max_expiration} seconds")
             
+            # Signing is local, but the client's GET is billed to us
+            record_backend_operation('r2', 'presigned_get')
             presigned_url = self.s3_client.generate_presigned_url(
                 'get_object',
                 Params={'Bucket': self.bucket_name, 'Key': file_key},
@@ -318,10 +347,11 @@ class CloudflareR2Storage:
                 logger.warning("No file key provided for metadata retrieval")
                 return None
                 
-            response = self.s3_client.head_object(
+            record_backend_operation('r2', 'head_object')
+            response = self.resilience.call('head', lambda timeout: self.s3_client.head_object(
                 Bucket=self.bucket_name,
                 Key=file_key
-            )
+            ), key=('head', file_key), hedge=True, on_hedge=lambda: record_backend_operation('r2', 'head_object'))
             
             return {
                 'file_key': file_key,
@@ -336,6 +366,13 @@ class CloudflareR2Storage:
             if current_app and current_app.debug:
                 logger.error(f"File metadata retrieval error: {e}")
             return None
+        except UsageLimitExceeded:
+            raise
+        except Exception as e:
+            logger.error("Unexpected error getting file metadata")
+            if current_app and current_app.debug:
+                logger.error(f"File metadata error: {e}")
+            return None
         
     
     def get_file_content(self, file_key):
@@ -345,17 +382,22 @@ class CloudflareR2Storage:
                 logger.warning("No file key provided for content retrieval")
                 return None
                 
-            response = self.s3_client.get_object(
+            # The body is read inside the call so the deadline covers the transfer.
+            # Not hedged: a duplicate full-body download doubles the transfer
+            # and holds a second R2 worker for up to the whole deadline
+            record_backend_operation('r2', 'get_object')
+            return self.resilience.call('get', lambda timeout: self.s3_client.get_object(
                 Bucket=self.bucket_name,
                 Key=file_key
-            )
-            return response['Body'].read()
+            )['Body'].read(), deadline=30)
             
         except ClientError as e:
             logger.error("Error retrieving file content from R2")
             if current_app and current_app.debug:
                 logger.error(f"File content retrieval error: {e}")
             return None
+        except UsageLimitExceeded:
+            raise
         except Exception as e:
             logger.error("Unexpected error retrieving file from R2")
             if current_app and current_app.debug:
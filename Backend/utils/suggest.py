@@ -0,0 +1,335 @@
+# Backend/utils/suggest.py
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import re
+import threading
+
+from utils.firestore_db import add_note_listener, get_firestore_db
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Note fields that feed the autocomplete index
+SUGGEST_FIELDS = ('title', 'subject', 'department')
+
+# Upper bound on prefix entries inspected per lookup (keeps 1-char queries cheap)
+MAX_PREFIX_SCAN = 200
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_term(text: str) -> str:
+    """Lowercase and collapse whitespace so lookups are case/spacing insensitive"""
+    return _WHITESPACE.sub(' ', str(text)).strip().casefold()
+
+
+def trigrams(text: str) -> set:
+    """Padded character trigrams used for typo-tolerant matching"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(word: str) -> int:
+    """Typos tolerated in a query word: none below 4 characters, two from 8"""
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def prefix_edit_distance(a: str, b: str) -> int:
+    """
+    Edits (insert, delete, substitute, swap adjacent) from a to the closest prefix of b
+
+    Prefixes count so a partially typed word still matches ("pyth" -> "python").
+    """
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        before, previous = previous, current
+    return min(previous)
+
+
+class SuggestIndex:
+    """
+    Compact in-memory prefix + trigram index of note titles, subjects and departments.
+
+    Every distinct (field, normalized text) pair is stored once as a term with a
+    reference count of the notes using it. Prefix lookups bisect a sorted list of
+    word suffixes ("data structures" is reachable from "data" and "struct").
+    When prefixes do not fill the requested number of completions, each query
+    word is matched against the words of every term: trigram postings narrow
+    the candidates and an edit distance check accepts up to max_edits() typos,
+    so "pyhton" finds "Python" and "operating sytems" finds "Operating Systems".
+    """
+
+    def __init__(self, max_terms: int = 5000):
+        self.max_terms = max_terms
+        self._lock = threading.RLock()
+        # term key -> {'text', 'field', 'count', 'grams'}
+        self._terms: Dict[Tuple[str, str], Dict] = {}
+        # sorted "word-suffix\x00field\x00normalized" entries for prefix search
+        self._prefixes: List[str] = []
+        # word -> set of term keys containing it
+        self._words: Dict[str, set] = {}
+        # trigram -> set of words
+        self._grams: Dict[str, set] = defaultdict(set)
+        # note id -> {field: original text} so updates/deletes can release terms
+        self._notes: Dict[str, Dict[str, str]] = {}
+
+    # ------------------------------------------------------------------ writes
+
+    def add_note(self, note_id: str, note: Dict):
+        """Index (or re-index) the searchable fields of a note"""
+        fields = {
+            field: str(note[field]).strip()
+            for field in SUGGEST_FIELDS
+            if note.get(field) and str(note[field]).strip()
+        }
+        with self._lock:
+            self.remove_note(note_id)
+            self._notes[note_id] = fields
+            for field, text in fields.items():
+                self._acquire(field, text)
+            if len(self._terms) > self.max_terms:
+                self._evict()
+
+    def update_note(self, note_id: str, changes: Dict):
+        """Apply a partial update, keeping fields the update does not touch"""
+        with self._lock:
+            merged = dict(self._notes.get(note_id, {}))
+            merged.update({k: v for k, v in changes.items() if k in SUGGEST_FIELDS})
+            self.add_note(note_id, merged)
+
+    def remove_note(self, note_id: str):
+        """Release the terms held by a note"""
+        with self._lock:
+            fields = self._notes.pop(note_id, None)
+            if not fields:
+                return
+            for field, text in fields.items():
+                self._release((field, normalize_term(text)))
+
+    def on_note_event(self, event: str, note_id: str, note: Dict):
+        """Note listener hook keeping the index in step with note writes"""
+        if event == 'created':
+            self.add_note(note_id, note)
+        elif event == 'updated':
+            self.update_note(note_id, note)
+        elif event == 'deleted':
+            self.remove_note(note_id)
+
+    def _acquire(self, field: str, text: str):
+        key = (field, normalize_term(text))
+        term = self._terms.get(key)
+        if term:
+            term['count'] += 1
+            return
+
+        normalized = key[1]
+        self._terms[key] = {'text': text, 'field': field, 'count': 1}
+        for suffix in self._word_suffixes(normalized):
+            insort(self._prefixes, f"{suffix}\x00{field}\x00{normalized}")
+        for word in set(normalized.split(' ')):
+            keys = self._words.get(word)
+            if keys is None:
+                keys = self._words[word] = set()
+                for gram in trigrams(word):
+                    self._grams[gram].add(word)
+            keys.add(key)
+
+    def _release(self, key: Tuple[str, str]):
+        term = self._terms.get(key)
+        if not term:
+            return
+        term['count'] -= 1
+        if term['count'] <= 0:
+            self._drop(key)
+
+    def _drop(self, key: Tuple[str, str]):
+        field, normalized = key
+        self._terms.pop(key, None)
+        for suffix in self._word_suffixes(normalized):
+            entry = f"{suffix}\x00{field}\x00{normalized}"
+            i = bisect_left(self._prefixes, entry)
+            if i < len(self._prefixes) and self._prefixes[i] == entry:
+                del self._prefixes[i]
+        for word in set(normalized.split(' ')):
+            keys = self._words.get(word)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if keys:
+                continue
+            del self._words[word]
+            for gram in trigrams(word):
+                postings = self._grams.get(gram)
+                if postings is not None:
+                    postings.discard(word)
+                    if not postings:
+                        del self._grams[gram]
+
+    def _evict(self):
+        """Drop the least referenced terms, leaving 10% headroom so eviction stays rare"""
+        overflow = len(self._terms) - int(self.max_terms * 0.9)
+        victims = {key for key, _ in sorted(self._terms.items(), key=lambda kv: kv[1]['count'])[:overflow]}
+        for key in victims:
+            self._drop(key)
+        # Notes forget evicted terms, so a later update or delete can't release
+        # a term that was re-added for other notes since
+        for fields in self._notes.values():
+            for field, text in list(fields.items()):
+                if (field, normalize_term(text)) in victims:
+                    del fields[field]
+        logger.debug(f"Suggest index evicted {len(victims)} terms")
+
+    @staticmethod
+    def _word_suffixes(normalized: str) -> List[str]:
+        """The term itself plus every suffix starting at a word boundary"""
+        suffixes = [normalized]
+        for i, char in enumerate(normalized):
+            if char == ' ' and i + 1 < len(normalized):
+                suffixes.append(normalized[i + 1:])
+        return suffixes
+
+    # ------------------------------------------------------------------- reads
+
+    def suggest(self, query: str, limit: int = 8, field: Optional[str] = None) -> List[Dict]:
+        """
+        Return the top completions for a (possibly misspelled) partial query
+
+        Args:
+            query: Text typed so far
+            limit: Maximum number of completions
+            field: Restrict completions to one of SUGGEST_FIELDS
+
+        Returns:
+            list: Completions ordered by relevance, each with text, field and count
+        """
+        q = normalize_term(query)
+        if not q or limit <= 0:
+            return []
+
+        with self._lock:
+            scored = {}
+
+            # Prefix matches: whole-term prefixes rank above word prefixes
+            i = bisect_left(self._prefixes, q)
+            end = min(len(self._prefixes), i + MAX_PREFIX_SCAN)
+            while i < end and self._prefixes[i].startswith(q):
+                _, term_field, normalized = self._prefixes[i].split('\x00')
+                i += 1
+                if field and term_field != field:
+                    continue
+                key = (term_field, normalized)
+                score = 3.0 if normalized.startswith(q) else 2.0
+                if scored.get(key, 0) < score:
+                    scored[key] = score
+
+            # Typo tolerance for anything prefixes missed (scores below 1 rank after prefixes)
+            if len(scored) < limit and any(max_edits(word) for word in q.split(' ')):
+                for key, score in self._fuzzy(q, field).items():
+                    scored.setdefault(key, score)
+
+            ranked = sorted(
+                scored.items(),
+                key=lambda kv: (-kv[1], -self._terms[kv[0]]['count'], len(kv[0][1]))
+            )[:limit]
+
+            return [
+                {
+                    'text': self._terms[key]['text'],
+                    'field': key[0],
+                    'count': self._terms[key]['count'],
+                }
+                for key, _ in ranked
+            ]
+
+    def _fuzzy(self, q: str, field: Optional[str]) -> Dict[Tuple[str, str], float]:
+        """Terms in which every query word matches a word (mean of the word scores)"""
+        words = q.split(' ')
+        matched = None
+        for word in words:
+            scores = self._match_word(word)
+            if field:
+                scores = {key: score for key, score in scores.items() if key[0] == field}
+            if matched is None:
+                matched = scores
+            else:
+                matched = {key: matched[key] + score for key, score in scores.items() if key in matched}
+            if not matched:
+                return {}
+        return {key: total / len(words) for key, total in matched.items()}
+
+    def _match_word(self, word: str) -> Dict[Tuple[str, str], float]:
+        """Terms with a word that starts with `word` give or take max_edits(word) typos"""
+        matches = {}
+        edits = max_edits(word)
+        if not edits:
+            i = bisect_left(self._prefixes, word)
+            end = min(len(self._prefixes), i + MAX_PREFIX_SCAN)
+            while i < end and self._prefixes[i].startswith(word):
+                _, term_field, normalized = self._prefixes[i].split('\x00')
+                matches[(term_field, normalized)] = 1.0
+                i += 1
+            return matches
+
+        # k edits destroy at most 4k of a word's trigrams (and a prefix match
+        # loses the end-of-word one), so fewer shared trigrams can't be a match
+        grams = trigrams(word)
+        needed = max(1, len(grams) - 4 * edits - 1)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                overlap[candidate] += 1
+        for candidate, shared in overlap.items():
+            if shared < needed:
+                continue
+            distance = prefix_edit_distance(word, candidate)
+            if distance > edits:
+                continue
+            score = 1.0 - distance / (len(word) + 1)
+            for key in self._words[candidate]:
+                if matches.get(key, 0) < score:
+                    matches[key] = score
+        return matches
+
+    def stats(self) -> Dict:
+        """Size of the index for monitoring"""
+        with self._lock:
+            return {
+                'notes': len(self._notes),
+                'terms': len(self._terms),
+                'max_terms': self.max_terms,
+                'prefix_entries': len(self._prefixes),
+                'words': len(self._words),
+                'trigrams': len(self._grams),
+            }
+
+
+_suggest_index = None
+_suggest_index_lock = threading.Lock()
+
+
+def get_suggest_index() -> SuggestIndex:
+    """Get the global suggest index, seeding it from the notes store on first use"""
+    global _suggest_index
+    if _suggest_index is None:
+        with _suggest_index_lock:
+            if _suggest_index is None:
+                index = SuggestIndex(max_terms=int(os.getenv('SUGGEST_MAX_TERMS', 5000)))
+                add_note_listener(index.on_note_event)
+                register_metrics('suggest_index', index.stats)
+                seed_limit = int(os.getenv('SUGGEST_SEED_LIMIT', 5000))
+                for note in get_firestore_db().get_all_notes(limit=seed_limit):
+                    index.add_note(note['id'], note)
+                logger.info(f"Suggest index seeded with {index.stats()['terms']} terms")
+                _suggest_index = index
+    return _suggest_index
@@ -0,0 +1,114 @@
+# Backend/utils/token_cache.py
+from typing import Dict, Optional
+import hashlib
+import os
+import threading
+import time
+
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+from utils.resilience import LatencyTracker
+
+
+class VerifiedTokenCache:
+    """
+    Decoded claims of verified Firebase ID tokens, kept until the token expires.
+
+    A page load sends the same token with every API call; only the first
+    one pays for signature verification. Entries are keyed by a SHA-256 of
+    the token (the raw token is never stored) and expire at the token's exp
+    claim. Each entry remembers when revocation was last checked so
+    sensitive routes can re-check at most every revocation_interval seconds
+    while ordinary routes trust the cached claims until expiry, exactly as
+    an uncached verify_id_token without check_revoked would.
+    """
+
+    def __init__(self, max_entries: int = 4096, revocation_interval: float = 300.0):
+        self.revocation_interval = revocation_interval
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=3600.0, name='verified_tokens')
+        self._latency = LatencyTracker()
+        self._lock = threading.Lock()
+
+        self.verifications = 0
+        self.revocation_checks = 0
+        self.verification_seconds = 0.0
+        self.max_verification_seconds = 0.0
+
+    @staticmethod
+    def key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, check_revoked: bool = False) -> Optional[Dict]:
+        """
+        Cached claims, or None if the token must be verified (again)
+
+        Args:
+            key: key() of the token
+            check_revoked: The caller needs revocation checked within revocation_interval
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        claims, revocation_checked_at = entry
+        if check_revoked and (revocation_checked_at is None or
+                              time.monotonic() - revocation_checked_at > self.revocation_interval):
+            return None
+        return dict(claims)
+
+    def put(self, key: str, claims: Dict, revocation_checked: bool = False):
+        ttl = claims.get('exp', 0) - time.time()
+        if ttl <= 0:
+            return
+        if not revocation_checked:
+            # Keep the last revocation check of a token verified again without one
+            previous = self._cache.get_stale(key)
+            checked_at = previous[1] if previous else None
+        else:
+            checked_at = time.monotonic()
+        self._cache.set(key, (dict(claims), checked_at), ttl_seconds=ttl)
+
+    def invalidate(self, key: str):
+        self._cache.invalidate(key)
+
+    def record_verification(self, seconds: float, revocation_checked: bool = False):
+        self._latency.record(seconds)
+        with self._lock:
+            self.verifications += 1
+            if revocation_checked:
+                self.revocation_checks += 1
+            self.verification_seconds += seconds
+            self.max_verification_seconds = max(self.max_verification_seconds, seconds)
+
+    def stats(self) -> Dict:
+        p95 = self._latency.percentile(0.95)
+        return {
+            **self._cache.stats(),
+            'verifications': self.verifications,
+            'revocation_checks': self.revocation_checks,
+            'revocation_interval': self.revocation_interval,
+            'avg_verification_ms': round(self.verification_seconds / self.verifications * 1000, 3)
+            if self.verifications else None,
+            'p95_verification_ms': round(p95 * 1000, 3) if p95 is not None else None,
+            'max_verification_ms': round(self.max_verification_seconds * 1000, 3),
+        }
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache() -> Optional[VerifiedTokenCache]:
+    """Get the verified-token cache, or None when AUTH_TOKEN_CACHE_ENABLED is false"""
+    global _token_cache
+    if os.getenv('AUTH_TOKEN_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                cache = VerifiedTokenCache(
+                    max_entries=int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 4096)),
+                    revocation_interval=float(os.getenv('AUTH_REVOCATION_CHECK_SECONDS', 300))
+                )
+                register_metrics('auth_tokens', cache.stats)
+                _token_cache = cache
+    return _token_cache
@@ -1,12 +1,441 @@
 from datetime import datetime, timezone
 from typing import Dict, Optional, Tuple
+from utils.fanout import get_fanout_executor
 from utils.firestore_db import get_firestore_db
+from utils.metrics import register_metrics
+from utils.operations import UsageLimitExceeded, add_operation_sink, operation_scope, summarize
+from utils.usage_history import UsageHistory, project_month_end
+from utils.write_queue import get_write_queue
+import atexit
 import os
 import logging
+import threading
+import time
 from firebase_admin import firestore
+from flask import current_app, request
 
 logger = logging.getLogger(__name__)
 
+# Daily Firestore usage documents are named FIRESTORE_DOC_PREFIX + YYYY-MM-DD
+FIRESTORE_DOC_PREFIX = 'firestore_'
+
+
+class UsageAggregator:
+    """
+    In-process aggregation of usage counters for UsageTracker.
+
+    record_operation() only adds to local deltas keyed by (document, field);
+    a background thread flushes them every flush_interval seconds as one
+    batched Increment per document (through the write queue when enabled).
+    Limit checks read a snapshot of the usage documents, refreshed every
+    snapshot_ttl seconds off the request path, plus the deltas not yet
+    written, so accounting costs no Firestore round trips per request.
+    Other workers' operations become visible on the next snapshot refresh,
+    which makes limits approximate to within one refresh interval.
+    """
+
+    def __init__(self, tracker: 'UsageTracker', flush_interval: float = 5.0, snapshot_ttl: float = 30.0):
+        self.tracker = tracker
+        self.flush_interval = flush_interval
+        self.snapshot_ttl = snapshot_ttl
+
+        # (doc_id, field) -> delta
+        self._pending: Dict[Tuple[str, str], int] = {}
+        # Deltas swapped out of _pending but not yet written
+        self._inflight: Dict[Tuple[str, str], int] = {}
+        self._snapshot: Optional[Dict] = None
+        self._snapshot_at = 0.0
+        self._known_docs = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        self.recorded = 0
+        self.flushes = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.last_flush_at = None
+
+        self._thread = threading.Thread(target=self._run, name='usage-aggregator-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, storage_delta: int = 0):
+        """Record one route-level operation and the storage it added or freed"""
+        with self._lock:
+            if storage_delta:
+                key = (self.tracker.get_storage_document_id(), 'storage_bytes')
+                self._pending[key] = self._pending.get(key, 0) + storage_delta
+            self.recorded += 1
+
+    def add_delta(self, doc_id: str, field: str, delta: int):
+        """Queue a raw counter change for the next flush"""
+        with self._lock:
+            key = (doc_id, field)
+            self._pending[key] = self._pending.get(key, 0) + delta
+
+    def _unwritten(self, doc_id: str, field: str) -> int:
+        key = (doc_id, field)
+        return self._pending.get(key, 0) + self._inflight.get(key, 0)
+
+    def current_usage(self) -> Dict:
+        """Last snapshot plus unwritten deltas (same shape as get_current_usage)"""
+        snapshot = self._snapshot
+        month_key = self.tracker.get_current_month_key()
+        if (snapshot is None or snapshot.get('month_key') != month_key or
+                snapshot.get('firestore_day') != self.tracker.get_firestore_document_id()):
+            # Cold start, new month or new day: read synchronously once
+            self.refresh()
+            snapshot = self._snapshot
+        elif time.monotonic() - self._snapshot_at > self.snapshot_ttl:
+            self._wake.set()
+
+        usage = dict(snapshot)
+        ops_doc = self.tracker.get_usage_document_id()
+        with self._lock:
+            usage['class_a_operations'] += self._unwritten(ops_doc, 'class_a_operations')
+            usage['class_b_operations'] += self._unwritten(ops_doc, 'class_b_operations')
+            usage['storage_bytes'] = max(0, usage['storage_bytes'] + self._unwritten(
+                self.tracker.get_storage_document_id(), 'storage_bytes'
+            ))
+            firestore_doc = self.tracker.get_firestore_document_id()
+            usage['firestore_reads'] += self._unwritten(firestore_doc, 'firestore_reads')
+            usage['firestore_writes'] += self._unwritten(firestore_doc, 'firestore_writes')
+        return usage
+
+    def refresh(self):
+        """Re-read the usage documents (creating them if missing)"""
+        with self._flush_lock:
+            storage_bytes = self.tracker.get_current_storage()
+            operations = self.tracker.get_current_operations()
+            firestore_usage = self.tracker.get_current_firestore_usage()
+            if storage_bytes < 0:
+                # Aggregated deletes can overshoot; never report negative storage
+                self.tracker.db.db.collection(self.tracker.collection_name).document(
+                    self.tracker.get_storage_document_id()
+                ).set({'storage_bytes': 0, 'last_updated': datetime.now(timezone.utc)}, merge=True)
+                storage_bytes = 0
+            self._snapshot = {
+                'month_key': operations.get('month_key', self.tracker.get_current_month_key()),
+                'created_at': operations.get('created_at'),
+                'last_updated': operations.get('last_updated'),
+                'storage_bytes': storage_bytes,
+                'class_a_operations': operations.get('class_a_operations', 0),
+                'class_b_operations': operations.get('class_b_operations', 0),
+                'reset_date': operations.get('reset_date'),
+                'firestore_day': self.tracker.get_firestore_document_id(),
+                'firestore_reads': firestore_usage['firestore_reads'],
+                'firestore_writes': firestore_usage['firestore_writes'],
+            }
+            self._snapshot_at = time.monotonic()
+            self._known_docs.update({self.tracker.get_usage_document_id(), self.tracker.get_storage_document_id()})
+            self.refreshes += 1
+
+    def invalidate(self):
+        """Force a re-read on the next check (after manual resets)"""
+        self._snapshot = None
+
+    def flush(self) -> int:
+        """
+        Write all pending deltas
+
+        Returns:
+            int: Number of counters written
+        """
+        with self._lock:
+            items = self._pending
+            self._pending = {}
+            for key, delta in items.items():
+                self._inflight[key] = self._inflight.get(key, 0) + delta
+        if not items:
+            return 0
+
+        with self._flush_lock:
+            try:
+                if any(doc_id not in self._known_docs and not doc_id.startswith(FIRESTORE_DOC_PREFIX)
+                       for doc_id, _ in items):
+                    # Make sure a new month's document exists before updating it
+                    self.tracker.get_current_operations()
+                    self.tracker.get_current_storage()
+                    self._known_docs.update({
+                        self.tracker.get_usage_document_id(), self.tracker.get_storage_document_id()
+                    })
+                self._write(items)
+                written = True
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Failed to flush usage counters, re-queueing: {e}")
+                written = False
+
+            with self._lock:
+                for key, delta in items.items():
+                    remaining = self._inflight.get(key, 0) - delta
+                    if remaining:
+                        self._inflight[key] = remaining
+                    else:
+                        self._inflight.pop(key, None)
+                    if not written:
+                        self._pending[key] = self._pending.get(key, 0) + delta
+                    elif self._snapshot is not None and key[1] in self._snapshot and key[0] in (
+                            self.tracker.get_usage_document_id(), self.tracker.get_storage_document_id(),
+                            self.tracker.get_firestore_document_id()):
+                        # Keep the snapshot in step instead of re-reading it
+                        self._snapshot = {**self._snapshot, key[1]: self._snapshot.get(key[1], 0) + delta}
+
+            if written:
+                self.flushes += 1
+                self.last_flush_at = time.time()
+            return len(items) if written else 0
+
+    def _write(self, items: Dict[Tuple[str, str], int]):
+        now = datetime.now(timezone.utc)
+        by_doc: Dict[str, Dict] = {}
+        for (doc_id, field), delta in items.items():
+            if delta:
+                by_doc.setdefault(doc_id, {'last_updated': now})[field] = firestore.Increment(delta)
+        if not by_doc:
+            return
+
+        queue = get_write_queue()
+        writer = queue.writer() if queue is not None else self.tracker.db.db.batch()
+        collection = self.tracker.db.db.collection(self.tracker.collection_name)
+        for doc_id, update in by_doc.items():
+            if doc_id.startswith(FIRESTORE_DOC_PREFIX):
+                # Daily documents are created by their first flush
+                writer.set(collection.document(doc_id), update, merge=True)
+            else:
+                writer.update(collection.document(doc_id), update)
+        writer.commit()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._snapshot is not None and time.monotonic() - self._snapshot_at > self.snapshot_ttl:
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Usage aggregator error: {e}")
+
+    def close(self):
+        """Stop the background flusher and drain what is left"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'recorded_operations': self.recorded,
+                'pending_counters': len(self._pending),
+                'inflight_counters': len(self._inflight),
+                'flushes': self.flushes,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'snapshot_age_seconds': round(time.monotonic() - self._snapshot_at, 3) if self._snapshot else None,
+                'last_flush_at': self.last_flush_at,
+                'flush_interval': self.flush_interval,
+            }
+
+
+@firestore.transactional
+def _lease_budget_in_transaction(transaction, doc_ref, field: str, limit: int, needed: int,
+                                 fraction: float, max_share: float) -> Optional[int]:
+    """
+    Reserve a slice of the remaining budget of one usage counter
+
+    The document keeps '<field>_leased', the total handed out to workers this
+    period (spent or not). Slices are a fraction of what is left, capped at
+    max_share of the limit, so they shrink as the limit approaches.
+
+    Returns:
+        int: Units granted (0 when the budget is exhausted), None if the document is missing
+    """
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    data = snapshot.to_dict()
+    leased_field = f"{field}_leased"
+    # Operations recorded without a lease (or before leases existed) count too
+    leased = max(data.get(leased_field, 0) or 0, data.get(field, 0) or 0)
+    available = limit - leased
+    if available < needed:
+        return 0
+    size = min(available, max(needed, min(int(available * fraction), int(limit * max_share))))
+    transaction.update(doc_ref, {leased_field: leased + size})
+    return size
+
+
+class BudgetLease:
+    """
+    Worker-local slice of a global usage budget.
+
+    Units are spent from the local slice with no I/O; when it runs below the
+    low-water mark a new slice is reserved in the background, and a request
+    that needs more than is left reserves one synchronously. Because every
+    spent unit was reserved first, all workers together cannot spend more
+    than the limit; a worker that dies without returning its slice strands
+    at most one slice until the period resets.
+    """
+
+    def __init__(self, tracker: 'UsageTracker', field: str, doc_id_fn, limit: int,
+                 fraction: float = 0.01, max_share: float = 0.001, retry_seconds: float = 5.0):
+        self.tracker = tracker
+        self.field = field
+        self.doc_id_fn = doc_id_fn
+        self.limit = limit
+        self.fraction = fraction
+        self.max_share = max_share
+        self.retry_seconds = retry_seconds
+
+        self.doc_id = None
+        self.remaining = 0
+        self.last_grant = 0
+        self._exhausted_until = 0.0
+        self._prefetching = False
+        self._lock = threading.Lock()
+        self._renew_lock = threading.Lock()
+
+        self.renewals = 0
+        self.denied = 0
+        self.errors = 0
+
+    def _doc_ref(self, doc_id: str):
+        return self.tracker.db.db.collection(self.tracker.collection_name).document(doc_id)
+
+    def _roll(self):
+        """Start from an empty slice when the period (document) changes; call with _lock held"""
+        doc_id = self.doc_id_fn()
+        if doc_id != self.doc_id:
+            self.doc_id = doc_id
+            self.remaining = 0
+            self.last_grant = 0
+            self._exhausted_until = 0.0
+
+    def consume(self, units: int) -> Optional[bool]:
+        """
+        Spend units from the local slice, reserving more if needed
+
+        Returns:
+            bool: Whether the budget allows it (None if no slice could be
+            reserved, e.g. Firestore is unavailable; callers fall back)
+        """
+        with self._lock:
+            self._roll()
+            if self.remaining >= units:
+                self.remaining -= units
+                if self.remaining < self.last_grant * 0.2:
+                    self._prefetch()
+                return True
+            if time.monotonic() < self._exhausted_until:
+                self.denied += 1
+                return False
+
+        with self._renew_lock:
+            with self._lock:
+                self._roll()
+                if self.remaining >= units:
+                    self.remaining -= units
+                    return True
+                missing = units - self.remaining
+            granted = self._renew(missing)
+            with self._lock:
+                if granted is None:
+                    return None
+                if granted < missing:
+                    self.denied += 1
+                    return False
+                self.remaining -= units
+                return True
+
+    def release(self, units: int):
+        """Give back units reserved for an operation that did not happen"""
+        with self._lock:
+            if self.doc_id == self.doc_id_fn():
+                self.remaining += units
+
+    def _renew(self, needed: int) -> Optional[int]:
+        """Reserve a new slice and add it to the local one (returns units granted)"""
+        doc_id = self.doc_id
+        try:
+            granted = _lease_budget_in_transaction(
+                self.tracker.db.db.transaction(), self._doc_ref(doc_id),
+                self.field, self.limit, needed, self.fraction, self.max_share
+            )
+            if granted is None:
+                # New period: create the usage documents, then retry once
+                self.tracker.get_current_operations()
+                self.tracker.get_current_storage()
+                granted = _lease_budget_in_transaction(
+                    self.tracker.db.db.transaction(), self._doc_ref(doc_id),
+                    self.field, self.limit, needed, self.fraction, self.max_share
+                )
+            if granted is None:
+                raise RuntimeError(f"Usage document {doc_id} is missing")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to lease {self.field} budget: {e}")
+            return None
+        with self._lock:
+            if self.doc_id == doc_id:
+                self.remaining += granted
+                self.last_grant = granted or self.last_grant
+                if granted < needed:
+                    # Don't ask again on every request while the budget is gone
+                    self._exhausted_until = time.monotonic() + self.retry_seconds
+        self.renewals += 1
+        return granted
+
+    def _prefetch(self):
+        """Renew in the background before the slice runs out; call with _lock held"""
+        if self._prefetching or time.monotonic() < self._exhausted_until:
+            return
+        self._prefetching = True
+
+        def renew():
+            try:
+                with self._renew_lock:
+                    self._renew(1)
+            finally:
+                self._prefetching = False
+
+        get_fanout_executor().submit(renew)
+
+    def discard(self):
+        """Drop the unspent slice without returning it (after the reservations were reset)"""
+        with self._lock:
+            self.remaining = 0
+            self.last_grant = 0
+            self._exhausted_until = 0.0
+
+    def close(self):
+        """Return the unspent slice so other workers can use it"""
+        with self._lock:
+            remaining, doc_id = self.remaining, self.doc_id
+            self.remaining = 0
+        if remaining and doc_id:
+            try:
+                self._doc_ref(doc_id).update({f"{self.field}_leased": firestore.Increment(-remaining)})
+            except Exception as e:
+                logger.error(f"Failed to return unspent {self.field} budget: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'period': self.doc_id,
+            'remaining': self.remaining,
+            'last_grant': self.last_grant,
+            'renewals': self.renewals,
+            'denied': self.denied,
+            'errors': self.errors,
+            'exhausted': time.monotonic() < self._exhausted_until,
+        }
+
+
 class UsageTracker:
     def __init__(self):
         self.env = os.getenv("ENV", "local").lower()
@@ -19,7 +448,46 @@ class UsageTracker:
             'storage_bytes': 10 * 1024 * 1024 * 1024,  # 10 GB in bytes (cumulative, never resets)
             'class_a_operations': 1_000_000,  # 1 million per month (resets monthly)
             'class_b_operations': 10_000_000,  # 10 million per month (resets monthly)
+            # Firestore free tier (resets daily)
+            'firestore_reads': 50_000,
+            'firestore_writes': 20_000,
         }
+        
+        # Count operations locally and flush them in batches
+        self.aggregator = None
+        if not self.disabled and os.getenv('USAGE_AGGREGATION_ENABLED', 'true').lower() == 'true':
+            self.aggregator = UsageAggregator(
+                self,
+                flush_interval=float(os.getenv('USAGE_FLUSH_SECONDS', 5)),
+                snapshot_ttl=float(os.getenv('USAGE_SNAPSHOT_TTL_SECONDS', 30))
+            )
+            register_metrics('usage_aggregator', self.aggregator.stats)
+        
+        # Worker-local slices of the global budgets, reserved in transactions
+        self.leases: Dict[str, BudgetLease] = {}
+        if self.aggregator and os.getenv('USAGE_LEASES_ENABLED', 'true').lower() == 'true':
+            fraction = float(os.getenv('USAGE_LEASE_FRACTION', 0.01))
+            max_share = float(os.getenv('USAGE_LEASE_MAX_SHARE', 0.001))
+            for field, doc_id_fn in (('class_a_operations', self.get_usage_document_id),
+                                     ('class_b_operations', self.get_usage_document_id),
+                                     ('storage_bytes', self.get_storage_document_id)):
+                self.leases[field] = BudgetLease(
+                    self, field, doc_id_fn, self.LIMITS[field], fraction=fraction, max_share=max_share
+                )
+                atexit.register(self.leases[field].close)
+            register_metrics('usage_leases', lambda: {field: lease.stats() for field, lease in self.leases.items()})
+        
+        # Backend operations are charged where they happen (storage backends, Firestore store)
+        self.route_operations: Dict[str, Dict[str, int]] = {}
+        if not self.disabled:
+            add_operation_sink(self.charge)
+            register_metrics('usage_by_route', lambda: dict(self.route_operations))
+        
+        # Hourly per-operation/per-endpoint buckets for capacity planning
+        self.history = None
+        if not self.disabled and os.getenv('USAGE_HISTORY_ENABLED', 'true').lower() == 'true':
+            self.history = UsageHistory(self.db.db, flush_interval=float(os.getenv('USAGE_HISTORY_FLUSH_SECONDS', 60)))
+            register_metrics('usage_history', self.history.stats)
     
     def get_current_month_key(self) -> str:
         """Generate a key for the current month (YYYY-MM format)"""
@@ -34,6 +502,18 @@ class UsageTracker:
         """Get the document ID for cumulative storage tracking"""
         return "storage_cumulative"
     
+    def get_firestore_document_id(self) -> str:
+        """Get the document ID for today's Firestore reads and writes"""
+        return f"{FIRESTORE_DOC_PREFIX}{datetime.now(timezone.utc).strftime('%Y-%m-%d')}"
+    
+    def get_document_id(self, field: str) -> str:
+        """Document holding a usage counter"""
+        if field == 'storage_bytes':
+            return self.get_storage_document_id()
+        if field.startswith('firestore_'):
+            return self.get_firestore_document_id()
+        return self.get_usage_document_id()
+    
     def initialize_monthly_usage(self) -> Dict:
         """Initialize usage document for the current month (operations only)"""
         doc_id = self.get_usage_document_id()
@@ -134,6 +614,21 @@ class UsageTracker:
             # Return safe defaults if database is unavailable
             return self.initialize_monthly_usage()
     
+    def get_current_firestore_usage(self) -> Dict:
+        """Get today's Firestore read and write counts"""
+        usage = {'firestore_reads': 0, 'firestore_writes': 0}
+        if self.disabled:
+            return usage
+        try:
+            doc = self.db.db.collection(self.collection_name).document(self.get_firestore_document_id()).get()
+            if doc.exists:
+                data = doc.to_dict()
+                usage['firestore_reads'] = data.get('firestore_reads', 0)
+                usage['firestore_writes'] = data.get('firestore_writes', 0)
+        except Exception as e:
+            logger.error(f"Failed to get Firestore usage: {e}")
+        return usage
+    
     def get_current_usage(self) -> Dict:
         """Get combined current usage (storage + operations)"""
         if self.disabled:
@@ -142,8 +637,13 @@ class UsageTracker:
                 'storage_bytes': 0,
                 'class_a_operations': 0,
                 'class_b_operations': 0,
+                'firestore_reads': 0,
+                'firestore_writes': 0,
             }
 
+        if self.aggregator:
+            return self.aggregator.current_usage()
+
         storage_bytes = self.get_current_storage()
         operations = self.get_current_operations()
         
@@ -154,13 +654,18 @@ class UsageTracker:
             'storage_bytes': storage_bytes,
             'class_a_operations': operations.get('class_a_operations', 0),
             'class_b_operations': operations.get('class_b_operations', 0),
-            'reset_date': operations.get('reset_date')
+            'reset_date': operations.get('reset_date'),
+            **self.get_current_firestore_usage()
         }
     
     def check_limits_before_operation(self, operation_type: str, additional_storage: int = 0) -> Tuple[bool, str, Dict]:
         """
         Check if operation would exceed limits
         
+        Only the R2 requests a route is known to make are checked here (uploads
+        write, downloads read); every backend call is charged, and refused once
+        a budget is gone, by charge() as it happens.
+        
         Args:
             operation_type: 'upload', 'download', 'list', 'delete', 'get_metadata'
             additional_storage: Additional storage bytes for upload operations
@@ -170,9 +675,16 @@ class UsageTracker:
         """
         current_usage = self.get_current_usage()
         
-        # Define operation types
-        class_a_ops = {'upload', 'delete', 'list'}  # PUT, DELETE, LIST operations
-        class_b_ops = {'download', 'get_metadata', 'get'}  # GET operations
+        if self.leases:
+            reserved, error_msg = self._reserve_budget(operation_type, additional_storage)
+            if error_msg:
+                return False, error_msg, current_usage
+            if reserved:
+                return True, "", current_usage
+        
+        # Define operation types (routes that call R2)
+        class_a_ops = {'upload'}  # PUT operations
+        class_b_ops = {'download'}  # GET operations
         
         # Check storage limit for uploads
         if operation_type == 'upload' and additional_storage > 0:
@@ -209,24 +721,108 @@ class UsageTracker:
         
         return True, "", current_usage
     
-    def record_operation(self, operation_type: str, storage_delta: int = 0) -> bool:
+    def _budget_units(self, operation_type: str, additional_storage: int = 0) -> Dict[str, int]:
+        """Budget units an operation needs, per limited counter"""
+        units = {}
+        if operation_type == 'upload' and additional_storage > 0:
+            units['storage_bytes'] = additional_storage
+        return units
+    
+    def _reserve_budget(self, operation_type: str, additional_storage: int = 0) -> Tuple[Optional[Dict], str]:
         """
-        Record an operation and update usage counters
+        Spend an operation's units from the worker's budget leases
+        
+        Returns:
+            Tuple of (reserved units or None when a lease is unavailable, error_message)
+        """
+        reserved = {}
+        for field, units in self._budget_units(operation_type, additional_storage).items():
+            allowed = self.leases[field].consume(units)
+            if allowed:
+                reserved[field] = units
+                continue
+            for reserved_field, reserved_units in reserved.items():
+                self.leases[reserved_field].release(reserved_units)
+            if allowed is None:
+                # No lease (e.g. Firestore unavailable): use the snapshot checks
+                return None, ""
+            if field == 'storage_bytes':
+                return None, (
+                    f"Storage limit exceeded. "
+                    f"Additional: {units / (1024 * 1024):.2f}MB, "
+                    f"Limit: {self.LIMITS[field] / (1024 * 1024 * 1024)}GB"
+                )
+            label = 'Class A' if field == 'class_a_operations' else 'Class B'
+            return None, f"{label} operations limit exceeded. Limit: {self.LIMITS[field]:,}"
+        return reserved, ""
+    
+    def release_reservation(self, operation_type: str, additional_storage: int = 0):
+        """Return the budget reserved by check_limits_before_operation for an operation that failed"""
+        for field, units in self._budget_units(operation_type, additional_storage).items():
+            if field in self.leases:
+                self.leases[field].release(units)
+    
+    def charge(self, field: str, count: int = 1):
+        """
+        Charge backend operations to a usage counter (operation sink)
+        
+        Raises:
+            UsageLimitExceeded: The R2 budget for this class is used up
+        """
+        lease = self.leases.get(field)
+        if lease is not None and lease.consume(count) is False:
+            label = 'Class A' if field == 'class_a_operations' else 'Class B'
+            raise UsageLimitExceeded(f"{label} operations limit exceeded. Limit: {self.LIMITS[field]:,}")
+        
+        doc_id = self.get_document_id(field)
+        if self.aggregator:
+            self.aggregator.add_delta(doc_id, field, count)
+            return
+        
+        try:
+            doc_ref = self.db.db.collection(self.collection_name).document(doc_id)
+            update = {field: firestore.Increment(count), 'last_updated': datetime.now(timezone.utc)}
+            queue = get_write_queue()
+            writer = queue.writer() if queue is not None else self.db.db.batch()
+            if doc_id.startswith(FIRESTORE_DOC_PREFIX):
+                writer.set(doc_ref, update, merge=True)
+            else:
+                writer.update(doc_ref, update)
+            writer.commit()
+        except Exception as e:
+            logger.error(f"Failed to charge {count} {field}: {e}")
+    
+    def record_operation(self, operation_type: str, storage_delta: int = 0,
+                         backend_operations: Optional[Dict] = None) -> bool:
+        """
+        Record a completed route-level operation
+        
+        Backend operations were already charged by the storage and database
+        layers as they happened; here they are only aggregated per route.
         
         Args:
             operation_type: Type of operation performed
             storage_delta: Change in storage (positive for upload, negative for delete)
+            backend_operations: (backend, operation) -> count made by the request
             
         Returns:
             bool: Success status
         """
         now = datetime.now(timezone.utc)
         
+        route = self.route_operations.setdefault(operation_type, {'requests': 0})
+        route['requests'] += 1
+        for field, count in summarize(backend_operations or {}).items():
+            route[field] = route.get(field, 0) + count
+        
+        if self.aggregator:
+            self.aggregator.add(storage_delta)
+            if storage_delta < 0 and 'storage_bytes' in self.leases:
+                # Freed storage goes back into the shared budget
+                self.aggregator.add_delta(self.get_storage_document_id(), 'storage_bytes_leased', storage_delta)
+            return True
+        
         try:
-            # Define operation types
-            class_a_ops = {'upload', 'delete', 'list'}
-            class_b_ops = {'download', 'get_metadata', 'get', 'search'}
-            
             # Update storage if there's a change
             if storage_delta != 0:
                 storage_doc_id = self.get_storage_document_id()
@@ -251,28 +847,6 @@ class UsageTracker:
                     
                     logger.info(f"Incremented storage by {storage_delta} bytes")
             
-            # Update operation counters
-            operations_doc_id = self.get_usage_document_id()
-            operations_doc_ref = self.db.db.collection(self.collection_name).document(operations_doc_id)
-            
-            update_data = {'last_updated': now}
-            
-            if operation_type in class_a_ops:
-                # Increment Class A operations
-                operations_doc_ref.update({
-                    'class_a_operations': firestore.Increment(1),
-                    **update_data
-                })
-                logger.info(f"Incremented Class A operations for {operation_type}")
-                
-            elif operation_type in class_b_ops:
-                # Increment Class B operations
-                operations_doc_ref.update({
-                    'class_b_operations': firestore.Increment(1),
-                    **update_data
-                })
-                logger.info(f"Incremented Class B operations for {operation_type}")
-            
             logger.info(f"Recorded {operation_type} operation with storage_delta={storage_delta}")
             return True
             
@@ -280,6 +854,31 @@ class UsageTracker:
             logger.error(f"Failed to record operation {operation_type}: {e}")
             return False
     
+    def record_history(self, operation_type: str, endpoint: Optional[str], status_code: int,
+                       backend_operations: Optional[Dict] = None, bytes_in: int = 0, bytes_out: int = 0,
+                       storage_delta: int = 0):
+        """Add a handled request to the current hourly usage bucket"""
+        if self.history is None:
+            return
+        self.history.record(operation_type, endpoint, {
+            'requests': 1,
+            'errors': 1 if status_code >= 400 else 0,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'storage_delta': storage_delta,
+            **summarize(backend_operations or {}),
+        })
+    
+    def get_usage_projection(self) -> Dict:
+        """Linear end-of-period projection for every limit"""
+        month_storage_delta = None
+        if self.history is not None:
+            try:
+                month_storage_delta = self.history.month_storage_delta()
+            except Exception as e:
+                logger.error(f"Failed to read this month's storage growth: {e}")
+        return project_month_end(self.get_current_usage(), self.LIMITS, month_storage_delta)
+    
     def get_usage_stats(self) -> Dict:
         """Get detailed usage statistics with percentages and limits"""
         current_usage = self.get_current_usage()
@@ -312,6 +911,16 @@ class UsageTracker:
                 'percentage_used': round((current_usage['class_b_operations'] / self.LIMITS['class_b_operations']) * 100, 2),
                 'remaining': self.LIMITS['class_b_operations'] - current_usage['class_b_operations'],
                 'note': 'Resets monthly on the 1st'
+            },
+            'firestore': {
+                'day': self.get_firestore_document_id()[len(FIRESTORE_DOC_PREFIX):],
+                'reads': current_usage['firestore_reads'],
+                'writes': current_usage['firestore_writes'],
+                'read_limit': self.LIMITS['firestore_reads'],
+                'write_limit': self.LIMITS['firestore_writes'],
+                'reads_percentage_used': round((current_usage['firestore_reads'] / self.LIMITS['firestore_reads']) * 100, 2),
+                'writes_percentage_used': round((current_usage['firestore_writes'] / self.LIMITS['firestore_writes']) * 100, 2),
+                'note': 'Resets daily at midnight UTC; reported, not enforced'
             }
         }
         
@@ -325,10 +934,14 @@ class UsageTracker:
             'storage': stats['storage']['percentage_used'] >= threshold_percentage,
             'class_a': stats['class_a_operations']['percentage_used'] >= threshold_percentage,
             'class_b': stats['class_b_operations']['percentage_used'] >= threshold_percentage,
+            'firestore': max(stats['firestore']['reads_percentage_used'],
+                             stats['firestore']['writes_percentage_used']) >= threshold_percentage,
             'any_near_limit': any([
                 stats['storage']['percentage_used'] >= threshold_percentage,
                 stats['class_a_operations']['percentage_used'] >= threshold_percentage,
                 stats['class_b_operations']['percentage_used'] >= threshold_percentage,
+                stats['firestore']['reads_percentage_used'] >= threshold_percentage,
+                stats['firestore']['writes_percentage_used'] >= threshold_percentage,
             ])
         }
     
@@ -358,6 +971,8 @@ class UsageTracker:
             }
             
             self.db.db.collection(self.collection_name).document(doc_id).set(reset_data)
+            if self.aggregator:
+                self.aggregator.invalidate()
             logger.info(f"Reset operations for month: {month_key} (storage unchanged)")
             return True
             
@@ -378,12 +993,20 @@ class UsageTracker:
         try:
             reset_data = {
                 'storage_bytes': new_storage_value,
+                # Reservations restart from the synced value; slices other
+                # workers still hold are forgotten (returning them later
+                # can't drop the total below storage_bytes)
+                'storage_bytes_leased': new_storage_value,
                 'last_updated': datetime.now(timezone.utc),
                 'manually_reset': True,
                 'reset_reason': 'Manual storage sync to match actual bucket usage'
             }
             
             self.db.db.collection(self.collection_name).document(doc_id).set(reset_data, merge=True)
+            if 'storage_bytes' in self.leases:
+                self.leases['storage_bytes'].discard()
+            if self.aggregator:
+                self.aggregator.invalidate()
             logger.info(f"Manually set storage to: {new_storage_value} bytes")
             return True
             
@@ -414,14 +1037,16 @@ def track_usage(operation_type: str, check_limits: bool = True):
         def wrapper(*args, **kwargs):
             tracker = get_usage_tracker()
 
+            # Async views run through Flask's sync bridge
+            view = current_app.ensure_sync(func)
+
             if tracker.disabled:
-                return func(*args, **kwargs)
+                return view(*args, **kwargs)
             
             # For upload operations, we need to check the file size
             additional_storage = 0
             if operation_type == 'upload' and check_limits:
                 # Try to extract file size from request
-                from flask import request
                 if 'file' in request.files:
                     file = request.files['file']
                     # Get file size by seeking to end
@@ -446,7 +1071,6 @@ def track_usage(operation_type: str, check_limits: bool = True):
                     
                     # Method 3: Extract from Flask request path
                     if not note_id:
-                        from flask import request
                         path_parts = request.path.split('/')
                         if 'delete' in path_parts:
                             delete_index = path_parts.index('delete')
@@ -481,8 +1105,26 @@ def track_usage(operation_type: str, check_limits: bool = True):
                         'usage_stats': tracker.get_usage_stats()
                     }), 429  # Too Many Requests
             
-            # Execute the original function
-            result = func(*args, **kwargs)
+            # Execute the original function, collecting the backend operations it makes
+            try:
+                with operation_scope() as backend_operations:
+                    result = view(*args, **kwargs)
+            except UsageLimitExceeded as e:
+                # A storage call was refused mid-request
+                if check_limits:
+                    tracker.release_reservation(operation_type, additional_storage)
+                tracker.record_history(operation_type, request.endpoint, 429, backend_operations,
+                                       bytes_in=request.content_length or 0)
+                from flask import jsonify
+                return jsonify({
+                    'error': f'Usage limit exceeded: {e}',
+                    'code': 'USAGE_LIMIT_EXCEEDED',
+                    'usage_stats': tracker.get_usage_stats()
+                }), 429
+            except Exception:
+                if check_limits:
+                    tracker.release_reservation(operation_type, additional_storage)
+                raise
             
             # Determine if operation was successful
             status_code = 200
@@ -503,8 +1145,18 @@ def track_usage(operation_type: str, check_limits: bool = True):
                     final_storage_delta = storage_delta  # Already calculated above
                 
                 # Record the operation with appropriate storage delta
-                tracker.record_operation(operation_type, final_storage_delta)
+                tracker.record_operation(operation_type, final_storage_delta, backend_operations)
                 print(f"✅ Recorded {operation_type} operation with storage delta: {final_storage_delta}")
+            elif check_limits:
+                tracker.release_reservation(operation_type, additional_storage)
+            
+            response = result[0] if isinstance(result, tuple) else result
+            tracker.record_history(
+                operation_type, request.endpoint, status_code, backend_operations,
+                bytes_in=request.content_length or 0,
+                bytes_out=getattr(response, 'content_length', None) or 0,
+                storage_delta=final_storage_delta if status_code < 400 else 0
+            )
             
             return result
         
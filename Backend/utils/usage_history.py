@@ -0,0 +1,363 @@
+# Backend/utils/usage_history.py
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import atexit
+import calendar
+import logging
+import threading
+import time
+
+from firebase_admin import firestore
+
+from utils.cache import TTLCache
+from utils.operations import record_backend_operation
+from utils.write_queue import get_write_queue
+
+logger = logging.getLogger(__name__)
+
+HOURLY_COLLECTION = 'usage_history_hourly'   # YYYY-MM-DDTHH, written by UsageHistory.flush
+DAILY_COLLECTION = 'usage_history_daily'     # YYYY-MM-DD, written by rollup_day
+MONTHLY_COLLECTION = 'usage_history_monthly'  # YYYY-MM, written by rollup_month
+
+# Counters kept per operation type and per endpoint in every bucket
+METRICS = ('requests', 'errors', 'bytes_in', 'bytes_out', 'storage_delta',
+           'class_a_operations', 'class_b_operations', 'firestore_reads', 'firestore_writes')
+
+# Longest series the history endpoint returns, per granularity
+MAX_PERIODS = {'hour': 168, 'day': 92, 'month': 24}
+
+
+def hour_key(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H')
+
+
+def _add_counts(target: Dict, source: Dict):
+    """Sum nested {section: {name: {metric: n}}} counts into target"""
+    for section in ('routes', 'endpoints'):
+        for name, counts in (source.get(section) or {}).items():
+            bucket = target.setdefault(section, {}).setdefault(name, {})
+            for metric, value in counts.items():
+                bucket[metric] = bucket.get(metric, 0) + value
+
+
+def _totals(bucket: Dict) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for counts in (bucket.get('routes') or {}).values():
+        for metric, value in counts.items():
+            totals[metric] = totals.get(metric, 0) + value
+    return totals
+
+
+class UsageHistory:
+    """
+    Hourly usage buckets for capacity planning.
+
+    Every tracked request adds its counts (requests, errors, bytes in and
+    out, storage delta and the billed backend operations it made) under its
+    operation type and its Flask endpoint in the current hour's bucket.
+    Buckets are kept in memory and merged into one document per hour with
+    Increment transforms every flush_interval seconds, so a busy hour costs
+    one write per worker per flush. Daily and monthly documents are rolled
+    up from the hourly ones by rollup() (see run_usage_rollup).
+    """
+
+    def __init__(self, db, flush_interval: float = 60.0):
+        self.db = db
+        self.flush_interval = flush_interval
+
+        # hour key -> {(section, name, metric): delta}
+        self._pending: Dict[str, Dict[Tuple[str, str, str], int]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        # Dashboards poll the series; a minute of staleness is fine
+        self._series_cache = TTLCache(max_entries=32, ttl_seconds=60.0, name='usage_history_series')
+
+        self.recorded = 0
+        self.flushes = 0
+        self.failures = 0
+        self.rollups = 0
+        self.last_flush_at = None
+
+        self._thread = threading.Thread(target=self._run, name='usage-history-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, operation_type: str, endpoint: Optional[str], counts: Dict[str, int]):
+        """Add one request's counts to the current hour"""
+        key = hour_key(datetime.now(timezone.utc))
+        # Map keys are literal in set(), but keep endpoint names free of path separators anyway
+        names = [('routes', operation_type)]
+        if endpoint:
+            names.append(('endpoints', endpoint.replace('.', ':')))
+        with self._lock:
+            bucket = self._pending.setdefault(key, {})
+            for section, name in names:
+                for metric in METRICS:
+                    value = counts.get(metric)
+                    if value:
+                        field = (section, name, metric)
+                        bucket[field] = bucket.get(field, 0) + value
+            self.recorded += 1
+
+    def flush(self) -> int:
+        """
+        Merge pending counts into the hourly documents
+
+        Returns:
+            int: Number of hourly documents written
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return 0
+
+        with self._flush_lock:
+            try:
+                now = datetime.now(timezone.utc)
+                queue = get_write_queue()
+                writer = queue.writer() if queue is not None else self.db.batch()
+                collection = self.db.collection(HOURLY_COLLECTION)
+                for key, fields in pending.items():
+                    data = {
+                        'start': datetime.strptime(key, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc),
+                        'last_updated': now,
+                    }
+                    for (section, name, metric), delta in fields.items():
+                        data.setdefault(section, {}).setdefault(name, {})[metric] = firestore.Increment(delta)
+                    writer.set(collection.document(key), data, merge=True)
+                if queue is None:
+                    record_backend_operation('firestore', 'write', len(pending))
+                writer.commit()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Failed to flush usage history, re-queueing: {e}")
+                with self._lock:
+                    for key, fields in pending.items():
+                        bucket = self._pending.setdefault(key, {})
+                        for field, delta in fields.items():
+                            bucket[field] = bucket.get(field, 0) + delta
+                return 0
+
+        self.flushes += 1
+        self.last_flush_at = time.time()
+        return len(pending)
+
+    def _get_all(self, collection: str, keys: List[str]) -> Dict[str, Dict]:
+        if not keys:
+            return {}
+        refs = [self.db.collection(collection).document(key) for key in keys]
+        record_backend_operation('firestore', 'read', len(refs))
+        return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+    def rollup_day(self, day: date) -> Dict:
+        """Sum a day's hourly buckets into its daily document"""
+        hours = [f"{day.isoformat()}T{hour:02d}" for hour in range(24)]
+        rolled = {}
+        found = self._get_all(HOURLY_COLLECTION, hours)
+        for bucket in found.values():
+            _add_counts(rolled, bucket)
+        rolled.update({
+            'start': datetime(day.year, day.month, day.day, tzinfo=timezone.utc),
+            'hours': len(found),
+            'rolled_up_at': datetime.now(timezone.utc),
+        })
+        record_backend_operation('firestore', 'write')
+        self.db.collection(DAILY_COLLECTION).document(day.isoformat()).set(rolled)
+        return rolled
+
+    def rollup_month(self, year: int, month: int) -> Dict:
+        """Sum a month's daily documents into its monthly document"""
+        days = [date(year, month, day).isoformat() for day in range(1, calendar.monthrange(year, month)[1] + 1)]
+        rolled = {}
+        found = self._get_all(DAILY_COLLECTION, days)
+        for bucket in found.values():
+            _add_counts(rolled, bucket)
+        rolled.update({
+            'start': datetime(year, month, 1, tzinfo=timezone.utc),
+            'days': len(found),
+            'rolled_up_at': datetime.now(timezone.utc),
+        })
+        record_backend_operation('firestore', 'write')
+        self.db.collection(MONTHLY_COLLECTION).document(f"{year}-{month:02d}").set(rolled)
+        return rolled
+
+    def rollup(self, now: Optional[datetime] = None):
+        """
+        Roll up today and yesterday (late flushes land in the previous day)
+        and the months they belong to; rerunning is harmless
+        """
+        today = (now or datetime.now(timezone.utc)).date()
+        yesterday = today - timedelta(days=1)
+        for day in (yesterday, today):
+            self.rollup_day(day)
+        for year, month in sorted({(yesterday.year, yesterday.month), (today.year, today.month)}):
+            self.rollup_month(year, month)
+        self.rollups += 1
+
+    def series(self, granularity: str = 'hour', periods: Optional[int] = None,
+               now: Optional[datetime] = None) -> List[Dict]:
+        """
+        The last `periods` buckets, oldest first (missing buckets are zero)
+
+        Daily and monthly buckets include the current period up to its last rollup.
+        """
+        if granularity not in MAX_PERIODS:
+            raise ValueError(f"granularity must be one of: {', '.join(MAX_PERIODS)}")
+        default = MAX_PERIODS[granularity] // 3
+        periods = max(1, min(int(periods or default), MAX_PERIODS[granularity]))
+        if now is not None:
+            return self._series(granularity, periods, now)
+
+        # Every length is cut from one of two cached series per granularity,
+        # so varying `periods` can't force reads
+        fetched = default if periods <= default else MAX_PERIODS[granularity]
+        series = self._series_cache.get((granularity, fetched))
+        if series is None:
+            series = self._series(granularity, fetched, datetime.now(timezone.utc))
+            self._series_cache.set((granularity, fetched), series)
+        return series[-periods:]
+
+    def _series(self, granularity: str, periods: int, now: datetime) -> List[Dict]:
+
+        if granularity == 'hour':
+            current = now.replace(minute=0, second=0, microsecond=0)
+            keys = [hour_key(current - timedelta(hours=offset)) for offset in range(periods - 1, -1, -1)]
+            collection = HOURLY_COLLECTION
+        elif granularity == 'day':
+            keys = [(now.date() - timedelta(days=offset)).isoformat() for offset in range(periods - 1, -1, -1)]
+            collection = DAILY_COLLECTION
+        else:
+            year, month = now.year, now.month
+            keys = []
+            for _ in range(periods):
+                keys.append(f"{year}-{month:02d}")
+                year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+            keys.reverse()
+            collection = MONTHLY_COLLECTION
+
+        found = self._get_all(collection, keys)
+        series = []
+        for key in keys:
+            bucket = found.get(key) or {}
+            series.append({
+                'period': key,
+                'totals': _totals(bucket),
+                'routes': bucket.get('routes', {}),
+                'endpoints': bucket.get('endpoints', {}),
+            })
+        return series
+
+    def month_storage_delta(self, now: Optional[datetime] = None) -> Optional[int]:
+        """Net storage change this month as of the last rollup (None before the first one)"""
+        now = now or datetime.now(timezone.utc)
+        key = f"{now.year}-{now.month:02d}"
+        cached = self._series_cache.get(('storage_delta', key))
+        if cached is not None:
+            return cached[0]
+        found = self._get_all(MONTHLY_COLLECTION, [key])
+        delta = _totals(found[key]).get('storage_delta', 0) if key in found else None
+        self._series_cache.set(('storage_delta', key), (delta,))
+        return delta
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Usage history error: {e}")
+
+    def close(self):
+        """Stop the background flusher and write what is left"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = sum(len(fields) for fields in self._pending.values())
+        return {
+            'recorded_requests': self.recorded,
+            'pending_counters': pending,
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'rollups': self.rollups,
+            'last_flush_at': self.last_flush_at,
+            'flush_interval': self.flush_interval,
+        }
+
+
+def project_month_end(usage: Dict, limits: Dict, month_storage_delta: Optional[int] = None,
+                      now: Optional[datetime] = None) -> Dict[str, Dict]:
+    """
+    Linear projection of every limit to the end of its period
+
+    Monthly operation counts are extrapolated from the rate so far this
+    month, Firestore counts from the rate so far today, and cumulative
+    storage from this month's net growth (flat when unknown).
+    """
+    now = now or datetime.now(timezone.utc)
+    month_start = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    month_end = month_start + timedelta(days=calendar.monthrange(now.year, now.month)[1])
+    day_start = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    day_end = day_start + timedelta(days=1)
+
+    def project(used: float, start: datetime, end: datetime, limit: int, period: str, base: float = 0) -> Dict:
+        elapsed = max((now - start).total_seconds(), 60.0)
+        rate = used / elapsed
+        projected = base + used + rate * (end - now).total_seconds()
+        result = {
+            'period': period,
+            'used': base + used,
+            'projected': int(projected),
+            'limit': limit,
+            'projected_percentage': round(projected / limit * 100, 2) if limit else None,
+            'exceeds_limit': projected > limit,
+            'limit_reached_at': None,
+        }
+        if projected > limit and rate > 0:
+            seconds_left = max(0.0, (limit - base - used) / rate)
+            result['limit_reached_at'] = (now + timedelta(seconds=seconds_left)).isoformat()
+        return result
+
+    projection = {
+        field: project(usage.get(field, 0), month_start, month_end, limits[field], 'month')
+        for field in ('class_a_operations', 'class_b_operations')
+    }
+    projection.update({
+        field: project(usage.get(field, 0), day_start, day_end, limits[field], 'day')
+        for field in ('firestore_reads', 'firestore_writes')
+    })
+    storage = usage.get('storage_bytes', 0)
+    growth = month_storage_delta or 0
+    projection['storage_bytes'] = project(growth, month_start, month_end, limits['storage_bytes'],
+                                          'cumulative', base=storage - growth)
+    return projection
+
+
+def run_usage_rollup(interval: float = 3600.0, once: bool = False):
+    """Roll hourly usage buckets up into daily and monthly documents every `interval` seconds"""
+    from utils.usage_db import get_usage_tracker
+
+    tracker = get_usage_tracker()
+    if tracker.history is None:
+        logger.warning("Usage history is disabled; nothing to roll up")
+        return
+    while True:
+        started = time.monotonic()
+        try:
+            tracker.history.flush()
+            tracker.history.rollup()
+            logger.info("Rolled up usage history")
+        except Exception as e:
+            logger.error(f"Usage rollup failed: {e}")
+        if once:
+            return
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
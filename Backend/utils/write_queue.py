@@ -0,0 +1,450 @@
+# Backend/utils/write_queue.py
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from google.api_core.exceptions import (
+    AlreadyExists, Conflict, FailedPrecondition, InvalidArgument, NotFound
+)
+from typing import Any, Callable, Dict, List, Optional
+import atexit
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.metrics import register_metrics
+from utils.operations import record_backend_operation
+
+logger = logging.getLogger(__name__)
+
+# Firestore allows 500 writes per batch; one is the idempotency receipt
+MAX_BATCH_WRITES = 499
+
+# Receipts of committed batches; give the collection a TTL policy on expire_at
+RECEIPTS_COLLECTION = 'write_queue_receipts'
+RECEIPT_RETENTION_DAYS = 7
+
+# A claimed batch is retried by anyone after this long (covers crashed flushers)
+CLAIM_LEASE_SECONDS = 60
+MAX_BACKOFF_SECONDS = 300
+MAX_ATTEMPTS = 20
+
+# Errors that prove a commit was rejected (nothing was applied)
+DEFINITIVE_ERRORS = (NotFound, InvalidArgument, FailedPrecondition)
+
+
+def _encode(value: Any) -> Any:
+    """JSON-safe form of a Firestore write payload (transforms become markers)"""
+    if value is firestore.SERVER_TIMESTAMP:
+        return {'__wq__': 'server_timestamp'}
+    if isinstance(value, firestore.Increment):
+        return {'__wq__': 'increment', 'value': value.value}
+    if isinstance(value, datetime):
+        return {'__wq__': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        marker = value.get('__wq__')
+        if marker == 'server_timestamp':
+            return firestore.SERVER_TIMESTAMP
+        if marker == 'increment':
+            return firestore.Increment(value['value'])
+        if marker == 'datetime':
+            return datetime.fromisoformat(value['value'])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class QueuedWriter:
+    """
+    WriteBatch look-alike that records writes for the queue.
+
+    Writes recorded on one writer form a group: they are enqueued in a single
+    SQLite transaction on commit() and always sent to Firestore in the same
+    batch, so they stay atomic with each other.
+    """
+
+    def __init__(self, queue: 'WriteQueue', group_id: Optional[str] = None):
+        self.queue = queue
+        self.group_id = group_id or uuid.uuid4().hex
+        self.ops: List[tuple] = []
+
+    def set(self, doc_ref, data: Dict, merge: bool = False):
+        self.ops.append(('set', doc_ref.path, _encode(data), int(bool(merge))))
+
+    def update(self, doc_ref, data: Dict):
+        self.ops.append(('update', doc_ref.path, _encode(data), 0))
+
+    def create(self, doc_ref, data: Dict):
+        self.ops.append(('create', doc_ref.path, _encode(data), 0))
+
+    def delete(self, doc_ref):
+        self.ops.append(('delete', doc_ref.path, None, 0))
+
+    def commit(self) -> bool:
+        """Durably enqueue the recorded writes (False if this group id was already queued)"""
+        return self.queue.enqueue([self]) > 0
+
+
+class WriteQueue:
+    """
+    Durable write-behind queue for non-critical Firestore writes.
+
+    Requests record writes through writer() and return as soon as they are
+    in a local SQLite file; a background thread drains the file with batched
+    commits. Each Firestore batch also creates a receipt document named after
+    the batch, so a batch that is replayed after a lost acknowledgement (or by
+    another worker) fails with AlreadyExists instead of applying its
+    increments twice. Transient failures back off exponentially; a batch
+    rejected outright is split into its groups so one bad write (e.g. an
+    update to a deleted document) cannot hold up the rest.
+    """
+
+    def __init__(self, db, path: str, flush_interval: float = 2.0):
+        self.db = db
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        self.batches = 0
+        self.flushed = 0
+        self.replayed = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_flush_at = None
+        self.last_error = None
+        self._settle_listeners: List[Callable[[List[str], bool], None]] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS ops (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            data TEXT,
+            merge INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            batch_id TEXT,
+            solo INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            dead INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (group_id, seq)
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS ops_ready ON ops (dead, next_attempt_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ops_batch ON ops (batch_id)')
+
+        self._thread = threading.Thread(target=self._run, name='write-queue-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ----------------------------------------------------------------- enqueue
+
+    def writer(self, group_id: Optional[str] = None) -> QueuedWriter:
+        """
+        Start a group of writes
+
+        Args:
+            group_id: Idempotency key; enqueueing the same id twice is a no-op
+        """
+        return QueuedWriter(self, group_id)
+
+    def enqueue(self, writers: List[QueuedWriter]) -> int:
+        """
+        Durably enqueue several groups in one SQLite transaction
+
+        Returns:
+            int: Number of groups that were not already queued
+        """
+        now = time.time()
+        rows = []
+        for writer in writers:
+            if len(writer.ops) > MAX_BATCH_WRITES:
+                raise ValueError(f"A write group is limited to {MAX_BATCH_WRITES} writes")
+            rows.append([
+                (writer.group_id, seq, kind, path, None if data is None else json.dumps(data), merge, now)
+                for seq, (kind, path, data, merge) in enumerate(writer.ops)
+            ])
+        added = 0
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for group_rows in rows:
+                cursor = conn.executemany(
+                    'INSERT OR IGNORE INTO ops (group_id, seq, kind, path, data, merge, enqueued_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', group_rows
+                )
+                added += cursor.rowcount > 0
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def add_settle_listener(self, listener: Callable[[List[str], bool], None]):
+        """
+        Be told when groups leave the queue in this process
+
+        listener(group_ids, committed) is called after a batch is committed
+        (or found already committed), and with committed=False when its
+        groups are dropped or dead-lettered. Groups flushed by another
+        worker's queue thread are not reported; use queued_groups() for those.
+        """
+        self._settle_listeners.append(listener)
+
+    def queued_groups(self, group_ids: List[str]) -> set:
+        """The subset of group_ids still waiting to be committed"""
+        found = set()
+        for i in range(0, len(group_ids), 500):
+            chunk = group_ids[i:i + 500]
+            found.update(row[0] for row in self._conn().execute(
+                f'SELECT DISTINCT group_id FROM ops WHERE dead = 0 AND group_id IN ({",".join("?" * len(chunk))})',
+                chunk
+            ))
+        return found
+
+    def _settled(self, rows: List[tuple], committed: bool):
+        group_ids = list({row[1] for row in rows})
+        for listener in self._settle_listeners:
+            try:
+                listener(group_ids, committed)
+            except Exception as e:
+                logger.error(f"Write queue settle listener failed: {e}")
+
+    # ------------------------------------------------------------------- flush
+
+    def _claim(self) -> Optional[tuple]:
+        """
+        Reserve the next batch: a retry of an earlier batch, or fresh groups
+
+        Returns:
+            tuple: (batch_id, rows) or None when nothing is ready
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT batch_id FROM ops WHERE dead = 0 AND batch_id IS NOT NULL AND next_attempt_at <= ? '
+                'ORDER BY id LIMIT 1', (now,)
+            ).fetchone()
+            if row:
+                batch_id = row[0]
+            else:
+                groups = conn.execute(
+                    'SELECT group_id, COUNT(*), MAX(solo) FROM ops '
+                    'WHERE dead = 0 AND batch_id IS NULL AND next_attempt_at <= ? '
+                    'GROUP BY group_id ORDER BY MIN(id) LIMIT ?', (now, MAX_BATCH_WRITES)
+                ).fetchall()
+                chosen, size = [], 0
+                for group_id, count, solo in groups:
+                    if chosen and (solo or size + count > MAX_BATCH_WRITES):
+                        break
+                    chosen.append(group_id)
+                    size += count
+                    if solo:
+                        break
+                if not chosen:
+                    conn.execute('COMMIT')
+                    return None
+                batch_id = uuid.uuid4().hex
+                conn.execute(
+                    f'UPDATE ops SET batch_id = ? WHERE batch_id IS NULL AND group_id IN ({",".join("?" * len(chosen))})',
+                    (batch_id, *chosen)
+                )
+            conn.execute('UPDATE ops SET next_attempt_at = ? WHERE batch_id = ?', (now + CLAIM_LEASE_SECONDS, batch_id))
+            rows = conn.execute(
+                'SELECT id, group_id, kind, path, data, merge, attempts, enqueued_at FROM ops '
+                'WHERE batch_id = ? ORDER BY id', (batch_id,)
+            ).fetchall()
+            conn.execute('COMMIT')
+            return batch_id, rows
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _commit_batch(self, batch_id: str, rows: List[tuple]):
+        batch = self.db.batch()
+        for _, _, kind, path, data, merge, _, _ in rows:
+            doc_ref = self.db.document(path)
+            if kind == 'delete':
+                batch.delete(doc_ref)
+                continue
+            payload = _decode(json.loads(data))
+            if kind == 'set':
+                batch.set(doc_ref, payload, merge=bool(merge))
+            elif kind == 'update':
+                batch.update(doc_ref, payload)
+            else:
+                batch.create(doc_ref, payload)
+        record_backend_operation('firestore', 'write', len(rows) + 1)
+        batch.create(self.db.collection(RECEIPTS_COLLECTION).document(batch_id), {
+            'committed_at': firestore.SERVER_TIMESTAMP,
+            'writes': len(rows),
+            'expire_at': datetime.now(timezone.utc) + timedelta(days=RECEIPT_RETENTION_DAYS),
+        })
+        batch.commit()
+
+    def _done(self, batch_id: str):
+        self._conn().execute('DELETE FROM ops WHERE batch_id = ?', (batch_id,))
+
+    def _failed(self, batch_id: str, rows: List[tuple], error: Exception):
+        conn = self._conn()
+        groups = {row[1] for row in rows}
+        message = str(error)[:500]
+
+        if isinstance(error, DEFINITIVE_ERRORS):
+            if len(groups) > 1:
+                # Retry each group in its own batch to isolate the bad write
+                conn.execute(
+                    'UPDATE ops SET batch_id = NULL, solo = 1, next_attempt_at = 0, last_error = ? WHERE batch_id = ?',
+                    (message, batch_id)
+                )
+                return
+            if isinstance(error, NotFound):
+                # e.g. a counter update for a note deleted in the meantime
+                logger.info(f"Dropping queued writes for a missing document: {message}")
+                self.dropped += len(rows)
+                self._done(batch_id)
+                self._settled(rows, committed=False)
+                return
+            logger.error(f"Queued write rejected, moving to dead letters: {message}")
+            conn.execute('UPDATE ops SET dead = 1, last_error = ? WHERE batch_id = ?', (message, batch_id))
+            self._settled(rows, committed=False)
+            return
+
+        attempts = max(row[6] for row in rows) + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(f"Queued write failed {attempts} times, moving to dead letters: {message}")
+            conn.execute('UPDATE ops SET dead = 1, last_error = ? WHERE batch_id = ?', (message, batch_id))
+            self._settled(rows, committed=False)
+            return
+        delay = min(MAX_BACKOFF_SECONDS, 2 ** attempts) * random.uniform(0.5, 1.0)
+        conn.execute(
+            'UPDATE ops SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE batch_id = ?',
+            (attempts, time.time() + delay, message, batch_id)
+        )
+
+    def flush(self, max_batches: int = 100) -> int:
+        """
+        Drain ready writes
+
+        Returns:
+            int: Number of writes committed
+        """
+        written = 0
+        with self._flush_lock:
+            for _ in range(max_batches):
+                claimed = self._claim()
+                if claimed is None:
+                    break
+                batch_id, rows = claimed
+                try:
+                    self._commit_batch(batch_id, rows)
+                    written += len(rows)
+                    self.flushed += len(rows)
+                    self.batches += 1
+                except (AlreadyExists, Conflict):
+                    # The receipt exists: this batch was committed before
+                    self.replayed += 1
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = str(e)[:500]
+                    logger.warning(f"Write queue batch failed: {e}")
+                    self._failed(batch_id, rows, e)
+                    if not isinstance(e, DEFINITIVE_ERRORS):
+                        break
+                    continue
+                self._done(batch_id)
+                self._settled(rows, committed=True)
+            self.last_flush_at = time.time()
+        return written
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write queue flush error: {e}")
+
+    def close(self):
+        """Stop the background flusher and try to drain what is ready"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Write queue final flush failed (writes stay queued on disk): {e}")
+
+    def stats(self) -> Dict:
+        depth, dead, oldest = self._conn().execute(
+            'SELECT COALESCE(SUM(dead = 0), 0), COALESCE(SUM(dead = 1), 0), MIN(CASE WHEN dead = 0 THEN enqueued_at END) '
+            'FROM ops'
+        ).fetchone()
+        return {
+            'depth': depth,
+            'dead_letters': dead,
+            'flush_lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'batches': self.batches,
+            'flushed': self.flushed,
+            'replayed_batches': self.replayed,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_flush_at': self.last_flush_at,
+            'flush_interval': self.flush_interval,
+        }
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> Optional[WriteQueue]:
+    """Get the write-behind queue, or None when WRITE_QUEUE_PATH is not set (writes stay synchronous)"""
+    global _write_queue
+    path = os.getenv('WRITE_QUEUE_PATH')
+    if not path:
+        return None
+    if _write_queue is None:
+        with _write_queue_lock:
+            if _write_queue is None:
+                queue = WriteQueue(
+                    firestore.client(),
+                    path,
+                    flush_interval=float(os.getenv('WRITE_QUEUE_FLUSH_SECONDS', 2))
+                )
+                register_metrics('write_queue', queue.stats)
+                _write_queue = queue
+    return _write_queue